@@ -0,0 +1,596 @@
+import datetime as dt
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import GPU_query_db as db
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "gpu"))
+from GPU_logger import (  # noqa: E402
+    HISTORY_TIERS,
+    SCHEMA_INDEXES,
+    connect_database,
+    initialize_database,
+    migrate_database,
+    rollup_history,
+)
+
+
+def make_history_database(
+    db_path: str,
+    days: int = 30,
+    n_gpus: int = 8,
+    n_users: int = 4,
+    end_time: dt.datetime = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc),
+    legacy: bool = False,
+) -> None:
+    """
+    生成合成的 GPU 数据库：最近 1 小时的 1 秒实时数据和 days 天的 30 秒历史数据。
+
+    Args:
+        db_path (str): SQLite 数据库路径。
+        days (int): 历史数据天数。
+        n_gpus (int): GPU 数量。
+        n_users (int): 每张 GPU 上的用户数量。
+        end_time (datetime): 数据的结束时间。
+        legacy (bool): 是否生成旧版本（TEXT 时间戳、单列索引）的数据库。
+    """
+    initialize_database(db_path)
+    conn = sqlite3.connect(db_path)
+    rng = np.random.default_rng(0)
+    end = int(end_time.timestamp())
+
+    def timestamps(epochs):
+        if legacy:
+            return [
+                dt.datetime.fromtimestamp(t, tz=dt.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+                for t in epochs
+            ]
+        return epochs.tolist()
+
+    with conn:
+        if legacy:
+            for name, _, _ in SCHEMA_INDEXES:
+                conn.execute(f"DROP INDEX {name}")
+            for table in ("gpu_info", "gpu_user_info", "gpu_history", "gpu_user_history"):
+                conn.execute(f"CREATE INDEX idx_{table}_timestamp ON {table} (timestamp)")
+                conn.execute(f"CREATE INDEX idx_{table}_gpu_index ON {table} (gpu_index)")
+            for _, suffix, _ in HISTORY_TIERS[1:]:
+                conn.execute(f"CREATE INDEX idx_gpu_history{suffix}_timestamp ON gpu_history{suffix} (timestamp)")
+                conn.execute(f"CREATE INDEX idx_user_history{suffix}_timestamp ON gpu_user_history{suffix} (timestamp)")
+            conn.execute("PRAGMA user_version = 0")
+
+        for table, period, n_rows in (("info", 1, 3600), ("history", 30, days * 2880)):
+            epochs = np.repeat(end - period * np.arange(n_rows)[::-1], n_gpus)
+            gpu_index = np.tile(np.arange(n_gpus), n_rows)
+            utilization = rng.uniform(0, 100, len(epochs))
+            memory = rng.uniform(0, 80 * 0x40000000, len(epochs))
+            ts = timestamps(epochs)
+            if table == "info":
+                conn.executemany(
+                    """
+                    INSERT INTO gpu_info (gpu_index, name, gpu_utilization, memory_utilization, total_memory, used_memory, free_memory, timestamp)
+                    VALUES (?, 'NVIDIA A100-SXM4-80GB', ?, 0, 85899345920, ?, 0, ?)
+                    """,
+                    zip(gpu_index.tolist(), utilization.round().tolist(), memory.round().tolist(), ts),
+                )
+            else:
+                conn.executemany(
+                    """
+                    INSERT INTO gpu_history (gpu_index, gpu_utilization, gpu_utilization_max, gpu_utilization_min, used_memory, used_memory_max, used_memory_min, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    zip(
+                        gpu_index.tolist(),
+                        utilization.tolist(),
+                        (utilization + 5).tolist(),
+                        (utilization - 5).tolist(),
+                        memory.tolist(),
+                        (memory * 1.05).tolist(),
+                        (memory * 0.95).tolist(),
+                        ts,
+                    ),
+                )
+            for u in range(n_users):
+                user_rows = zip(
+                    gpu_index.tolist(),
+                    [f"user{(u + i) % (2 * n_users)}" for i in gpu_index.tolist()],
+                    (memory / n_users).tolist(),
+                    (utilization / n_users).tolist(),
+                    ts,
+                )
+                if table == "info":
+                    conn.executemany(
+                        """
+                        INSERT INTO gpu_user_info (gpu_index, user, used_memory, gpu_utilization, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                        """,
+                        user_rows,
+                    )
+                else:
+                    conn.executemany(
+                        """
+                        INSERT INTO gpu_user_history (gpu_index, user, used_memory, used_memory_max, used_memory_min, gpu_utilization, gpu_utilization_max, gpu_utilization_min, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        ((g, user, m, m, m, u_, u_, u_, t) for g, user, m, u_, t in user_rows),
+                    )
+    conn.close()
+
+
+def time_query(func, *args, repeat: int = 3, cache: bool = False) -> float:
+    # 取多次执行中最短的耗时（毫秒），cache 为 False 时每次执行前清空查询结果缓存
+    best = float("inf")
+    for _ in range(repeat):
+        if not cache:
+            db.result_cache.clear()
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_queries(db_paths: dict, end_time: dt.datetime, repeat: int = 3) -> None:
+    realtime_start = (end_time - dt.timedelta(seconds=30)).strftime("%Y-%m-%d %H:%M:%S")
+    realtime_end = end_time.strftime("%Y-%m-%d %H:%M:%S")
+    cases = [
+        ("query_latest_gpu_info", db.query_latest_gpu_info, ()),
+        ("query_min_max_timestamp", db.query_min_max_timestamp, ()),
+        ("query_gpu_realtime_usage 30s", db.query_gpu_realtime_usage, (realtime_start, realtime_end)),
+        ("query_user_gpu_realtime_usage 30s", db.query_user_gpu_realtime_usage, (realtime_start, realtime_end)),
+    ]
+    for days in (1, 7, 30):
+        start_time = end_time - dt.timedelta(days=days)
+        cases += [
+            (f"query_gpu_history_usage {days}d", db.query_gpu_history_usage, (start_time, end_time)),
+            (f"query_gpu_history_average_usage {days}d", db.query_gpu_history_average_usage, (start_time, end_time)),
+            (f"query_gpu_user_history_usage {days}d", db.query_gpu_user_history_usage, (start_time, end_time)),
+            (
+                f"query_gpu_user_history_total_usage {days}d",
+                db.query_gpu_user_history_total_usage,
+                (start_time, end_time),
+            ),
+        ]
+
+    print(f"{'query':<44}" + "".join(f"{name:>14}" for name in db_paths))
+    for name, func, args in cases:
+        timings = [time_query(func, *args, path, repeat=repeat) for path in db_paths.values()]
+        print(f"{name:<44}" + "".join(f"{t:11.1f} ms" for t in timings))
+
+
+# 比较旧版本（TEXT 时间戳）与当前版本（整数时间戳、复合覆盖索引）数据库上的查询耗时
+def bench_schema(days: int = 30, repeat: int = 3) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_path = os.path.join(tmp_dir, "legacy.db")
+        epoch_path = os.path.join(tmp_dir, "epoch.db")
+        tiers_path = os.path.join(tmp_dir, "tiers.db")
+
+        start = time.perf_counter()
+        make_history_database(legacy_path, days=days, end_time=end_time, legacy=True)
+        print(f"Generated {days}-day legacy database in {time.perf_counter() - start:.1f} s")
+
+        shutil.copy(legacy_path, epoch_path)
+        start = time.perf_counter()
+        converted = migrate_database(epoch_path)
+        print(f"Migrated {converted} rows in {time.perf_counter() - start:.1f} s")
+
+        shutil.copy(epoch_path, tiers_path)
+        conn = sqlite3.connect(tiers_path)
+        rollup_history(conn, end_time + dt.timedelta(days=1))
+        conn.close()
+
+        bench_queries({"legacy": legacy_path, "epoch": epoch_path, "epoch+tiers": tiers_path}, end_time, repeat)
+
+
+def make_hub_database(hub_path: str, device_paths: dict, end_time: dt.datetime) -> None:
+    """
+    把各设备的单设备数据库合并到一个多设备数据库中，并按设备汇总历史层级。
+
+    Args:
+        hub_path (str): 多设备 SQLite 数据库路径。
+        device_paths (dict): 设备名 -> 单设备数据库路径。
+        end_time (datetime): 数据的结束时间。
+    """
+    initialize_database(hub_path, hub=True)
+    conn = sqlite3.connect(hub_path)
+    for device, path in device_paths.items():
+        conn.execute("ATTACH DATABASE ? AS src", (path,))
+        with conn:
+            # 汇总层级由多设备数据库自己按设备生成
+            for table in ("gpu_info", "gpu_user_info", "gpu_history", "gpu_user_history"):
+                columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA src.table_info({table})") if row[1] != "id")
+                conn.execute(
+                    f"INSERT INTO main.{table} ({columns}, device) SELECT {columns}, ? FROM src.{table}", (device,)
+                )
+        conn.execute("DETACH DATABASE src")
+        rollup_history(conn, end_time + dt.timedelta(days=1), device=device)
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+# 比较每台设备一个数据库与所有设备共用一个多设备数据库时的查询耗时
+def bench_hub(n_devices: int = 4, days: int = 7, repeat: int = 3) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        device_paths = {}
+        for i in range(n_devices):
+            device_paths[f"dev{i}"] = os.path.join(tmp_dir, f"gpu_history_dev{i}.db")
+            make_history_database(device_paths[f"dev{i}"], days=days, end_time=end_time)
+            conn = sqlite3.connect(device_paths[f"dev{i}"])
+            rollup_history(conn, end_time + dt.timedelta(days=1))
+            conn.close()
+        hub_path = os.path.join(tmp_dir, "gpu_hub.db")
+        make_hub_database(hub_path, device_paths, end_time)
+        print(f"Generated {n_devices} devices with {days} days of history in {time.perf_counter() - start:.1f} s")
+        print(
+            f"Total size: {sum(os.path.getsize(path) for path in device_paths.values()) / 2**20:.0f} MiB in files, "
+            f"{os.path.getsize(hub_path) / 2**20:.0f} MiB in hub"
+        )
+
+        realtime_start = (end_time - dt.timedelta(seconds=30)).strftime("%Y-%m-%d %H:%M:%S")
+        realtime_end = end_time.strftime("%Y-%m-%d %H:%M:%S")
+        history_start = end_time - dt.timedelta(days=days)
+        device, path = next(iter(device_paths.items()))
+        cases = [
+            ("query_latest_gpu_info", db.query_latest_gpu_info, ()),
+            ("query_gpu_realtime_usage 30s", db.query_gpu_realtime_usage, (realtime_start, realtime_end)),
+            (f"query_gpu_history_usage {days}d", db.query_gpu_history_usage, (history_start, end_time)),
+            (f"query_gpu_user_history_usage {days}d", db.query_gpu_user_history_usage, (history_start, end_time)),
+            (
+                f"query_gpu_user_history_total_usage {days}d",
+                db.query_gpu_user_history_total_usage,
+                (history_start, end_time),
+            ),
+        ]
+        print(f"\nOne device:\n{'query':<44}{'file':>14}{'hub':>14}")
+        for name, func, args in cases:
+            file_time = time_query(lambda: func(*args, path), repeat=repeat)
+            hub_time = time_query(lambda: func(*args, hub_path, device), repeat=repeat)
+            print(f"{name:<44}{file_time:11.1f} ms{hub_time:11.1f} ms")
+
+        # 单设备数据库需要逐个查询每台设备
+        cases = [
+            (
+                "latest",
+                lambda: [db.query_latest_gpu_info(path) for path in device_paths.values()],
+                lambda: db.query_fleet_latest_gpu_info(hub_path),
+            ),
+            (
+                f"history usage {days}d",
+                lambda: [db.query_gpu_history_usage(history_start, end_time, path) for path in device_paths.values()],
+                lambda: db.query_fleet_history_usage(history_start, end_time, hub_path),
+            ),
+            (
+                f"user total usage {days}d",
+                lambda: [
+                    db.query_gpu_user_history_total_usage(history_start, end_time, path)
+                    for path in device_paths.values()
+                ],
+                lambda: db.query_fleet_user_total_usage(history_start, end_time, hub_path),
+            ),
+        ]
+        print(f"\nAll {n_devices} devices:\n{'query':<44}{'files':>14}{'hub':>14}")
+        for name, files_func, hub_func in cases:
+            files_time = time_query(files_func, repeat=repeat)
+            hub_time = time_query(hub_func, repeat=repeat)
+            print(f"{name:<44}{files_time:11.1f} ms{hub_time:11.1f} ms")
+
+
+@contextmanager
+def plain_connection(db_path: str):
+    # 改用连接池之前每次查询的做法：打开新的默认连接，查询后关闭
+    conn = sqlite3.connect(db_path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# 比较每次查询新建连接与使用只读连接池时实时页面一次刷新的耗时，可以同时有记录程序在写入
+def bench_pool(sessions: int = 4, reruns: int = 200, write_period: float = 1.0) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "gpu_history.db")
+        make_history_database(db_path, days=1, end_time=end_time)
+        connect_database(db_path).close()
+        realtime_start = (end_time - dt.timedelta(seconds=30)).strftime("%Y-%m-%d %H:%M:%S")
+        realtime_end = end_time.strftime("%Y-%m-%d %H:%M:%S")
+
+        # 实时页面每次刷新的查询
+        def rerun():
+            db.query_latest_gpu_info(db_path)
+            db.query_gpu_realtime_usage(realtime_start, realtime_end, db_path)
+            db.query_gpu_memory_realtime_usage(realtime_start, realtime_end, db_path)
+            db.query_user_gpu_realtime_usage(realtime_start, realtime_end, db_path)
+            db.query_user_gpu_memory_realtime_usage(realtime_start, realtime_end, db_path)
+            db.query_min_max_timestamp(db_path)
+
+        # 模拟记录程序：WAL 模式的写连接，每 write_period 秒在一个事务中写入一次采样
+        def write(stop):
+            conn = connect_database(db_path)
+            epoch = int(end_time.timestamp())
+            while not stop.wait(write_period):
+                epoch += 1
+                with conn:
+                    conn.executemany(
+                        """
+                        INSERT INTO gpu_info (gpu_index, name, gpu_utilization, memory_utilization, total_memory, used_memory, free_memory, timestamp)
+                        VALUES (?, 'NVIDIA A100-SXM4-80GB', 50, 0, 85899345920, 0, 0, ?)
+                        """,
+                        ((i, epoch) for i in range(8)),
+                    )
+            conn.close()
+
+        def session(latencies):
+            for _ in range(reruns):
+                start = time.perf_counter()
+                rerun()
+                latencies.append(time.perf_counter() - start)
+
+        print(f"{sessions} sessions x {reruns} reruns of the realtime page (6 queries each)")
+        print(f"{'connections':<16}{'reruns/s':>10}{'p50':>12}{'p90':>12}{'p99':>12}")
+        read_connection = db.read_connection
+        for name, connection in (("new per query", plain_connection), ("pooled", read_connection)):
+            db.read_connection = connection
+            latencies = []
+            stop = threading.Event()
+            writer = threading.Thread(target=write, args=(stop,))
+            if write_period > 0:
+                writer.start()
+            threads = [threading.Thread(target=session, args=(latencies,)) for _ in range(sessions)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            if write_period > 0:
+                writer.join()
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+            print(f"{name:<16}{len(latencies) / elapsed:10.1f}{p50:9.2f} ms{p90:9.2f} ms{p99:9.2f} ms")
+        db.read_connection = read_connection
+        db.close_read_connections()
+
+
+# 历史页面一次刷新的耗时：结果缓存为空、命中缓存、新的汇总数据写入后缓存失效
+def bench_cache(days: int = 7, repeat: int = 5) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "gpu_history.db")
+        make_history_database(db_path, days=30, end_time=end_time)
+        conn = connect_database(db_path)
+        rollup_history(conn, end_time + dt.timedelta(days=1))
+        start_time = end_time - dt.timedelta(days=days)
+
+        def rerun():
+            db.query_min_max_timestamp(db_path)
+            db.query_gpu_history_average_usage(start_time, end_time, db_path)
+            db.query_gpu_history_usage(start_time, end_time, db_path)
+            db.query_gpu_user_history_usage(start_time, end_time, db_path)
+            db.query_gpu_user_history_total_usage(start_time, end_time, db_path)
+
+        # 记录程序每 30 秒写入一次汇总数据
+        epoch = int(end_time.timestamp())
+
+        def write():
+            nonlocal epoch
+            epoch += 30
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO gpu_history (gpu_index, gpu_utilization, used_memory, timestamp)
+                    VALUES (?, 50, 0, ?)
+                    """,
+                    ((i, epoch) for i in range(8)),
+                )
+
+        def cold():
+            db.result_cache.clear()
+            rerun()
+
+        def invalidated():
+            write()
+            rerun()
+
+        print(f"History page rerun over {days} days (5 queries)")
+        for name, func in (("cold", cold), ("cached", rerun), ("after a write", invalidated)):
+            print(f"{name:<16}{time_query(func, repeat=repeat, cache=True):9.1f} ms")
+        print(db.result_cache.stats())
+        conn.close()
+        db.close_read_connections()
+
+
+# 实时页面每秒刷新一次：每次分别重新查询最近 duration 秒，与一次增量读取的实时快照比较
+def bench_realtime(duration: int = 30, ticks: int = 300, n_gpus: int = 8, n_users: int = 4) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "gpu_history.db")
+        make_history_database(db_path, days=1, n_gpus=n_gpus, n_users=n_users, end_time=end_time)
+        conn = connect_database(db_path)
+        epoch = int(end_time.timestamp())
+
+        def write():
+            nonlocal epoch
+            epoch += 1
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO gpu_info (gpu_index, name, gpu_utilization, memory_utilization, total_memory, used_memory, free_memory, timestamp)
+                    VALUES (?, 'NVIDIA A100-SXM4-80GB', 50, 0, 85899345920, 0, 0, ?)
+                    """,
+                    ((i, epoch) for i in range(n_gpus)),
+                )
+                conn.executemany(
+                    "INSERT INTO gpu_user_info (gpu_index, user, used_memory, gpu_utilization, timestamp) VALUES (?, ?, 0, 50, ?)",
+                    ((i, f"user{j}", epoch) for i in range(n_gpus) for j in range(n_users)),
+                )
+
+        def time_range():
+            start = dt.datetime.fromtimestamp(epoch - duration, tz=dt.timezone.utc)
+            end = dt.datetime.fromtimestamp(epoch, tz=dt.timezone.utc)
+            return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+        # 改用快照之前每次刷新的查询：最新状态和时间范围内的 GPU、用户数据分别查询
+        def full():
+            start, end = time_range()
+            db.query_latest_gpu_info(db_path)
+            db.query_gpu_realtime_usage(start, end, db_path)
+            db.query_gpu_memory_realtime_usage(start, end, db_path)
+            db.query_user_gpu_realtime_usage(start, end, db_path)
+            db.query_user_gpu_memory_realtime_usage(start, end, db_path)
+
+        def snapshot():
+            db.query_realtime_snapshot(db_path, duration, end_time=dt.datetime.fromtimestamp(epoch, tz=dt.timezone.utc))
+
+        print(f"{ticks} one-second reruns over a {duration} s window, {n_gpus} GPUs x {n_users} users")
+        for name, func in (("five queries", full), ("snapshot", snapshot)):
+            elapsed = []
+            for _ in range(ticks):
+                write()
+                start = time.perf_counter()
+                func()
+                elapsed.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(elapsed, [50, 99]) * 1000
+            print(f"{name:<16}{p50:9.2f} ms p50{p99:9.2f} ms p99")
+        conn.close()
+        db.close_read_connections()
+
+
+# 时间戳转换的耗时：旧版本 TEXT 时间戳和当前版本整数时间戳，逐个解析与一次转换为 datetime64 比较
+def bench_timestamps(days: int = 30, repeat: int = 3) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "gpu_history.db")
+        start = time.perf_counter()
+        make_history_database(db_path, days=days, end_time=end_time)
+        conn = sqlite3.connect(db_path)
+        epochs = pd.read_sql_query("SELECT timestamp FROM gpu_user_history", conn)["timestamp"]
+        # 旧版本数据库中的 TEXT 时间戳
+        query = "SELECT DATETIME(timestamp, 'unixepoch') AS timestamp FROM gpu_user_history"
+        texts = pd.read_sql_query(query, conn)["timestamp"]
+        conn.close()
+        print(f"Generated {days} days of history, {len(epochs)} rows in {time.perf_counter() - start:.1f} s")
+
+        tz = db.DISPLAY_TIMEZONE
+        cases = [
+            (
+                "TEXT, pd.to_datetime",
+                lambda: pd.to_datetime(texts).dt.tz_localize("UTC").dt.tz_convert(tz),
+            ),
+            ("TEXT, to_local_time", lambda: db.to_local_time(texts)),
+            ("epoch, pd.to_datetime", lambda: pd.to_datetime(epochs, unit="s", utc=True).dt.tz_convert(tz)),
+            ("epoch, to_local_time", lambda: db.to_local_time(epochs)),
+        ]
+        print(f"{'conversion':<28}{'time':>12}{'rows/s':>14}")
+        for name, func in cases:
+            elapsed = time_query(func, repeat=repeat)
+            print(f"{name:<28}{elapsed:9.1f} ms{len(epochs) / elapsed / 1000:12.1f} M")
+
+        local = db.to_local_time(epochs)
+        cases = [
+            ("dt.strftime", lambda: local.dt.strftime("%Y-%m-%d %H:%M:%S")),
+            ("format_local_time", lambda: db.format_local_time(local)),
+        ]
+        print(f"\n{'formatting':<28}{'time':>12}{'rows/s':>14}")
+        for name, func in cases:
+            elapsed = time_query(func, repeat=repeat)
+            print(f"{name:<28}{elapsed:9.1f} ms{len(epochs) / elapsed / 1000:12.1f} M")
+
+
+# 用户历史使用情况：逐个 (用户, GPU) 补齐时间点，与一次放入共用时间轴的矩阵比较
+def bench_pivot(days: int = 7, n_users: int = 25, repeat: int = 3) -> None:
+    end_time = dt.datetime(2024, 2, 1, tzinfo=dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "gpu_history.db")
+        start = time.perf_counter()
+        make_history_database(db_path, days=days, n_users=n_users, end_time=end_time)
+        conn = sqlite3.connect(db_path)
+        rollup_history(conn, end_time + dt.timedelta(days=1))
+        conn.close()
+        print(
+            f"Generated {days} days of history with {2 * n_users} users, "
+            f"{n_users} per GPU, in {time.perf_counter() - start:.1f} s"
+        )
+
+        print(f"{'range':<10}{'per-group dict':>18}{'matrix':>14}")
+        for range_days in sorted({1, days}):
+            args = (end_time - dt.timedelta(days=range_days), end_time, db_path)
+            grouped = time_query(db.query_gpu_user_history_usage, *args, repeat=repeat)
+            matrix = time_query(db.query_gpu_user_history_matrix, *args, repeat=repeat)
+            print(f"{f'{range_days}d':<10}{grouped:15.1f} ms{matrix:11.1f} ms")
+        db.close_read_connections()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the GPU database queries.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_schema = subparsers.add_parser("schema", help="Query latency on the legacy and current schema.")
+    parser_schema.add_argument("--days", type=int, help="Days of synthetic history.", default=30)
+    parser_schema.add_argument("--repeat", type=int, help="Runs per query, the fastest is reported.", default=3)
+
+    parser_hub = subparsers.add_parser("hub", help="Query latency on per-device databases and a multi-device hub.")
+    parser_hub.add_argument("--devices", type=int, help="Number of devices.", default=4)
+    parser_hub.add_argument("--days", type=int, help="Days of synthetic history per device.", default=7)
+    parser_hub.add_argument("--repeat", type=int, help="Runs per query, the fastest is reported.", default=3)
+
+    parser_pool = subparsers.add_parser("pool", help="Realtime page latency with new connections and the read pool.")
+    parser_pool.add_argument("--sessions", type=int, help="Concurrent browser sessions (threads).", default=4)
+    parser_pool.add_argument("--reruns", type=int, help="Page reruns per session.", default=200)
+    parser_pool.add_argument(
+        "--write-period", type=float, help="Seconds between logger writes, 0 to disable.", default=1.0
+    )
+
+    parser_cache = subparsers.add_parser("cache", help="History page latency with and without the result cache.")
+    parser_cache.add_argument("--days", type=int, help="Queried range in days.", default=7)
+    parser_cache.add_argument("--repeat", type=int, help="Runs per case, the fastest is reported.", default=5)
+
+    parser_realtime = subparsers.add_parser(
+        "realtime", help="Realtime page reruns with separate queries and the snapshot."
+    )
+    parser_realtime.add_argument("--duration", type=int, help="Seconds shown on the realtime page.", default=30)
+    parser_realtime.add_argument("--ticks", type=int, help="Number of one-second reruns.", default=300)
+    parser_realtime.add_argument("--gpus", type=int, help="GPUs per sample.", default=8)
+    parser_realtime.add_argument("--users", type=int, help="Users per GPU.", default=4)
+
+    parser_timestamps = subparsers.add_parser("timestamps", help="Timestamp conversion on a large history database.")
+    parser_timestamps.add_argument("--days", type=int, help="Days of synthetic history.", default=30)
+    parser_timestamps.add_argument("--repeat", type=int, help="Runs per case, the fastest is reported.", default=3)
+
+    parser_pivot = subparsers.add_parser("pivot", help="User history as per-group frames and as one matrix.")
+    parser_pivot.add_argument("--days", type=int, help="Days of synthetic history.", default=7)
+    parser_pivot.add_argument("--users", type=int, help="Users per GPU, twice as many in total.", default=25)
+    parser_pivot.add_argument("--repeat", type=int, help="Runs per query, the fastest is reported.", default=3)
+
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.command == "schema":
+        bench_schema(args.days, args.repeat)
+    elif args.command == "hub":
+        bench_hub(args.devices, args.days, args.repeat)
+    elif args.command == "pool":
+        bench_pool(args.sessions, args.reruns, args.write_period)
+    elif args.command == "cache":
+        bench_cache(args.days, args.repeat)
+    elif args.command == "realtime":
+        bench_realtime(args.duration, args.ticks, args.gpus, args.users)
+    elif args.command == "timestamps":
+        bench_timestamps(args.days, args.repeat)
+    elif args.command == "pivot":
+        bench_pivot(args.days, args.users, args.repeat)
@@ -1,97 +1,510 @@
+import contextlib
 import datetime as dt
+import functools
+import inspect
 import os
+import pathlib
 import sqlite3
+import sys
+import threading
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
 from loguru import logger
 
 if os.getenv("ENABLE_NAME_DICT", "0") == "1":
     from name_dict import dict_username
 
+# 历史数据的汇总层级：(表名后缀, 时间粒度秒数)，由 GPU 记录程序维护
+HISTORY_TIERS = (("", 30), ("_5m", 300), ("_1h", 3600), ("_1d", 86400))
 
-def query_latest_gpu_info(db_path: str = "gpu_history.db") -> pd.DataFrame:
+# 从该表结构版本开始，timestamp 为整数 Unix 时间戳（秒，UTC），此前为 TEXT
+EPOCH_SCHEMA_VERSION = 2
+
+# 查询结果中时间的显示时区
+DISPLAY_TIMEZONE = os.getenv("DISPLAY_TIMEZONE", "Asia/Shanghai")
+
+
+# 只读连接池：每个数据库最多保留的空闲连接数，以及连接的内存映射大小、页缓存大小（字节）
+# 和等待记录程序写入完成的超时（秒）
+READ_POOL_SIZE = 4
+READ_MMAP_SIZE = 256 * 2**20
+READ_CACHE_SIZE = 32 * 2**20
+READ_TIMEOUT = 5.0
+
+_read_pools: dict[str, list[sqlite3.Connection]] = {}
+_read_pools_lock = threading.Lock()
+
+
+def open_read_connection(db_path: str) -> sqlite3.Connection:
+    """
+    以只读方式打开数据库连接，并设置内存映射和页缓存大小。
+
+    连接可以在不同线程中使用（Streamlit 每次运行脚本都在新的线程中），但同一时刻只能由一个线程使用。
+
+    Args:
+        db_path (str): SQLite 数据库路径。
+
+    Returns:
+        sqlite3.Connection: 只读的数据库连接。
+    """
+    uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=READ_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {READ_MMAP_SIZE}")
+    # 负数表示以 KiB 为单位
+    conn.execute(f"PRAGMA cache_size = {-(READ_CACHE_SIZE // 1024)}")
+    return conn
+
+
+@contextlib.contextmanager
+def read_connection(db_path: str):
+    """
+    从连接池中取出数据库的只读连接，用完后放回连接池。
+
+    连接池按数据库的绝对路径区分，没有空闲连接时打开新的连接；空闲连接超过 READ_POOL_SIZE 时关闭多余的连接。
+    多个线程同时查询时各自取得不同的连接。
+
+    Args:
+        db_path (str): SQLite 数据库路径。
+
+    Yields:
+        sqlite3.Connection: 只读的数据库连接。
+    """
+    key = os.path.abspath(db_path)
+    with _read_pools_lock:
+        pool = _read_pools.get(key)
+        conn = pool.pop() if pool else None
+    if conn is None:
+        conn = open_read_connection(key)
+    try:
+        yield conn
+    finally:
+        # 未结束的事务会一直持有读快照，这样的连接不放回连接池
+        if not conn.in_transaction:
+            with _read_pools_lock:
+                pool = _read_pools.setdefault(key, [])
+                if len(pool) < READ_POOL_SIZE:
+                    pool.append(conn)
+                    conn = None
+        if conn is not None:
+            conn.close()
+
+
+def close_read_connections() -> None:
+    """
+    关闭连接池中所有的空闲连接，例如在删除或替换数据库文件之前。
+    """
+    with _read_pools_lock:
+        pools = list(_read_pools.values())
+        _read_pools.clear()
+    for pool in pools:
+        for conn in pool:
+            conn.close()
+
+
+# 历史查询结果缓存的内存上限（字节）
+RESULT_CACHE_SIZE = 256 * 2**20
+
+
+def result_size(result) -> int:
+    # 估计查询结果占用的内存（字节）
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=True).sum())
+    if isinstance(result, (pd.Series, pd.Index)):
+        return int(result.memory_usage(deep=True))
+    if isinstance(result, np.ndarray) and result.dtype != object:
+        return result.nbytes
+    if isinstance(result, dict):
+        return sys.getsizeof(result) + sum(
+            result_size(key) + result_size(value) for key, value in result.items()
+        )
+    if isinstance(result, (tuple, list)):
+        return sys.getsizeof(result) + sum(result_size(item) for item in result)
+    return sys.getsizeof(result)
+
+
+def copy_result(result):
+    # 调用者可能修改返回的 DataFrame，缓存中保存的结果不直接交给调用者
+    if isinstance(result, (pd.DataFrame, pd.Series, pd.Index, np.ndarray)):
+        return result.copy()
+    if isinstance(result, dict):
+        return {key: copy_result(value) for key, value in result.items()}
+    if isinstance(result, tuple):
+        return tuple(copy_result(item) for item in result)
+    return result
+
+
+class ResultCache:
+    """
+    查询结果的 LRU 缓存，按结果占用的内存淘汰最久未使用的条目。
+
+    每个条目记录查询时数据库的数据版本（见 data_version），版本变化后条目失效。
+    hits、misses 分别统计命中和未命中（包括条目失效）的次数，evictions 统计因内存上限淘汰的条目数。
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (version, result, size)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, version):
+        """
+        查找缓存的结果。
+
+        Args:
+            key (Hashable): 查询的键。
+            version (tuple): 数据库当前的数据版本。
+
+        Returns:
+            found (bool): 是否命中。
+            result: 命中时为缓存的结果，否则为 None。
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+                self.nbytes -= entry[2]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, version, result):
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self.entries[key] = (version, result, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, _, old_size) = self.entries.popitem(last=False)
+                self.nbytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+result_cache = ResultCache()
+
+
+def data_version(conn: sqlite3.Connection) -> tuple:
+    """
+    历史数据的版本：表结构版本和各历史表（包括汇总层级）的最小、最大 id。
+
+    id 是 AUTOINCREMENT 主键，写入新的汇总数据会增大最大 id，清理过期数据会增大最小 id，
+    每个值都只需在主键上查找一次。
+
+    Args:
+        conn (sqlite3.Connection): SQLite 数据库连接。
+
+    Returns:
+        tuple: 数据版本，历史数据没有变化时保持不变。
+    """
+    query = """
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND name LIKE 'gpu%history%'
+        ORDER BY name
+    """
+    tables = [row[0] for row in conn.execute(query)]
+    columns = ", ".join(
+        f"(SELECT MIN(id) FROM {table}), (SELECT MAX(id) FROM {table})"
+        for table in tables
+    )
+    version = conn.execute(f"SELECT {columns}").fetchone() if tables else ()
+    return (get_schema_version(conn), *version)
+
+
+def align_time_range(start_time, end_time) -> tuple:
+    """
+    将时间范围向外对齐到该范围的采样间隔（见 get_period_sample_interval）。
+
+    起始时间对齐到所在采样间隔的开头，终止时间对齐到所在采样间隔的最后一秒，
+    落在相同采样间隔内的时间范围得到相同的结果，第一个和最后一个时间点也包含完整的采样间隔；
+    若对齐后的范围对应的采样间隔与原来不同，则不对齐。
+
+    Args:
+        start_time (datetime): 起始时间，没有时区信息的时间视为 UTC。
+        end_time (datetime): 终止时间，没有时区信息的时间视为 UTC。
+
+    Returns:
+        start_time (datetime): 对齐后的起始时间，时区与原来一致。
+        end_time (datetime): 对齐后的终止时间，时区与原来一致。
+    """
+    interval = int(get_period_sample_interval(start_time, end_time))
+    start = to_epoch(start_time) // interval * interval
+    end = to_epoch(end_time) // interval * interval + interval - 1
+    aligned = []
+    for epoch, original in ((start, start_time), (end, end_time)):
+        value = dt.datetime.fromtimestamp(epoch, tz=dt.timezone.utc)
+        if original.tzinfo is None:
+            value = value.replace(tzinfo=None)
+        aligned.append(value)
+    if get_period_sample_interval(*aligned) != interval:
+        return start_time, end_time
+    return tuple(aligned)
+
+
+def cached_query(func):
+    """
+    缓存历史查询函数的结果。
+
+    键为函数名、数据库的绝对路径、对齐到采样间隔的时间范围（见 align_time_range）和其余参数；
+    数据库的数据版本（见 data_version）变化前，同一个键直接返回缓存结果的副本，
+    只有新的汇总数据写入（或过期数据被清理）后才重新查询。
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+        if "start_time" in arguments:
+            arguments["start_time"], arguments["end_time"] = align_time_range(
+                arguments["start_time"], arguments["end_time"]
+            )
+        db_path = os.path.abspath(arguments["db_path"])
+        key = (func.__name__, db_path) + tuple(
+            (name, to_epoch(value) if isinstance(value, dt.datetime) else value)
+            for name, value in arguments.items()
+            if name != "db_path"
+        )
+
+        # 先读取数据版本再查询：查询期间写入的数据会使下一次查询重新执行
+        with read_connection(db_path) as conn:
+            version = data_version(conn)
+        found, result = result_cache.get(key, version)
+        if not found:
+            result = func(**arguments)
+            result_cache.put(key, version, result)
+        return copy_result(result)
+
+    return wrapper
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """
+    查询数据库的表结构版本（PRAGMA user_version）。
+
+    Args:
+        conn (sqlite3.Connection): SQLite 数据库连接。
+
+    Returns:
+        int: 表结构版本。
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def to_epoch(timestamp: str | dt.datetime) -> int:
+    """
+    将时间转换为 Unix 时间戳（秒），没有时区信息的时间视为 UTC。
+
+    Args:
+        timestamp (str | datetime): 时间，字符串格式为 "YYYY-MM-DD HH:MM:SS"。
+
+    Returns:
+        int: Unix 时间戳。
+    """
+    if isinstance(timestamp, str):
+        timestamp = dt.datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=dt.timezone.utc)
+    return int(timestamp.timestamp())
+
+
+def time_params(version: int, start_time, end_time) -> tuple:
+    # 整数时间戳的数据库以 Unix 时间戳作为查询参数
+    if version >= EPOCH_SCHEMA_VERSION:
+        return to_epoch(start_time), to_epoch(end_time)
+    return start_time, end_time
+
+
+def bucket_expr(version: int, interval: int) -> str:
+    # 将时间戳对齐到采样间隔的 SQL 表达式，整数除法即向下取整
+    # 旧版本数据库的 TEXT 时间戳先转换为 Unix 时间戳，结果同样是整数
+    interval = int(interval)
+    if version >= EPOCH_SCHEMA_VERSION:
+        return f"timestamp / {interval} * {interval}"
+    return f"UNIXEPOCH(timestamp) / {interval} * {interval}"
+
+
+# 多设备数据库中的设备名：每次在以 device 开头的索引中查找下一个设备，不扫描整张表
+DEVICES_CTE = """
+    WITH RECURSIVE devices(device) AS (
+        SELECT MIN(device) FROM {table}
+        UNION ALL
+        SELECT (SELECT MIN(device) FROM {table} WHERE device > devices.device)
+        FROM devices
+        WHERE device IS NOT NULL
+    )
+"""
+
+
+def device_filter(device: str | None) -> tuple[str, tuple]:
+    """
+    多设备（hub）数据库中按设备过滤的 SQL 条件。
+
+    Args:
+        device (str | None): 设备名，None 表示不过滤（单设备数据库，或查询全部设备）。
+
+    Returns:
+        condition (str): 追加在 WHERE 子句末尾的条件。
+        params (tuple): 条件的参数。
+    """
+    if device is None:
+        return "", ()
+    return " AND device = ?", (device,)
+
+
+def to_local_time(values: pd.Series | np.ndarray, unit: str = "s") -> pd.Series:
+    """
+    将数据库中的时间戳转换为 DISPLAY_TIMEZONE 时区的 datetime。
+
+    整数 Unix 时间戳（当前版本的数据库）一次转换为 datetime64，不逐个解析；
+    旧版本数据库的 TEXT 时间戳（UTC）由 numpy 按 ISO 格式解析。
+
+    Args:
+        values (pd.Series | np.ndarray): 时间戳。
+        unit (str): 整数时间戳的单位，"s" 或 "us"。
+
+    Returns:
+        pd.Series: 带时区的 datetime，索引与 values 相同。
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    array = np.asarray(values)
+    if array.dtype.kind in "iu":
+        # 换算为纳秒后直接作为 datetime64[ns] 解释
+        scale = {"s": 1_000_000_000, "us": 1_000}[unit]
+        times = (array.astype(np.int64) * scale).view("datetime64[ns]")
+    elif array.dtype.kind == "f":
+        # 含有 NULL 的整数列读为浮点数
+        times = pd.to_datetime(array, unit=unit)
+    else:
+        try:
+            times = array.astype("datetime64[ns]")
+        except (TypeError, ValueError):
+            times = pd.to_datetime(array)
+    times = pd.DatetimeIndex(times).tz_localize("UTC").tz_convert(DISPLAY_TIMEZONE)
+    return pd.Series(times, index=index)
+
+
+def format_local_time(values: pd.Series) -> pd.Series:
+    # 将带时区的 datetime 格式化为 "YYYY-MM-DD HH:MM:SS"（该时区的当地时间）
+    # np.char.replace 不接受空数组（数据库中还没有数据时）
+    if values.empty:
+        return pd.Series([], index=values.index, dtype=object)
+    local = values.dt.tz_localize(None).to_numpy(dtype="datetime64[s]")
+    text = np.char.replace(np.datetime_as_string(local, unit="s"), "T", " ")
+    return pd.Series(text, index=values.index, dtype=object)
+
+
+def query_latest_gpu_info(
+    db_path: str = "gpu_history.db", device: str | None = None
+) -> pd.DataFrame:
     """
     查询最新的 GPU 状态信息（包括 GPU 使用率、内存使用情况等）。
 
     Args:
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: 最新的 GPU 状态信息。
     """
     logger.trace(f"Querying latest GPU info from {db_path}")
-    conn = sqlite3.connect(db_path)
+    with read_connection(db_path) as conn:
+        condition, device_params = device_filter(device)
 
-    # 查询最新的 GPU 信息
-    query = """
-        SELECT *
-        FROM gpu_info
-        WHERE timestamp = (
-            SELECT MAX(timestamp)
+        # 查询最新的 GPU 信息
+        query = f"""
+            SELECT *
             FROM gpu_info
-        )
-    """
-    data = pd.read_sql_query(query, conn)
-    conn.close()
+            WHERE timestamp = (
+                SELECT MAX(timestamp)
+                FROM gpu_info
+                WHERE 1{condition}
+            ){condition}
+        """
+        data = pd.read_sql_query(query, conn, params=device_params * 2)
     logger.trace("Query latest GPU info completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-        .dt.strftime("%Y-%m-%d %H:%M:%S")
-    )
+    data["timestamp"] = format_local_time(to_local_time(data["timestamp"]))
 
     return data
 
 
+@cached_query
 def query_min_max_timestamp(
-    db_path: str = "gpu_history.db",
+    db_path: str = "gpu_history.db", device: str | None = None
 ) -> tuple[dt.datetime, dt.datetime]:
     """
     查询最早和最晚的 GPU 数据记录时间。
 
     Args:
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         min_timestamp (datetime): 最早的 GPU 数据记录时间。
         max_timestamp (datetime): 最晚的 GPU 数据记录时间。
     """
     logger.trace(f"Querying min and max timestamp from {db_path}")
-    conn = sqlite3.connect(db_path)
-
-    # 查询最早和最晚的 GPU 数据记录时间
-    query = """
-        SELECT 
-            MIN(timestamp) AS min_timestamp,
-            MAX(timestamp) AS max_timestamp
-        FROM gpu_history
-    """
-    data = pd.read_sql_query(query, conn)
-    conn.close()
+    with read_connection(db_path) as conn:
+        condition, device_params = device_filter(device)
+
+        # 查询最早和最晚的 GPU 数据记录时间
+        query = f"""
+            SELECT 
+                MIN(timestamp) AS min_timestamp,
+                MAX(timestamp) AS max_timestamp
+            FROM gpu_history
+            WHERE 1{condition}
+        """
+        data = pd.read_sql_query(query, conn, params=device_params)
     logger.trace("Query min and max timestamp completed")
 
     if data.empty:
         return None, None
 
-    min_timestamp = (
-        pd.to_datetime(data["min_timestamp"].iloc[0])
-        .tz_localize("UTC")
-        .tz_convert("Asia/Shanghai")
-    )
-    max_timestamp = (
-        pd.to_datetime(data["max_timestamp"].iloc[0])
-        .tz_localize("UTC")
-        .tz_convert("Asia/Shanghai")
-    )
+    min_timestamp = to_local_time(data["min_timestamp"]).iloc[0]
+    max_timestamp = to_local_time(data["max_timestamp"]).iloc[0]
 
     return min_timestamp, max_timestamp
 
 
 def query_gpu_realtime_usage(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的 GPU 使用情况。
@@ -100,6 +513,7 @@ def query_gpu_realtime_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         gpu_utilization_df: 每台 GPU 在每个时刻的使用率变化。
@@ -107,31 +521,32 @@ def query_gpu_realtime_usage(
     logger.trace(
         f"Querying GPU realtime usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
-
-    # 查询 GPU 信息
-    query = """
-        SELECT gpu_index, gpu_utilization, timestamp
-        FROM gpu_info
-        WHERE timestamp BETWEEN ? AND ?
-        ORDER BY timestamp
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 查询 GPU 信息
+        query = f"""
+            SELECT gpu_index, gpu_utilization, timestamp
+            FROM gpu_info
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            ORDER BY timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query GPU realtime usage completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-    )
+    data["timestamp"] = to_local_time(data["timestamp"])
 
     return data
 
 
 def query_gpu_memory_realtime_usage(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的 GPU 内存使用情况。
@@ -140,6 +555,7 @@ def query_gpu_memory_realtime_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: GPU 内存使用情况。
@@ -147,31 +563,32 @@ def query_gpu_memory_realtime_usage(
     logger.trace(
         f"Querying GPU memory realtime usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
-
-    # 查询 GPU 信息
-    query = """
-        SELECT gpu_index, used_memory, timestamp
-        FROM gpu_info
-        WHERE timestamp BETWEEN ? AND ?
-        ORDER BY timestamp
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 查询 GPU 信息
+        query = f"""
+            SELECT gpu_index, used_memory, timestamp
+            FROM gpu_info
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            ORDER BY timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query GPU memory realtime usage completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-    )
+    data["timestamp"] = to_local_time(data["timestamp"])
 
     return data
 
 
 def query_user_gpu_realtime_usage(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的用户 GPU 使用情况。
@@ -180,6 +597,7 @@ def query_user_gpu_realtime_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: 用户 GPU 使用情况。
@@ -187,31 +605,32 @@ def query_user_gpu_realtime_usage(
     logger.trace(
         f"Querying user GPU realtime usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
-
-    # 查询用户 GPU 使用情况
-    query = """
-        SELECT gpu_index, user, gpu_utilization, timestamp
-        FROM gpu_user_info
-        WHERE timestamp BETWEEN ? AND ?
-        ORDER BY timestamp
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 查询用户 GPU 使用情况
+        query = f"""
+            SELECT gpu_index, user, gpu_utilization, timestamp
+            FROM gpu_user_info
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            ORDER BY timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query user GPU realtime usage completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-    )
+    data["timestamp"] = to_local_time(data["timestamp"])
 
     return data
 
 
 def query_user_gpu_memory_realtime_usage(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的用户 GPU 内存使用情况。
@@ -220,6 +639,7 @@ def query_user_gpu_memory_realtime_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: 用户 GPU 内存使用情况。
@@ -227,29 +647,402 @@ def query_user_gpu_memory_realtime_usage(
     logger.trace(
         f"Querying user GPU memory realtime usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
-
-    # 查询用户 GPU 使用情况
-    query = """
-        SELECT gpu_index, user, used_memory, timestamp
-        FROM gpu_user_info
-        WHERE timestamp BETWEEN ? AND ?
-        ORDER BY timestamp
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 查询用户 GPU 使用情况
+        query = f"""
+            SELECT gpu_index, user, used_memory, timestamp
+            FROM gpu_user_info
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            ORDER BY timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query user GPU memory realtime usage completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-    )
+    data["timestamp"] = to_local_time(data["timestamp"])
 
     return data
 
 
+def query_gpu_samples(
+    start_time: str,
+    end_time: str,
+    metric: str = "gpu_utilization",
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
+) -> pd.DataFrame:
+    """
+    查询指定时间范围内高频采样模式记录的采样点。
+
+    Args:
+        start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        metric (str): 指标名，如 "gpu_utilization"、"memory_utilization"、"power"。
+        db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
+
+    Returns:
+        pd.DataFrame: 每台 GPU 的采样点，列为 gpu_index、value、timestamp。
+    """
+    logger.trace(
+        f"Querying GPU {metric} samples from {start_time} to {end_time} in {db_path}"
+    )
+    with read_connection(db_path) as conn:
+        if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'gpu_samples'"
+        ).fetchone():
+            return pd.DataFrame(columns=["gpu_index", "value", "timestamp"])
+        condition, device_params = device_filter(device)
+
+        # 每行是一次采样读到的一组采样点，偏移和采样值以小端 uint32/float32 存储
+        query = f"""
+            SELECT gpu_index, start, count, offsets, vals
+            FROM gpu_samples
+            WHERE timestamp BETWEEN ? AND ? AND metric = ?{condition}
+            ORDER BY timestamp
+        """
+        rows = conn.execute(
+            query, (to_epoch(start_time), to_epoch(end_time), metric) + device_params
+        ).fetchall()
+    logger.trace("Query GPU samples completed")
+
+    if not rows:
+        return pd.DataFrame(columns=["gpu_index", "value", "timestamp"])
+    gpu_index, start, count, offsets, vals = zip(*rows)
+    count = np.array(count)
+    timestamps = np.repeat(np.array(start, dtype=np.int64), count)
+    timestamps += np.frombuffer(b"".join(offsets), dtype="<u4")
+    data = pd.DataFrame(
+        {
+            "gpu_index": np.repeat(gpu_index, count),
+            "value": np.frombuffer(b"".join(vals), dtype="<f4"),
+            "timestamp": to_local_time(timestamps, unit="us"),
+        }
+    )
+
+    return data.sort_values(["gpu_index", "timestamp"], ignore_index=True)
+
+
+# 增量读取实时数据时各列的类型，其余列为 float64（NULL 读为 NaN）
+REALTIME_DTYPES = {"id": np.int64, "timestamp": np.int64, "gpu_index": np.int64}
+REALTIME_TEXT_COLUMNS = {"user", "name"}
+
+
+def read_realtime_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: list[str],
+    last_id: int | None = None,
+    start_time: str | None = None,
+    device: str | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    在给定的连接上增量读取实时表中的行，参数和返回值见 query_realtime_rows。
+    """
+    columns = ["id", "timestamp"] + [c for c in columns if c not in ("id", "timestamp")]
+    condition, device_params = device_filter(device)
+    version = get_schema_version(conn)
+    # 旧版本数据库的 TEXT 时间戳在查询中转换为 Unix 时间戳
+    timestamp = (
+        "timestamp" if version >= EPOCH_SCHEMA_VERSION else "UNIXEPOCH(timestamp)"
+    )
+    select = ", ".join(timestamp if c == "timestamp" else c for c in columns)
+    if last_id is not None:
+        where, params = "id > ?", (last_id,)
+    else:
+        where = "timestamp >= ?"
+        params = time_params(version, start_time, start_time)[:1]
+    query = f"""
+        SELECT {select}
+        FROM {table}
+        WHERE {where}{condition}
+        ORDER BY id
+    """
+    rows = conn.execute(query, params + device_params).fetchall()
+
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {
+        column: np.array(
+            value,
+            dtype=(
+                object
+                if column in REALTIME_TEXT_COLUMNS
+                else REALTIME_DTYPES.get(column, np.float64)
+            ),
+        )
+        for column, value in zip(columns, values)
+    }
+
+
+def query_realtime_rows(
+    table: str,
+    columns: list[str],
+    db_path: str = "gpu_history.db",
+    last_id: int | None = None,
+    start_time: str | None = None,
+    device: str | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    增量读取实时表（gpu_info、gpu_user_info）中的行，按 id 排序。
+
+    last_id 不为 None 时只读取 id 大于 last_id 的行（新写入的行），只需在主键上查找；
+    否则读取 start_time 之后的全部行。
+
+    Args:
+        table (str): 实时表名，"gpu_info" 或 "gpu_user_info"。
+        columns (list[str]): 读取的列名，结果总是包含 id 和 timestamp。
+        db_path (str): SQLite 数据库路径。
+        last_id (int | None): 已读取的最大 id。
+        start_time (str | None): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"，last_id 为 None 时使用。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
+
+    Returns:
+        dict[str, np.ndarray]: 列名 -> 该列的值，timestamp 为 Unix 时间戳（秒）。
+    """
+    with read_connection(db_path) as conn:
+        return read_realtime_rows(conn, table, columns, last_id, start_time, device)
+
+
+class RealtimeBuffer:
+    """
+    实时表最近若干行的环形缓冲区，每列一个固定长度的 numpy 数组。
+
+    每次刷新页面时 update() 只从数据库读取 id 大于已读取的最大 id 的行，追加到缓冲区中，
+    超过 capacity 行时覆盖最早的行；window() 从缓冲区中取出一段时间内的行，不再查询数据库，
+    也不再重复解析已读取行的时间戳。可以保存在 Streamlit 的 session_state 中，每个会话一个。
+    """
+
+    def __init__(
+        self,
+        table: str,
+        columns: list[str],
+        db_path: str = "gpu_history.db",
+        capacity: int = 16384,
+        device: str | None = None,
+    ):
+        self.table = table
+        self.columns = ["id", "timestamp"] + [
+            c for c in columns if c not in ("id", "timestamp")
+        ]
+        self.db_path = db_path
+        self.capacity = capacity
+        self.device = device
+        self.data = {
+            c: np.empty(
+                capacity,
+                dtype=(
+                    object
+                    if c in REALTIME_TEXT_COLUMNS
+                    else REALTIME_DTYPES.get(c, np.float64)
+                ),
+            )
+            for c in self.columns
+        }
+        self.head = 0  # 下一行写入的位置
+        self.size = 0
+        self.last_id = None
+        self.latest = None  # 缓冲区中最晚的时间戳
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.size = 0
+            self.last_id = None
+            self.latest = None
+
+    def append(self, rows: dict[str, np.ndarray]) -> None:
+        """
+        追加 query_realtime_rows 读取的行，超过容量时覆盖最早的行。
+
+        Args:
+            rows (dict[str, np.ndarray]): 列名 -> 该列的值，需要包含缓冲区的全部列。
+        """
+        n = len(rows["id"])
+        if n == 0:
+            return
+        with self.lock:
+            # 只保留最后 capacity 行，分成写到数组末尾和从头开始覆盖的两段
+            start = max(0, n - self.capacity)
+            positions = (self.head + np.arange(n - start)) % self.capacity
+            for c in self.columns:
+                self.data[c][positions] = rows[c][start:]
+            self.head = (self.head + n - start) % self.capacity
+            self.size = min(self.capacity, self.size + n - start)
+            self.last_id = int(rows["id"][-1])
+            latest = int(rows["timestamp"].max())
+            self.latest = latest if self.latest is None else max(self.latest, latest)
+
+    def update(self, start_time: str, conn: sqlite3.Connection | None = None) -> int:
+        """
+        从数据库读取新写入的行。
+
+        缓冲区为空，或其中最晚的行已早于 start_time（例如较长时间没有刷新）时，
+        清空缓冲区并重新读取 start_time 之后的全部行。
+
+        Args:
+            start_time (str): 需要的时间范围的起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+            conn (sqlite3.Connection | None): 使用的数据库连接，None 表示从连接池中取出。
+
+        Returns:
+            int: 读取的行数。
+        """
+        if self.latest is not None and self.latest < to_epoch(start_time):
+            self.clear()
+        args = (self.table, self.columns, self.last_id, start_time, self.device)
+        if conn is None:
+            with read_connection(self.db_path) as conn:
+                rows = read_realtime_rows(conn, *args)
+        else:
+            rows = read_realtime_rows(conn, *args)
+        self.append(rows)
+        return len(rows["id"])
+
+    def window(self, start_time: str, end_time: str) -> pd.DataFrame:
+        """
+        取出缓冲区中指定时间范围内的行，按时间排序。
+
+        Args:
+            start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+            end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+
+        Returns:
+            pd.DataFrame: 缓冲区中除 id 外的全部列，timestamp 为带时区的 datetime。
+        """
+        with self.lock:
+            # 按写入顺序排列：缓冲区写满后最早的行位于 head
+            order = (self.head - self.size + np.arange(self.size)) % self.capacity
+            timestamps = self.data["timestamp"][order]
+            mask = (timestamps >= to_epoch(start_time)) & (
+                timestamps <= to_epoch(end_time)
+            )
+            order = order[mask]
+            order = order[np.argsort(self.data["timestamp"][order], kind="stable")]
+            data = pd.DataFrame(
+                {c: self.data[c][order] for c in self.columns if c != "id"}
+            )
+        data["timestamp"] = to_local_time(data["timestamp"])
+        return data
+
+
+# 实时快照读取的列，gpu_info 中除 name 外都是整数列
+REALTIME_GPU_COLUMNS = [
+    "gpu_index",
+    "name",
+    "gpu_utilization",
+    "memory_utilization",
+    "total_memory",
+    "used_memory",
+    "free_memory",
+]
+REALTIME_USER_COLUMNS = ["gpu_index", "user", "gpu_utilization", "used_memory"]
+
+
+class RealtimeReader:
+    """
+    一个数据库（多设备数据库中的一台设备）的实时数据，所有会话共用。
+
+    gpu_info 和 gpu_user_info 各有一个 RealtimeBuffer，snapshot() 在同一个读事务中增量读取两张表，
+    同一时刻只有一个线程读取，避免重复追加同一批行。
+    """
+
+    def __init__(
+        self,
+        db_path: str = "gpu_history.db",
+        device: str | None = None,
+        capacity: int = 16384,
+    ):
+        self.db_path = db_path
+        self.device = device
+        self.gpu = RealtimeBuffer(
+            "gpu_info", REALTIME_GPU_COLUMNS, db_path, capacity, device
+        )
+        self.user = RealtimeBuffer(
+            "gpu_user_info", REALTIME_USER_COLUMNS, db_path, capacity, device
+        )
+        self.lock = threading.Lock()
+
+    def snapshot(self, window: float = 30, end_time: dt.datetime | None = None) -> dict:
+        """
+        读取新写入的行，返回最近 window 秒的实时数据，参数和返回值见 query_realtime_snapshot。
+        """
+        if end_time is None:
+            end_time = dt.datetime.now(tz=dt.timezone.utc)
+        start_time = end_time - dt.timedelta(seconds=window)
+        # 与其他实时查询相同，以 UTC 时间字符串作为时间范围
+        start_time, end_time = (
+            t.astimezone(dt.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            for t in (start_time, end_time)
+        )
+        with self.lock, read_connection(self.db_path) as conn:
+            # 两张表在同一个读事务中读取，得到同一时刻的数据
+            conn.execute("BEGIN")
+            try:
+                self.gpu.update(start_time, conn)
+                self.user.update(start_time, conn)
+            finally:
+                conn.execute("COMMIT")
+        gpu = self.gpu.window(start_time, end_time)
+        user = self.user.window(start_time, end_time)
+
+        if gpu.empty:
+            # 时间范围内没有数据（监控程序可能离线），单独查询最后一次采样
+            latest = query_latest_gpu_info(self.db_path, self.device)
+        else:
+            latest = gpu[gpu["timestamp"] == gpu["timestamp"].max()]
+            latest = latest.sort_values("gpu_index", ignore_index=True)
+            for column in REALTIME_GPU_COLUMNS:
+                if column != "name":
+                    latest[column] = latest[column].astype("Int64")
+            latest["timestamp"] = format_local_time(latest["timestamp"])
+        return {"latest": latest, "gpu": gpu, "user": user}
+
+
+_realtime_readers: dict[tuple, RealtimeReader] = {}
+_realtime_readers_lock = threading.Lock()
+
+
+def query_realtime_snapshot(
+    db_path: str = "gpu_history.db",
+    window: float = 30,
+    end_time: dt.datetime | None = None,
+    device: str | None = None,
+) -> dict:
+    """
+    一次读取实时页面需要的全部数据：最新的 GPU 状态、每台 GPU 和每个用户的使用情况。
+
+    每个数据库（设备）的数据保存在所有会话共用的 RealtimeReader 中，每次调用在一个读事务中
+    只读取 gpu_info 和 gpu_user_info 中新写入的行，不再重复查询已读取的行。
+
+    Args:
+        db_path (str): SQLite 数据库路径。
+        window (float): 时间范围（秒）。
+        end_time (datetime | None): 终止时间，None 表示当前时间。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
+
+    Returns:
+        dict: 包含以下 DataFrame：
+            latest: 最新的 GPU 状态信息，与 query_latest_gpu_info 相同。
+            gpu: 每台 GPU 在每个时刻的使用情况，列为 timestamp、gpu_index、name、
+                gpu_utilization、memory_utilization、total_memory、used_memory、free_memory。
+            user: 每个用户在每台 GPU 上的使用情况，列为 timestamp、gpu_index、user、
+                gpu_utilization、used_memory。
+    """
+    key = (os.path.abspath(db_path), device)
+    with _realtime_readers_lock:
+        if key not in _realtime_readers:
+            _realtime_readers[key] = RealtimeReader(db_path, device)
+        reader = _realtime_readers[key]
+    return reader.snapshot(window, end_time)
+
+
 def get_period_sample_interval(start_time: str, end_time: str) -> int:
     """
     获取指定时间段的采样间隔。
@@ -276,10 +1069,114 @@ def get_period_sample_interval(start_time: str, end_time: str) -> int:
     return interval
 
 
+def get_history_table(
+    conn: sqlite3.Connection,
+    table: str,
+    interval: int,
+    start_time,
+    end_time,
+    device: str | None = None,
+) -> str:
+    """
+    选择满足采样间隔的汇总层级，返回查询的表名或子查询。
+
+    汇总层级只包含已经结束的时间桶。优先使用时间粒度能整除采样间隔的最粗层级，
+    其最后一个时间桶之后的部分依次由更细的层级补齐（UNION ALL），分界点向下对齐到采样间隔，
+    同一个采样点的数据只来自一个层级。层级的最早数据晚于需要补齐的起点、而更细的层级有更早的数据时
+    （已过期或开始汇总较晚），跳过该层级。这些层级在查询范围内都没有数据时，依次尝试更粗的层级。
+
+    Args:
+        conn (sqlite3.Connection): SQLite 数据库连接。
+        table (str): 基础表名，"gpu_history" 或 "gpu_user_history"。
+        interval (int): 采样间隔（秒）。
+        start_time: 起始时间，格式与数据库中的时间戳一致（见 time_params）。
+        end_time: 终止时间，格式与数据库中的时间戳一致（见 time_params）。
+        device (str | None): 多设备数据库中只检查该设备的数据。
+
+    Returns:
+        str: 用于 FROM 子句的表名或子查询。
+    """
+    interval = int(interval)
+    query = "SELECT name FROM sqlite_master WHERE type = 'table'"
+    tables = {row[0] for row in conn.execute(query)}
+    condition, device_params = device_filter(device)
+    finer = [
+        (f"{table}{suffix}", period)
+        for suffix, period in HISTORY_TIERS[::-1]
+        if period <= interval
+        and interval % period == 0
+        and f"{table}{suffix}" in tables
+    ]
+    coarser = [
+        f"{table}{suffix}"
+        for suffix, period in HISTORY_TIERS
+        if period > interval and f"{table}{suffix}" in tables
+    ]
+
+    if get_schema_version(conn) >= EPOCH_SCHEMA_VERSION:
+        # 各层级最早和最后一个时间桶的起点，每个值都只需在索引上查找一次
+        bounds = []
+        for name, _ in finer:
+            query = f"""
+                SELECT
+                    (SELECT MIN(timestamp) FROM {name} WHERE 1{condition}),
+                    (SELECT MAX(timestamp) FROM {name} WHERE 1{condition})
+            """
+            bounds.append(conn.execute(query, device_params * 2).fetchone())
+
+        # 从粗到细选择层级，每个层级查询 [lower, upper)，基础表没有上界
+        segments = []
+        lower = start_time
+        for i, ((name, period), (first, last)) in enumerate(zip(finer, bounds)):
+            if first is None or first > end_time:
+                continue
+            earlier = [b[0] for b in bounds[i + 1 :] if b[0] is not None]
+            if first > lower and earlier and min(earlier) < first:
+                continue
+            upper = None if name == table else (last + period) // interval * interval
+            if upper is not None and upper <= lower:
+                continue
+            segments.append((name, lower, upper))
+            lower = upper
+            if upper is None or upper > end_time:
+                break
+
+        if len(segments) == 1:
+            return segments[0][0]
+        if segments:
+            query = f"PRAGMA table_info({table})"
+            columns = ", ".join(row[1] for row in conn.execute(query) if row[1] != "id")
+            parts = []
+            for i, (name, lower, upper) in enumerate(segments):
+                # 汇总层级的时间桶 [b, b + period) 包含基础表中时间戳（窗口结束时间）在 (b, b + period] 中的行
+                operator = ">" if name == table else ">="
+                conditions = [] if i == 0 else [f"timestamp {operator} {int(lower)}"]
+                if upper is not None:
+                    conditions.append(f"timestamp < {int(upper)}")
+                parts.append(
+                    f"SELECT {columns} FROM {name} WHERE {' AND '.join(conditions)}"
+                )
+            return f"({' UNION ALL '.join(parts)})"
+        # 能整除采样间隔的层级在查询范围内都没有数据
+        finer = []
+
+    for name in [name for name, _ in finer] + coarser:
+        query = f"""
+            SELECT 1 FROM {name}
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            LIMIT 1
+        """
+        if conn.execute(query, (start_time, end_time) + device_params).fetchone():
+            return name
+    return table
+
+
+@cached_query
 def query_gpu_history_usage(
     start_time: str,
     end_time: str,
     db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的 GPU 使用情况，并进行间隔采样以减小数据量。
@@ -288,6 +1185,7 @@ def query_gpu_history_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: GPU 使用情况。
@@ -295,43 +1193,42 @@ def query_gpu_history_usage(
     logger.trace(
         f"Querying GPU history usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 根据时间段计算采样间隔，并选择对应的汇总层级
+        interval = get_period_sample_interval(start_time, end_time)
+        table = get_history_table(conn, "gpu_history", interval, *params, device=device)
+
+        # SQL 查询
+        query = f"""
+            WITH AlignedData AS (
+                SELECT
+                    gpu_index,
+                    -- 将时间戳对齐到采样间隔
+                    {bucket_expr(version, interval)} AS aligned_timestamp,
+                    AVG(gpu_utilization) AS gpu_utilization,
+                    MIN(gpu_utilization_min) AS gpu_utilization_min,
+                    MAX(gpu_utilization_max) AS gpu_utilization_max,
+                    AVG(used_memory) AS used_memory,
+                    MIN(used_memory_min) AS used_memory_min,
+                    MAX(used_memory_max) AS used_memory_max
+                FROM {table}
+                WHERE timestamp BETWEEN ? AND ?{condition}
+                GROUP BY gpu_index, aligned_timestamp
+            )
+            SELECT *
+            FROM AlignedData
+            ORDER BY aligned_timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
 
-    # 根据时间段计算采样间隔
-    interval = get_period_sample_interval(start_time, end_time)
-
-    # SQL 查询
-    query = f"""
-        WITH AlignedData AS (
-            SELECT
-                gpu_index,
-                -- 将时间戳对齐到采样间隔
-                DATETIME(FLOOR(UNIXEPOCH(timestamp) / {interval}) * {interval}, 'unixepoch') AS aligned_timestamp,
-                AVG(gpu_utilization) AS gpu_utilization,
-                MIN(gpu_utilization_min) AS gpu_utilization_min,
-                MAX(gpu_utilization_max) AS gpu_utilization_max,
-                AVG(used_memory) AS used_memory,
-                MIN(used_memory_min) AS used_memory_min,
-                MAX(used_memory_max) AS used_memory_max
-            FROM gpu_history
-            WHERE timestamp BETWEEN ? AND ?
-            GROUP BY gpu_index, aligned_timestamp
-        )
-        SELECT *
-        FROM AlignedData
-        ORDER BY aligned_timestamp
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-
-    conn.close()
     logger.trace("Query GPU history usage completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["aligned_timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-    )
+    data["timestamp"] = to_local_time(data["aligned_timestamp"])
 
     # if use_resample and len(data) > 500:
     #     freq = len(data) // 36 + 1
@@ -361,8 +1258,12 @@ def query_gpu_history_usage(
     return data
 
 
+@cached_query
 def query_gpu_history_average_usage(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的 GPU 平均使用情况。
@@ -371,6 +1272,7 @@ def query_gpu_history_average_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: GPU 平均使用情况。
@@ -378,20 +1280,29 @@ def query_gpu_history_average_usage(
     logger.trace(
         f"Querying GPU history average usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+        table = get_history_table(
+            conn,
+            "gpu_history",
+            get_period_sample_interval(start_time, end_time),
+            *params,
+            device=device,
+        )
 
-    # 查询 GPU 信息
-    query = """
-        SELECT 
-            gpu_index,
-            AVG(gpu_utilization) AS avg_gpu_utilization,
-            AVG(used_memory) AS avg_used_memory
-        FROM gpu_history
-        WHERE timestamp BETWEEN ? AND ?
-        GROUP BY gpu_index
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+        # 查询 GPU 信息
+        query = f"""
+            SELECT 
+                gpu_index,
+                AVG(gpu_utilization) AS avg_gpu_utilization,
+                AVG(used_memory) AS avg_used_memory
+            FROM {table}
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            GROUP BY gpu_index
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query GPU history average usage completed")
 
     # 将显存相关字段转换为 GB
@@ -400,8 +1311,12 @@ def query_gpu_history_average_usage(
     return data
 
 
+@cached_query
 def query_gpu_user_history_list(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的用户列表。
@@ -410,6 +1325,7 @@ def query_gpu_user_history_list(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: 用户列表。
@@ -417,25 +1333,36 @@ def query_gpu_user_history_list(
     logger.trace(
         f"Querying GPU user history list from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+        table = get_history_table(
+            conn,
+            "gpu_user_history",
+            get_period_sample_interval(start_time, end_time),
+            *params,
+            device=device,
+        )
 
-    # 查询用户列表
-    query = """
-        SELECT DISTINCT user
-        FROM gpu_user_history
-        WHERE timestamp BETWEEN ? AND ?
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+        # 查询用户列表
+        query = f"""
+            SELECT DISTINCT user
+            FROM {table}
+            WHERE timestamp BETWEEN ? AND ?{condition}
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query GPU user history list completed")
 
     return data
 
 
+@cached_query
 def query_gpu_user_history_usage(
     start_time: str,
     end_time: str,
     db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> tuple[dict, pd.DatetimeIndex]:
     """
     查询指定时间范围内的用户 GPU 使用情况，并进行间隔采样以减小数据量。
@@ -444,6 +1371,7 @@ def query_gpu_user_history_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         tuple[dict, pd.DatetimeIndex]: 用户 GPU 使用情况和时间索引。
@@ -451,39 +1379,40 @@ def query_gpu_user_history_usage(
     logger.trace(
         f"Querying GPU user history usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
-
-    # 根据时间段计算采样间隔
-    interval = get_period_sample_interval(start_time, end_time)
-
-    # SQL 查询
-    query = f"""
-        WITH AlignedData AS (
-            SELECT
-                user,
-                gpu_index,
-                -- 将时间戳对齐到采样间隔
-                DATETIME(FLOOR(UNIXEPOCH(timestamp) / {interval}) * {interval}, 'unixepoch') AS aligned_timestamp,
-                AVG(gpu_utilization) AS gpu_utilization,
-                AVG(used_memory) AS used_memory
-            FROM gpu_user_history
-            WHERE timestamp BETWEEN ? AND ?
-            GROUP BY user, gpu_index, aligned_timestamp
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 根据时间段计算采样间隔，并选择对应的汇总层级
+        interval = get_period_sample_interval(start_time, end_time)
+        table = get_history_table(
+            conn, "gpu_user_history", interval, *params, device=device
         )
-        SELECT *
-        FROM AlignedData
-        ORDER BY aligned_timestamp
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+
+        # SQL 查询
+        query = f"""
+            WITH AlignedData AS (
+                SELECT
+                    user,
+                    gpu_index,
+                    -- 将时间戳对齐到采样间隔
+                    {bucket_expr(version, interval)} AS aligned_timestamp,
+                    AVG(gpu_utilization) AS gpu_utilization,
+                    AVG(used_memory) AS used_memory
+                FROM {table}
+                WHERE timestamp BETWEEN ? AND ?{condition}
+                GROUP BY user, gpu_index, aligned_timestamp
+            )
+            SELECT *
+            FROM AlignedData
+            ORDER BY aligned_timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query GPU user history usage completed")
 
     # 将时间戳转换为 datetime 类型
-    data["timestamp"] = (
-        pd.to_datetime(data["aligned_timestamp"])
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Shanghai")
-    )
+    data["timestamp"] = to_local_time(data["aligned_timestamp"])
     max_time = data["timestamp"].max()
     min_time = data["timestamp"].min()
 
@@ -536,8 +1465,103 @@ def query_gpu_user_history_usage(
     )
 
 
+@cached_query
+def query_gpu_user_history_matrix(
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
+) -> dict:
+    """
+    查询指定时间范围内的用户 GPU 使用情况，以列式矩阵返回。
+
+    与 query_gpu_user_history_usage 相同按采样间隔对齐，但不为每个 (用户, GPU) 分别补齐时间点：
+    所有 (用户, GPU) 共用一条时间轴，查询结果一次放入 时间点 × (用户, GPU) 的矩阵，没有数据的位置为 0。
+
+    Args:
+        start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
+
+    Returns:
+        dict: 包含以下字段：
+            timestamp (pd.DatetimeIndex): 共用的时间轴，长度为 T。
+            user (np.ndarray): 每列的用户名，长度为 K，按用户名和 GPU 编号排序。
+            gpu_index (np.ndarray): 每列的 GPU 编号，长度为 K。
+            gpu_utilization (np.ndarray): T × K 的 GPU 使用率。
+            used_memory (np.ndarray): T × K 的显存用量（GB）。
+    """
+    logger.trace(
+        f"Querying GPU user history matrix from {start_time} to {end_time} in {db_path}"
+    )
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 根据时间段计算采样间隔，并选择对应的汇总层级
+        interval = int(get_period_sample_interval(start_time, end_time))
+        table = get_history_table(
+            conn, "gpu_user_history", interval, *params, device=device
+        )
+
+        query = f"""
+            SELECT
+                user,
+                gpu_index,
+                {bucket_expr(version, interval)} AS aligned_timestamp,
+                AVG(gpu_utilization) AS gpu_utilization,
+                AVG(used_memory) AS used_memory
+            FROM {table}
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            GROUP BY user, gpu_index, aligned_timestamp
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
+    logger.trace("Query GPU user history matrix completed")
+
+    # 与按 (用户, GPU) 分组相同，忽略用户或 GPU 为空的记录
+    data = data.dropna(subset=["user", "gpu_index"])
+    if data.empty:
+        return {
+            "timestamp": pd.DatetimeIndex([], tz=DISPLAY_TIMEZONE),
+            "user": np.array([], dtype=object),
+            "gpu_index": np.array([], dtype=np.int64),
+            "gpu_utilization": np.zeros((0, 0)),
+            "used_memory": np.zeros((0, 0)),
+        }
+
+    # 数据晚于起始时间开始时，时间轴最前面多一个时间点，图表从 0 开始
+    epochs = data["aligned_timestamp"].to_numpy(dtype=np.int64)
+    first, last = epochs.min(), epochs.max()
+    if first > to_epoch(start_time):
+        first -= interval
+    rows = (epochs - first) // interval
+    columns, labels = pd.MultiIndex.from_arrays(
+        [data["user"], data["gpu_index"]]
+    ).factorize(sort=True)
+
+    shape = ((last - first) // interval + 1, len(labels))
+    result = {
+        "timestamp": pd.DatetimeIndex(
+            to_local_time(np.arange(first, last + 1, interval))
+        ),
+        "user": labels.get_level_values(0).to_numpy(dtype=object),
+        "gpu_index": labels.get_level_values(1).to_numpy(dtype=np.int64),
+    }
+    for column, scale in (("gpu_utilization", 1), ("used_memory", 0x40000000)):
+        matrix = np.zeros(shape)
+        matrix[rows, columns] = data[column].to_numpy(dtype=np.float64) / scale
+        result[column] = matrix
+    return result
+
+
+@cached_query
 def query_gpu_user_history_total_usage(
-    start_time: str, end_time: str, db_path: str = "gpu_history.db"
+    start_time: str,
+    end_time: str,
+    db_path: str = "gpu_history.db",
+    device: str | None = None,
 ) -> pd.DataFrame:
     """
     查询指定时间范围内的用户 GPU 总用量。
@@ -546,6 +1570,7 @@ def query_gpu_user_history_total_usage(
         start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
         db_path (str): SQLite 数据库路径。
+        device (str | None): 多设备数据库中只查询该设备，None 表示单设备数据库。
 
     Returns:
         pd.DataFrame: 用户 GPU 总用量。
@@ -553,30 +1578,32 @@ def query_gpu_user_history_total_usage(
     logger.trace(
         f"Querying GPU user history total usage from {start_time} to {end_time} in {db_path}"
     )
-    conn = sqlite3.connect(db_path)
-
-    # 先查询总的历史记录数量作为总时间
-    query = """
-        SELECT COUNT(*) AS total_count
-        FROM gpu_history
-        WHERE timestamp BETWEEN ? AND ?
-    """
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+        condition, device_params = device_filter(device)
+
+        # 先查询总的历史记录数量作为总时间
+        query = f"""
+            SELECT COUNT(*) AS total_count
+            FROM gpu_history
+            WHERE timestamp BETWEEN ? AND ?{condition}
+        """
 
-    total_count = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    total_count = total_count["total_count"].iloc[0]
+        total_count = pd.read_sql_query(query, conn, params=params + device_params)
+        total_count = total_count["total_count"].iloc[0]
 
-    # 查询用户 GPU 总用量
-    query = """
-        SELECT 
-            user,
-            SUM(gpu_utilization) AS 平均GPU用量,
-            SUM(used_memory) AS 平均显存用量
-        FROM gpu_user_history
-        WHERE timestamp BETWEEN ? AND ?
-        GROUP BY user
-    """
-    data = pd.read_sql_query(query, conn, params=(start_time, end_time))
-    conn.close()
+        # 查询用户 GPU 总用量
+        query = f"""
+            SELECT 
+                user,
+                SUM(gpu_utilization) AS 平均GPU用量,
+                SUM(used_memory) AS 平均显存用量
+            FROM gpu_user_history
+            WHERE timestamp BETWEEN ? AND ?{condition}
+            GROUP BY user
+        """
+        data = pd.read_sql_query(query, conn, params=params + device_params)
     logger.trace("Query GPU user history total usage completed")
 
     # 计算总用量
@@ -584,3 +1611,164 @@ def query_gpu_user_history_total_usage(
     data["平均显存用量"] = (data["平均显存用量"] / 0x40000000 / total_count).round(1)
 
     return data
+
+
+def query_device_list(db_path: str = "gpu_hub.db") -> list[str]:
+    """
+    查询多设备数据库中的设备列表。
+
+    Args:
+        db_path (str): 多设备 SQLite 数据库路径。
+
+    Returns:
+        list[str]: 按名称排序的设备名。
+    """
+    with read_connection(db_path) as conn:
+        query = f"""
+            {DEVICES_CTE.format(table="gpu_history")}
+            SELECT device FROM devices WHERE device IS NOT NULL
+        """
+        devices = [row[0] for row in conn.execute(query)]
+    return devices
+
+
+def query_fleet_latest_gpu_info(db_path: str = "gpu_hub.db") -> pd.DataFrame:
+    """
+    查询多设备数据库中每台设备最新的 GPU 状态信息。
+
+    Args:
+        db_path (str): 多设备 SQLite 数据库路径。
+
+    Returns:
+        pd.DataFrame: 每台设备最新的 GPU 状态信息，device 列为设备名。
+    """
+    logger.trace(f"Querying fleet latest GPU info from {db_path}")
+    with read_connection(db_path) as conn:
+
+        # 每台设备的最新时间戳都只需在以 device 开头的索引中查找一次
+        query = f"""
+            {DEVICES_CTE.format(table="gpu_info")}
+            SELECT gpu_info.*
+            FROM devices
+            JOIN gpu_info
+            ON gpu_info.device = devices.device
+            AND gpu_info.timestamp = (
+                SELECT MAX(timestamp)
+                FROM gpu_info AS latest
+                WHERE latest.device = devices.device
+            )
+            ORDER BY gpu_info.device, gpu_index
+        """
+        data = pd.read_sql_query(query, conn)
+    logger.trace("Query fleet latest GPU info completed")
+
+    data["timestamp"] = format_local_time(to_local_time(data["timestamp"]))
+
+    return data
+
+
+@cached_query
+def query_fleet_history_usage(
+    start_time: str, end_time: str, db_path: str = "gpu_hub.db"
+) -> pd.DataFrame:
+    """
+    查询多设备数据库中每台设备在指定时间范围内的整体使用情况，按采样间隔对齐。
+
+    Args:
+        start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        db_path (str): 多设备 SQLite 数据库路径。
+
+    Returns:
+        pd.DataFrame: 每台设备每个时间点的平均 GPU 使用率、平均显存用量（GB）和
+            GPU 数量，列为 device、timestamp、gpu_utilization、used_memory、gpu_count。
+    """
+    logger.trace(
+        f"Querying fleet history usage from {start_time} to {end_time} in {db_path}"
+    )
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+
+        interval = get_period_sample_interval(start_time, end_time)
+        table = get_history_table(conn, "gpu_history", interval, *params)
+
+        query = f"""
+            SELECT
+                device,
+                {bucket_expr(version, interval)} AS aligned_timestamp,
+                AVG(gpu_utilization) AS gpu_utilization,
+                AVG(used_memory) AS used_memory,
+                COUNT(DISTINCT gpu_index) AS gpu_count
+            FROM {table}
+            WHERE timestamp BETWEEN ? AND ?
+            GROUP BY device, aligned_timestamp
+            ORDER BY aligned_timestamp, device
+        """
+        data = pd.read_sql_query(query, conn, params=params)
+    logger.trace("Query fleet history usage completed")
+
+    data["timestamp"] = to_local_time(data.pop("aligned_timestamp"))
+    data["used_memory"] = data["used_memory"] / 0x40000000
+
+    return data
+
+
+@cached_query
+def query_fleet_user_total_usage(
+    start_time: str, end_time: str, db_path: str = "gpu_hub.db"
+) -> pd.DataFrame:
+    """
+    查询多设备数据库中每台设备上每个用户在指定时间范围内的 GPU 总用量。
+
+    与 query_gpu_user_history_total_usage 相同，用量按该设备的历史记录数量平均。
+
+    Args:
+        start_time (str): 起始时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        end_time (str): 终止时间，格式为 "YYYY-MM-DD HH:MM:SS"。
+        db_path (str): 多设备 SQLite 数据库路径。
+
+    Returns:
+        pd.DataFrame: 列为 device、user、平均GPU用量、平均显存用量。
+    """
+    logger.trace(
+        f"Querying fleet user total usage from {start_time} to {end_time} in {db_path}"
+    )
+    with read_connection(db_path) as conn:
+        version = get_schema_version(conn)
+        params = time_params(version, start_time, end_time)
+
+        # 先分别按设备汇总，再按设备连接，避免逐行连接
+        query = """
+            WITH Totals AS (
+                SELECT device, COUNT(*) AS total_count
+                FROM gpu_history
+                WHERE timestamp BETWEEN ? AND ?
+                GROUP BY device
+            ),
+            Usage AS (
+                SELECT
+                    device,
+                    user,
+                    SUM(gpu_utilization) AS gpu_utilization,
+                    SUM(used_memory) AS used_memory
+                FROM gpu_user_history
+                WHERE timestamp BETWEEN ? AND ?
+                GROUP BY device, user
+            )
+            SELECT
+                device,
+                user,
+                gpu_utilization * 1.0 / total_count AS 平均GPU用量,
+                used_memory * 1.0 / total_count AS 平均显存用量
+            FROM Usage
+            JOIN Totals USING (device)
+            ORDER BY device, user
+        """
+        data = pd.read_sql_query(query, conn, params=params + params)
+    logger.trace("Query fleet user total usage completed")
+
+    data["平均GPU用量"] = data["平均GPU用量"].round(1)
+    data["平均显存用量"] = (data["平均显存用量"] / 0x40000000).round(1)
+
+    return data
@@ -0,0 +1,832 @@
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from GPU_logger import *
+from GPU_fake_nvml import FakeNVML
+from GPU_protocol import (
+    COMPACT_VERSION,
+    FrameDecoder,
+    decode_message,
+    decode_messages,
+    encode_batch,
+    encode_message,
+    encode_record,
+    encode_records,
+    message_payload,
+)
+from GPU_data_receiver import DeviceWriter, GPUDataProtocol, parse_timestamp, serve
+from GPU_data_sender import SpoolSender
+from GPU_spool import MessageSpool
+
+
+def summarize(name, latencies):
+    latencies = np.asarray(latencies) * 1000
+    print(
+        f"{name:<24} n={len(latencies):<6} mean={latencies.mean():8.3f} ms  "
+        f"p50={np.percentile(latencies, 50):8.3f} ms  p99={np.percentile(latencies, 99):8.3f} ms"
+    )
+
+
+def make_gpu_info(n_gpus=8, n_procs=4, n_users=3, seed=0):
+    rng = np.random.default_rng(seed)
+    gpu_info = []
+    for i in range(n_gpus):
+        gpu_info.append(
+            {
+                "gpu_index": i,
+                "name": "NVIDIA A100-SXM4-80GB",
+                "gpu_utilization": int(rng.integers(0, 101)),
+                "memory_utilization": int(rng.integers(0, 101)),
+                "total_memory": 80 * 0x40000000,
+                "used_memory": int(rng.integers(0, 80 * 0x40000000)),
+                "free_memory": 0,
+                "processes": [
+                    {
+                        "pid": 10000 + i * n_procs + j,
+                        "user": f"user{j % n_users}",
+                        "used_memory": int(rng.integers(0, 20 * 0x40000000)),
+                        "cpu_usage": float(rng.uniform(0, 100)),
+                        "name": "python",
+                    }
+                    for j in range(n_procs)
+                ],
+            }
+        )
+    return gpu_info
+
+
+# 比较每次采样重新初始化 NVML 与长期持有 NVML 会话的单次采样延迟，fake 为 True 时使用模拟的 NVML 和进程信息
+def bench_sampling(n=100, fake=False):
+    nvml = FakeNVML() if fake else pynvml
+    processes = nvml.processes if fake else None
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        get_gpu_info(nvml=nvml, processes=processes)
+        latencies.append(time.perf_counter() - start)
+    summarize("get_gpu_info", latencies)
+
+    collector = GPUCollector(nvml=nvml, processes=processes)
+    collector.sample()  # 预热：初始化 NVML 会话
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        collector.sample()
+        latencies.append(time.perf_counter() - start)
+    collector.close()
+    summarize("GPUCollector.sample", latencies)
+
+
+# 比较 update_database 与 DatabaseWriter 的写入吞吐量
+def bench_writer(n=1000, n_gpus=8, n_procs=4, commit_every=(1, 10)):
+    gpu_info = make_gpu_info(n_gpus, n_procs)
+    rows_per_sample = len(gpu_info) + sum(len(get_user_usage(gpu)) for gpu in gpu_info)
+    start_time = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    timestamps = [start_time + dt.timedelta(seconds=i) for i in range(n)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "update_database.db")
+        initialize_database(db_path=db_path)
+        start = time.perf_counter()
+        for timestamp in timestamps:
+            update_database(gpu_info, timestamp, db_path=db_path)
+        elapsed = time.perf_counter() - start
+        print(f"{'update_database':<32} {n * rows_per_sample / elapsed:10.0f} rows/s")
+
+        for k in commit_every:
+            db_path = os.path.join(tmp_dir, f"writer_{k}.db")
+            initialize_database(db_path=db_path)
+            writer = DatabaseWriter(db_path=db_path, commit_every=k)
+            start = time.perf_counter()
+            for timestamp in timestamps:
+                writer.write(gpu_info, timestamp)
+            writer.close()
+            elapsed = time.perf_counter() - start
+            print(f"{f'DatabaseWriter(commit_every={k})':<32} {n * rows_per_sample / elapsed:10.0f} rows/s")
+
+
+# 在模拟的 NVML 上比较普通采样与高频采样的单次采样延迟、每秒采样点数以及实时数据库中每个采样点占用的空间
+def bench_high_res(n=300, n_gpus=8):
+    clock = [time.time()]
+    for high_res in (False, True):
+        collector = GPUCollector(high_res=high_res, nvml=FakeNVML(n_gpus=n_gpus, clock=lambda: clock[0]))
+        collector.sample()  # 预热：初始化会话并读出缓冲区中已有的采样点
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "gpu_info.db")
+            initialize_database(db_path=db_path)
+            writer = DatabaseWriter(db_path=db_path)
+            latencies = []
+            points = 0
+            for _ in range(n):
+                clock[0] += 1
+                start = time.perf_counter()
+                gpu_info = collector.sample()
+                latencies.append(time.perf_counter() - start)
+                points += sum(len(p) for gpu in gpu_info for p in gpu.get("samples", {}).values())
+                writer.write(gpu_info, clock[0])
+            writer.close()
+            collector.close()
+            summarize(f"sample(high_res={high_res})", latencies)
+            if points:
+                conn = sqlite3.connect(db_path)
+                blob_bytes = conn.execute("SELECT SUM(LENGTH(offsets) + LENGTH(vals)) FROM gpu_samples").fetchone()[0]
+                conn.close()
+                print(
+                    f"{'':<24} {points / n:.1f} points/s, {blob_bytes / points:.1f} blob bytes/point, "
+                    f"{os.path.getsize(db_path) / points:.1f} db bytes/point"
+                )
+
+
+class SlowRecorder:
+    # 模拟数据库写入：每次 delay 秒，每 stall_every 次额外停顿 stall 秒（如 VACUUM）
+    def __init__(self, delay=0.002, stall=0.5, stall_every=20):
+        self.delay = delay
+        self.stall = stall
+        self.stall_every = stall_every
+        self.records = 0
+
+    def record(self, gpu_info, curr_time):
+        self.records += 1
+        time.sleep(self.delay + (self.stall if self.records % self.stall_every == 0 else 0))
+
+    def close(self):
+        pass
+
+
+class TimedCollector:
+    # 记录每次采样开始的单调时钟时间
+    def __init__(self, collector):
+        self.collector = collector
+        self.starts = []
+
+    def sample(self):
+        self.starts.append(time.monotonic())
+        return self.collector.sample()
+
+
+def summarize_ticks(name, starts, interval, duration):
+    starts = np.asarray(starts)
+    # 相对第一次采样的理想节拍的偏差
+    offsets = (starts - starts[0]) / interval
+    jitter = np.abs(offsets - np.round(offsets)) * interval * 1000
+    print(
+        f"{name:<24} samples={len(starts):<5} expected={int(duration / interval):<5} "
+        f"drift={(starts[-1] - starts[0]) - (len(starts) - 1) * interval:7.3f} s  "
+        f"p99 phase error={np.percentile(jitter, 99):7.3f} ms"
+    )
+
+
+# 比较 sleep 循环与 SamplingPipeline 在数据库写入偶尔停顿时的采样节拍
+def bench_pipeline(duration=10.0, interval=0.1, n_gpus=8):
+    collector = TimedCollector(GPUCollector(nvml=FakeNVML(n_gpus=n_gpus)))
+    collector.sample()
+    collector.starts = []
+    recorder = SlowRecorder()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        gpu_info = collector.sample()
+        recorder.record(gpu_info, dt.datetime.now(tz=dt.timezone.utc))
+        time.sleep(interval)
+    summarize_ticks("sleep loop", collector.starts, interval, duration)
+
+    collector.starts = []
+    pipeline = SamplingPipeline(collector, SlowRecorder(), interval=interval, queue_size=16)
+    pipeline.run(max_ticks=int(duration / interval))
+    pipeline.close()
+    collector.collector.close()
+    summarize_ticks("SamplingPipeline", collector.starts, interval, duration)
+    print(f"{'':<24} {pipeline.stats}")
+
+
+def database_size(db_path):
+    # 数据库文件及其 WAL 文件的大小
+    wal_path = db_path + "-wal"
+    return os.path.getsize(db_path), os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+
+# 在模拟的 NVML 上以加速时钟驱动完整的记录流程（采样 → 实时写入 → 聚合 → 清理），比较最初的逐次写入流程与 GPURecorder
+def bench_end_to_end(hours=2.0, n_gpus=8, n_procs=2, aggr_period=30, realtime_period=3600):
+    n = int(hours * 3600)
+    start_time = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    print(f"{n} ticks ({hours} simulated hours), {n_gpus} GPUs x {n_procs} processes")
+
+    for mode in ("legacy", "recorder"):
+        clock = [start_time.timestamp()]
+        fake = FakeNVML(n_gpus=n_gpus, n_procs=n_procs, clock=lambda: clock[0])
+        collector = GPUCollector(nvml=fake, processes=fake.processes)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "gpu_history.db")
+            db_realtime_path = os.path.join(tmp_dir, "gpu_info.db")
+            initialize_database(db_path=db_path)
+            initialize_database(db_path=db_realtime_path)
+            if mode == "recorder":
+                recorder = GPURecorder(
+                    db_path=db_path,
+                    db_realtime_path=db_realtime_path,
+                    aggr_period=aggr_period,
+                    realtime_period=realtime_period,
+                )
+            timestamp_last = start_time
+
+            latencies = []
+            growth = []
+            bench_start = time.perf_counter()
+            for i in range(n):
+                clock[0] += 1
+                curr_time = start_time + dt.timedelta(seconds=i + 1)
+                tick_start = time.perf_counter()
+                gpu_info = collector.sample()
+                if mode == "legacy":
+                    update_database(gpu_info, curr_time, db_path=db_realtime_path)
+                    if (curr_time - timestamp_last).seconds >= aggr_period - 1:
+                        timestamp_last = curr_time
+                        aggregate_data(curr_time, aggr_period, db_path=db_path, db_realtime_path=db_realtime_path)
+                        remove_old_data(curr_time, period_s=realtime_period, db_path=db_realtime_path)
+                else:
+                    recorder.record(gpu_info, curr_time)
+                latencies.append(time.perf_counter() - tick_start)
+                if (i + 1) % 3600 == 0:
+                    growth.append((database_size(db_realtime_path), database_size(db_path)))
+            elapsed = time.perf_counter() - bench_start
+            if mode == "recorder":
+                recorder.close()
+            collector.close()
+
+            print(f"{mode:<10} {n / elapsed:8.0f} samples/s")
+            summarize("  tick latency", latencies)
+            for hour, ((realtime_size, realtime_wal), (history_size, history_wal)) in enumerate(growth, 1):
+                print(
+                    f"{'':<12}after {hour:>3} h: "
+                    f"realtime DB {realtime_size / 1e6:7.2f} MB + {realtime_wal / 1e6:.2f} MB WAL, "
+                    f"history DB {history_size / 1e6:7.2f} MB + {history_wal / 1e6:.2f} MB WAL"
+                )
+
+
+def parse_json_stream(chunks):
+    # 原接收端的解析方式：每收到一块数据就对整个缓冲区重试 json.loads，返回成功解析的消息数
+    messages = 0
+    buffer = b""
+    for data in chunks:
+        buffer += data
+        try:
+            json.loads(buffer.decode("utf-8"))
+            messages += 1
+            buffer = b""
+        except json.JSONDecodeError:
+            if data[-1] == ord("}"):
+                buffer = b""
+    return messages
+
+
+def parse_frame_stream(chunks):
+    messages = 0
+    decoder = FrameDecoder()
+    for data in chunks:
+        while data:
+            buffer = decoder.get_buffer()
+            n = min(len(buffer), len(data))
+            buffer[:n] = data[:n]
+            data = data[n:]
+            for version, payload in decoder.buffer_updated(n):
+                decode_message(version, payload)
+                messages += 1
+    return messages
+
+
+# 比较原 JSON 缓冲解析与长度前缀帧解析：数据按 recv_size 切块到达，每块可能包含多条消息的一部分
+def bench_framing(n=200, n_gpus=8, n_procs=4, recv_size=4096):
+    fake = FakeNVML(n_gpus=n_gpus, n_procs=n_procs)
+    collector = GPUCollector(high_res=True, nvml=fake, processes=fake.processes)
+    gpu_info = collector.sample()
+    collector.close()
+    timestamp = dt.datetime(2024, 1, 1).isoformat()
+    message = json.dumps({"magic": 23333, "timestamp": timestamp, "gpu_info": gpu_info}).encode("utf-8")
+    frame = encode_message(timestamp, gpu_info)
+    print(f"message size: {len(message)} bytes, {n} messages, {recv_size}-byte reads")
+
+    for name, parse, stream in (
+        ("json buffer (one message per read)", parse_json_stream, [message] * n),
+        ("json buffer", parse_json_stream, [message * n]),
+        ("frame decoder", parse_frame_stream, [frame * n]),
+    ):
+        # 按 recv_size 切块模拟 socket 读取
+        chunks = [data[i : i + recv_size] for data in stream for i in range(0, len(data), recv_size)]
+        start = time.perf_counter()
+        messages = parse(chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<36} {messages:>5}/{n} messages decoded, {n / elapsed:10.0f} messages/s")
+
+
+def time_per_message(func, n, repeat=3):
+    # 多次执行取最短耗时，返回每条消息的微秒数
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e6
+
+
+# 比较版本 1 的 JSON 编码与版本 2 的紧凑编码（可选 zstd 压缩）的每条消息字节数和编解码耗时
+def bench_encoding(n=600, n_gpus=8, n_procs=2, batch_sizes=(1, 60, 600)):
+    start_time = dt.datetime(2024, 1, 1, 8)
+    clock = [start_time.timestamp()]
+    # 每分钟更换任务（进程和用户），利用率和显存占用逐秒波动，避免连续的消息完全相同而高估压缩率
+    fake = FakeNVML(n_gpus=n_gpus, n_procs=n_procs, job_period=60, noise=0.1, clock=lambda: clock[0])
+    samples = {}
+    for high_res in (False, True):
+        collector = GPUCollector(high_res=high_res, nvml=fake, processes=fake.processes)
+        samples[high_res] = []
+        for i in range(n):
+            clock[0] += 1
+            samples[high_res].append(((start_time + dt.timedelta(seconds=i)).isoformat(), collector.sample()))
+        collector.close()
+
+    print(f"{n} messages, {n_gpus} GPUs, {n_procs} processes per busy GPU")
+    for high_res, messages in samples.items():
+        for batch_size in batch_sizes:
+            batches = [messages[i : i + batch_size] for i in range(0, n, batch_size)]
+            print(f"high_res={high_res}, {batch_size} messages per frame")
+
+            def encode_json():
+                return [
+                    encode_batch([message_payload(ts, gpu_info, "node000") for ts, gpu_info in batch])
+                    for batch in batches
+                ]
+
+            def encode_compact(compression):
+                return [
+                    encode_records(
+                        [encode_record(ts, gpu_info, "node000") for ts, gpu_info in batch], COMPACT_VERSION, compression
+                    )
+                    for batch in batches
+                ]
+
+            for name, encode in (
+                ("json", encode_json),
+                ("compact", lambda: encode_compact(None)),
+                ("compact+zstd", lambda: encode_compact("zstd")),
+            ):
+                frames = encode()
+                size = sum(len(frame) for frame in frames) / n
+                parsed = []
+                for frame in frames:
+                    decoder = FrameDecoder(size=len(frame))
+                    buffer = decoder.get_buffer()
+                    buffer[: len(frame)] = frame
+                    parsed += [(version, bytes(payload)) for version, payload in decoder.buffer_updated(len(frame))]
+                encode_us = time_per_message(encode, n)
+                decode_us = time_per_message(
+                    lambda: [decode_messages(version, payload) for version, payload in parsed], n
+                )
+                print(f"  {name:<14} {size:9.0f} bytes/message  encode {encode_us:7.1f} us  decode {decode_us:7.1f} us")
+
+
+# 比较发送全部原始采样与发送端本地聚合：网络字节数、发送端和接收端的 CPU 时间
+def bench_edge(duration=3600, n_gpus=8, n_procs=2, aggr_period=30):
+    start_time = dt.datetime(2024, 1, 1, 8)
+    clock = [start_time.timestamp()]
+    fake = FakeNVML(n_gpus=n_gpus, n_procs=n_procs, clock=lambda: clock[0])
+    collector = GPUCollector(nvml=fake, processes=fake.processes)
+    samples = []
+    for i in range(duration):
+        clock[0] = start_time.timestamp() + i
+        curr_time = (start_time + dt.timedelta(seconds=i)).replace(tzinfo=dt.timezone(dt.timedelta(hours=8)))
+        samples.append((curr_time.replace(tzinfo=None).isoformat(), curr_time, collector.sample()))
+    collector.close()
+
+    print(
+        f"{duration} s of 1 Hz samples, {n_gpus} GPUs, {aggr_period} s aggregation period, one zstd frame per message"
+    )
+    for mode in ("raw", "edge+snapshot", "edge"):
+        # 发送端：本地聚合（不写本地数据库）并编码
+        start = time.perf_counter()
+        recorder = GPURecorder(aggr_period=aggr_period, persist=False)
+        frames = []
+        for timestamp, curr_time, gpu_info in samples:
+            history = recorder.record(gpu_info, curr_time)
+            if mode == "raw":
+                record = encode_record(timestamp, gpu_info, "node000")
+            elif history is not None:
+                record = encode_record(timestamp, gpu_info if mode == "edge+snapshot" else [], "node000", history)
+            else:
+                continue
+            frames.append(encode_records([record], COMPACT_VERSION, "zstd"))
+        recorder.close()
+        sender_time = time.perf_counter() - start
+
+        # 接收端：逐帧解码并写入数据库
+        with tempfile.TemporaryDirectory() as data_dir:
+            writer = DeviceWriter(data_dir=data_dir, aggr_period=aggr_period)
+            writer._recorder("node000")
+            start = time.perf_counter()
+            for frame in frames:
+                for message in decode_messages(COMPACT_VERSION, memoryview(frame)[8:]):
+                    curr_time = parse_timestamp(message["timestamp"])
+                    writer._record([(message["device"], message["gpu_info"], message.get("history"), curr_time)])
+            receiver_time = time.perf_counter() - start
+            writer.close()
+            conn = sqlite3.connect(os.path.join(data_dir, "gpu_history_node000.db"))
+            history_rows = conn.execute("SELECT COUNT(*) FROM gpu_history").fetchone()[0]
+            conn.close()
+
+        print(
+            f"  {mode:<14} {len(frames):5d} messages {sum(map(len, frames)) / 1024:8.1f} KiB  "
+            f"sender {sender_time * 1000:7.0f} ms  receiver {receiver_time * 1000:7.0f} ms  "
+            f"{history_rows} history rows"
+        )
+
+
+class TimedDeviceWriter(DeviceWriter):
+    # 记录每条消息从发送到写入数据库的延迟，以及队列的最大积压
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = {}
+        self.latencies = []
+        self.max_pending = 0
+
+    def put(self, protocol, item):
+        super().put(protocol, item)
+        self.max_pending = max(self.max_pending, self.queue.qsize())
+
+    def _record(self, items):
+        super()._record(items)
+        now = time.perf_counter()
+        for device, _, _, curr_time in items:
+            self.latencies.append(now - self.sent.pop((device, curr_time)))
+
+
+async def run_senders(n_senders, n_messages, interval, n_gpus, data_dir, group_commit=True, hub=False):
+    hub_path = os.path.join(data_dir, "gpu_hub.db") if hub else None
+    writer = TimedDeviceWriter(data_dir=data_dir, group_commit=group_commit, hub_path=hub_path)
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: GPUDataProtocol(writer), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    writer_task = asyncio.create_task(writer.run())
+
+    # 预先生成每个发送端的消息，发送端按 interval 的节拍发送
+    start_time = dt.datetime(2024, 1, 1, 8)
+    fake = FakeNVML(n_gpus=n_gpus, clock=lambda: start_time.timestamp())
+    collector = GPUCollector(nvml=fake, processes=fake.processes)
+    gpu_info = collector.sample()
+    collector.close()
+    frames = [
+        [
+            encode_message((start_time + dt.timedelta(seconds=i)).isoformat(), gpu_info, f"node{k:03d}")
+            for i in range(n_messages)
+        ]
+        for k in range(n_senders)
+    ]
+
+    def send(stream, k, i):
+        curr_time = (start_time + dt.timedelta(seconds=i)).replace(tzinfo=dt.timezone(dt.timedelta(hours=8)))
+        writer.sent[(f"node{k:03d}", curr_time.astimezone(dt.timezone.utc))] = time.perf_counter()
+        stream.write(frames[k][i])
+
+    async def wait_recorded(n):
+        while len(writer.latencies) < n:
+            await asyncio.sleep(0.005)
+
+    # 每个发送端先发送一条消息，等所有设备的数据库初始化完成后再开始计时
+    warmed_up = asyncio.Event()
+
+    async def sender(k):
+        _, stream = await asyncio.open_connection("127.0.0.1", port)
+        send(stream, k, 0)
+        await stream.drain()
+        await warmed_up.wait()
+        await asyncio.sleep(interval * k / n_senders)  # 错开各发送端的节拍
+        for i in range(1, n_messages):
+            send(stream, k, i)
+            await stream.drain()
+            if interval:
+                await asyncio.sleep(interval)
+        stream.close()
+        await stream.wait_closed()
+
+    senders = asyncio.gather(*(sender(k) for k in range(n_senders)))
+    await wait_recorded(n_senders)
+    writer.latencies = []
+    writer.max_pending = 0
+    warmed_up.set()
+
+    # 发送端写完不代表接收端已读完（暂停读取的连接仍有数据在内核缓冲区中），等待全部消息写入数据库
+    start = time.perf_counter()
+    await senders
+    await wait_recorded(n_senders * (n_messages - 1))
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    writer.queue.put_nowait(None)
+    await writer_task
+    writer.close()
+    return elapsed, writer
+
+
+# 多个模拟发送端同时连接异步接收端：逐条提交与成组提交的吞吐量、消息从发送到写入数据库的延迟和队列积压
+# interval 为 0 时发送端不停顿地发送，由接收端的反压限制发送速度；hub 为 True 时所有设备写入同一个多设备数据库
+def bench_receiver(senders=(1, 8, 32, 64), n_messages=100, interval=0.05, n_gpus=8, hub=False):
+    print(f"{n_messages} messages per sender, {interval * 1000:.0f} ms apart, {n_gpus} GPUs per message")
+    for n_senders in senders:
+        for group_commit in (False, True):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                elapsed, writer = asyncio.run(
+                    run_senders(n_senders, n_messages, interval, n_gpus, tmp_dir, group_commit, hub)
+                )
+                rows = 0
+                for k in range(n_senders):
+                    if hub:
+                        conn = sqlite3.connect(os.path.join(tmp_dir, "gpu_hub.db"))
+                        query = "SELECT COUNT(DISTINCT timestamp) FROM gpu_info WHERE device = ?"
+                        rows += conn.execute(query, (f"node{k:03d}",)).fetchone()[0]
+                    else:
+                        conn = sqlite3.connect(os.path.join(tmp_dir, f"gpu_info_node{k:03d}.db"))
+                        rows += conn.execute("SELECT COUNT(DISTINCT timestamp) FROM gpu_info").fetchone()[0]
+                    conn.close()
+            print(
+                f"{n_senders:>3} senders, group_commit={group_commit!s:<5}: "
+                f"{n_senders * (n_messages - 1) / elapsed:8.0f} messages/s, {rows} samples stored, "
+                f"max {writer.max_pending} queued"
+            )
+            summarize("  send -> stored", writer.latencies)
+
+
+class ReceiverThread:
+    """
+    在后台线程中运行接收端，可反复停止和启动，模拟接收端宕机和重启。
+    """
+
+    def __init__(self, port, data_dir):
+        self.port = port
+        self.data_dir = data_dir
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.started.set()
+        try:
+            await serve("127.0.0.1", self.port, data_dir=self.data_dir)
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self._main(),))
+        self.thread.start()
+        self.started.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+
+
+def stored_messages(db_path):
+    # 返回行数、不同时间戳数和最早的时间戳
+    conn = sqlite3.connect(db_path)
+    result = conn.execute("SELECT COUNT(*), COUNT(DISTINCT timestamp), MIN(timestamp) FROM gpu_info").fetchone()
+    conn.close()
+    return result
+
+
+# 接收端在发送过程中停止一段时间后重启，检查消息是否全部写入且没有重复
+def bench_outage(n_messages=600, outage=(200, 400), interval=0.01, n_gpus=8, batch_size=600):
+    start_time = dt.datetime(2024, 1, 1, 8)
+    fake = FakeNVML(n_gpus=n_gpus, clock=lambda: start_time.timestamp())
+    collector = GPUCollector(nvml=fake, processes=fake.processes)
+    gpu_info = collector.sample()
+    collector.close()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        receiver = ReceiverThread(port, data_dir)
+        receiver.start()
+        spool = MessageSpool(os.path.join(data_dir, "spool.db"))
+        sender = SpoolSender(
+            "127.0.0.1", port, spool, batch_size=batch_size, backoff_min=0.05, backoff_max=0.5, timeout=1
+        )
+
+        max_spooled = 0
+        restart = backlog_id = replay_time = None
+        for i in range(n_messages):
+            if i == outage[0]:
+                receiver.stop()
+            if i == outage[1]:
+                receiver.start()
+                restart = time.perf_counter()
+            message_id = spool.put(
+                encode_record((start_time + dt.timedelta(seconds=i)).isoformat(), gpu_info, "node000")
+            )
+            if i == outage[1]:
+                backlog_id = message_id
+            sender.send_pending()
+            max_spooled = max(max_spooled, message_id - sender.sent_id)
+            if replay_time is None and backlog_id is not None and sender.sent_id >= backlog_id:
+                replay_time = time.perf_counter() - restart
+            time.sleep(interval)
+
+        # 发送剩余的消息，等待接收端写入数据库
+        while sender.socket is None or spool.peek(sender.sent_id, 1):
+            sender.send_pending()
+            time.sleep(0.01)
+        db_path = os.path.join(data_dir, "gpu_info_node000.db")
+        deadline = time.perf_counter() + 10
+        last_epoch = to_epoch(start_time.replace(tzinfo=dt.timezone(dt.timedelta(hours=8)))) + n_messages - 1
+        while stored_messages(db_path)[1] < min(n_messages, last_epoch - stored_messages(db_path)[2] + 1):
+            if time.perf_counter() > deadline:
+                break
+            time.sleep(0.05)
+        sender.close()
+        receiver.stop()
+        rows, timestamps, first_epoch = stored_messages(db_path)
+        spool.close()
+
+    print(
+        f"{n_messages} messages, receiver down for messages {outage[0]}-{outage[1] - 1}, {interval * 1000:.0f} ms apart"
+    )
+    print(f"  max {max_spooled} messages pending in spool")
+    if replay_time is not None:
+        print(f"  backlog sent {replay_time * 1000:.1f} ms after the receiver restarted")
+    # 实时数据库只保留最近一小时，消息时间戳每条相差 1 秒
+    expected = min(n_messages, last_epoch - first_epoch + 1)
+    print(
+        f"  stored {timestamps}/{expected} messages in the realtime window, {rows - timestamps * n_gpus} duplicate rows"
+    )
+
+
+def scrape(port, path, n, keep_alive=True):
+    # 按顺序抓取 n 次，返回每次的延迟、响应体和出错次数
+    latencies, bodies, errors = [], [], 0
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    for _ in range(n):
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise ValueError(f"HTTP {response.status}")
+        except (OSError, ValueError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+        bodies.append(body)
+        if not keep_alive:
+            conn.close()
+    conn.close()
+    return latencies, bodies, errors
+
+
+def check_metrics(path, body):
+    # 检查响应能否解析：Prometheus 文本格式的每一行样本都以数值结尾，JSON 带有全部 GPU
+    if path == "/metrics.json":
+        return len(json.loads(body)["gpu_info"]) > 0
+    samples = [line for line in body.decode().splitlines() if line and not line.startswith("#")]
+    return len(samples) > 0 and all(float(line.rsplit(" ", 1)[1]) == float(line.rsplit(" ", 1)[1]) for line in samples)
+
+
+# 在模拟的 NVML 上运行采样流程并开启指标服务，多个采集端并发抓取：保持连接与每次新建连接的吞吐量和延迟
+def bench_metrics(scrapers=(1, 8, 32), n_requests=200, n_gpus=8, n_procs=4, interval=0.05):
+    fake = FakeNVML(n_gpus=n_gpus, n_procs=n_procs)
+    collector = GPUCollector(nvml=fake, processes=fake.processes)
+    metrics = MetricsState(device="node000", aggr_period=2)
+    server = MetricsServer(metrics, host="127.0.0.1", port=0)
+    server.start()
+    pipeline = SamplingPipeline(
+        collector, GPURecorder(aggr_period=2, persist=False), interval=interval, metrics=metrics
+    )
+    sampler = threading.Thread(target=pipeline.run)
+    sampler.start()
+    while metrics.period is None:
+        time.sleep(0.1)
+
+    print(f"{n_gpus} GPUs, {n_procs} processes per GPU, a new sample every {interval * 1000:.0f} ms")
+    for path in ("/metrics", "/metrics.json"):
+        size = len(metrics.render("json" if path.endswith(".json") else "prometheus"))
+        print(f"{path} ({size / 1024:.1f} KiB)")
+        for n_scrapers in scrapers:
+            for keep_alive in (True, False):
+                results = [None] * n_scrapers
+
+                def run(k):
+                    results[k] = scrape(server.port, path, n_requests, keep_alive)
+
+                threads = [threading.Thread(target=run, args=(k,)) for k in range(n_scrapers)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                latencies = [t for result in results for t in result[0]]
+                invalid = sum(not check_metrics(path, body) for result in results for body in result[1])
+                errors = sum(result[2] for result in results)
+                print(
+                    f"  {n_scrapers:>3} scrapers, {'keep-alive' if keep_alive else 'new connection':<14}: "
+                    f"{len(latencies) / elapsed:8.0f} scrapes/s, {errors} errors, {invalid} invalid"
+                )
+                summarize("    scrape", latencies)
+
+    pipeline.stop()
+    sampler.join()
+    pipeline.close()
+    collector.close()
+    server.close()
+    print(f"Sampling pipeline: {pipeline.stats}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the GPU logger.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_sampling = subparsers.add_parser("sampling", help="Per-sample latency of GPU info collection.")
+    parser_sampling.add_argument("-n", type=int, help="Number of samples.", default=100)
+    parser_sampling.add_argument("--fake", action="store_true", help="Sample a fake NVML instead of the real GPUs.")
+
+    parser_writer = subparsers.add_parser("writer", help="Realtime DB write throughput.")
+    parser_writer.add_argument("-n", type=int, help="Number of samples.", default=1000)
+    parser_writer.add_argument("--gpus", type=int, help="Number of GPUs per sample.", default=8)
+    parser_writer.add_argument("--procs", type=int, help="Number of processes per GPU.", default=4)
+
+    parser_high_res = subparsers.add_parser("high-res", help="High-resolution sampling on a fake NVML.")
+    parser_high_res.add_argument("-n", type=int, help="Number of samples.", default=300)
+    parser_high_res.add_argument("--gpus", type=int, help="Number of GPUs.", default=8)
+
+    parser_pipeline = subparsers.add_parser("pipeline", help="Sampling cadence with a stalling database.")
+    parser_pipeline.add_argument("--duration", type=float, help="Seconds per run.", default=10.0)
+    parser_pipeline.add_argument("--interval", type=float, help="Sampling interval in seconds.", default=0.1)
+
+    parser_e2e = subparsers.add_parser("e2e", help="Full logger pipeline on a fake NVML at accelerated speed.")
+    parser_e2e.add_argument("--hours", type=float, help="Simulated hours, one sample per second.", default=2.0)
+    parser_e2e.add_argument("--gpus", type=int, help="Number of GPUs.", default=8)
+    parser_e2e.add_argument("--procs", type=int, help="Number of processes per GPU.", default=2)
+
+    parser_framing = subparsers.add_parser("framing", help="Receiver stream parsing throughput.")
+    parser_framing.add_argument("-n", type=int, help="Number of messages.", default=200)
+    parser_framing.add_argument("--gpus", type=int, help="Number of GPUs per message.", default=8)
+
+    parser_receiver = subparsers.add_parser("receiver", help="Many concurrent senders against the receiver.")
+    parser_receiver.add_argument("--senders", type=int, nargs="+", help="Numbers of senders.", default=[1, 8, 32, 64])
+    parser_receiver.add_argument("-n", type=int, help="Messages per sender.", default=100)
+    parser_receiver.add_argument("--interval", type=float, help="Seconds between messages.", default=0.05)
+    parser_receiver.add_argument("--hub", action="store_true", help="Write all devices to one multi-device database.")
+
+    parser_encoding = subparsers.add_parser("encoding", help="Wire size and codec CPU of the protocol versions.")
+    parser_encoding.add_argument("-n", type=int, help="Number of messages.", default=600)
+    parser_encoding.add_argument("--procs", type=int, help="Processes per busy GPU.", default=2)
+
+    parser_edge = subparsers.add_parser("edge", help="Raw samples versus sender-side aggregation.")
+    parser_edge.add_argument("--duration", type=int, help="Seconds of samples.", default=3600)
+
+    parser_outage = subparsers.add_parser("outage", help="Sender spool and replay across a receiver restart.")
+    parser_outage.add_argument("-n", type=int, help="Number of messages.", default=600)
+    parser_outage.add_argument("--down", type=int, help="Message at which the receiver stops.", default=200)
+    parser_outage.add_argument("--up", type=int, help="Message at which the receiver restarts.", default=400)
+    parser_outage.add_argument("--interval", type=float, help="Seconds between messages.", default=0.01)
+    parser_outage.add_argument("--batch-size", type=int, help="Messages per replayed frame.", default=600)
+
+    parser_metrics = subparsers.add_parser("metrics", help="Concurrent scrapes of the metrics endpoint.")
+    parser_metrics.add_argument("--scrapers", type=int, nargs="+", help="Numbers of scrapers.", default=[1, 8, 32])
+    parser_metrics.add_argument("-n", type=int, help="Scrapes per scraper.", default=200)
+    parser_metrics.add_argument("--gpus", type=int, help="Number of GPUs.", default=8)
+
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.command == "sampling":
+        bench_sampling(args.n, args.fake)
+    elif args.command == "writer":
+        bench_writer(args.n, args.gpus, args.procs)
+    elif args.command == "high-res":
+        bench_high_res(args.n, args.gpus)
+    elif args.command == "pipeline":
+        bench_pipeline(args.duration, args.interval)
+    elif args.command == "e2e":
+        bench_end_to_end(args.hours, args.gpus, args.procs)
+    elif args.command == "framing":
+        bench_framing(args.n, args.gpus)
+    elif args.command == "encoding":
+        bench_encoding(args.n, n_procs=args.procs)
+    elif args.command == "edge":
+        bench_edge(args.duration)
+    elif args.command == "outage":
+        bench_outage(args.n, (args.down, args.up), args.interval, batch_size=args.batch_size)
+    elif args.command == "receiver":
+        bench_receiver(args.senders, args.n, args.interval, hub=args.hub)
+    elif args.command == "metrics":
+        bench_metrics(args.scrapers, args.n, args.gpus)
@@ -1,97 +1,348 @@
 from loguru import logger
-import socket
-import json
+import asyncio
+import os
+import re
+from collections import OrderedDict
 
 from GPU_logger import *
+from GPU_protocol import FrameDecoder, ProtocolError, decode_messages, encode_ack, negotiate
 
 
-# 接收 GPU 信息的函数
-def receive_gpu_info(server_ip, server_port, device="virgo"):
-    logger.info(f"Starting server at {server_ip}:{server_port}")
-    # 初始化 Socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((server_ip, server_port))
-    server_socket.listen(1)
-    logger.trace("Server initialized")
+def parse_timestamp(timestamp):
+    # 发送端发送的是 UTC+8 的本地时间
+    curr_time = dt.datetime.fromisoformat(timestamp).replace(tzinfo=dt.timezone(dt.timedelta(hours=8)))
+    return curr_time.astimezone(dt.timezone.utc)
 
-    logger.info(f"Server started, listening at {server_ip}:{server_port}")
 
-    DB_PATH = f"data/gpu_history_{device}.db"
-    DB_REALTIME_PATH = f"data/gpu_info_{device}.db"
+class DeviceWriter:
+    """
+    所有连接共享的写入任务。
 
-    initialize_database(db_path=DB_PATH)
-    initialize_database(db_path=DB_REALTIME_PATH)
-    # print("Database initialized.")
-    logger.info("Database initialized.")
-    timestamp_last = dt.datetime.now(tz=dt.timezone.utc)
-    AGGR_PERIOD = 30  # 聚合周期：30 秒
+    连接把解码后的采样放入队列，run() 每次取出队列中已有的全部采样，在工作线程中依次交给对应设备的 GPURecorder，
+    事件循环不会被 SQLite 写入阻塞；同一时刻只有一个线程写数据库。设备的数据库在首次收到其数据时初始化。
 
-    try:
+    group_commit 为 True 时，一批采样中同一设备的全部采样在一个事务中提交。队列积压到 high_water 条时，
+    继续发来数据的连接暂停读取，由 TCP 窗口让发送端的 sendall 阻塞；积压降到 low_water 条以下时恢复读取。
+
+    发送端断线重连后会重发部分已发送的消息。时间戳（秒）晚于该设备已记录的最新时间戳的消息直接记录；其余的消息按完整的消息时间
+    与本进程最近 recent_size 秒内记录过的消息比较，相同的作为重复消息丢弃，发送端时钟回拨或同一秒内的多条采样不会被误丢。
+    本进程没有记录过该秒的消息时（接收端重启前记录的），数据库中该秒已有该设备的实时数据或聚合结果即视为重复。
+    接收端重启后从实时数据和聚合结果中读取最新的时间戳。duplicates 和 invalid 分别统计丢弃的重复消息
+    和无法解码或内容不合法的消息（帧）。
+
+    带 history 的消息来自在本地聚合的发送端，聚合结果直接写入历史数据库，随附的快照只写入实时数据库。
+
+    hub_path 不为 None 时，所有设备的实时数据和历史数据都写入这一个多设备数据库（按 device 列区分），
+    各设备共用一个写连接，一批采样只提交一次。
+
+    retention 为实时数据的清理方式，见 resolve_retention。
+    """
+
+    def __init__(
+        self,
+        data_dir="data",
+        aggr_period=30,
+        realtime_period=3600,
+        group_commit=True,
+        high_water=1024,
+        low_water=256,
+        hub_path=None,
+        recent_size=3600,
+        retention=None,
+    ):
+        self.data_dir = data_dir
+        self.aggr_period = aggr_period
+        self.realtime_period = realtime_period
+        self.group_commit = group_commit
+        self.high_water = high_water
+        self.low_water = low_water
+        self.queue = asyncio.Queue()
+        self.recorders = {}
+        self.last_timestamp = {}  # 设备 -> 已记录的最新时间戳（秒）
+        self.recent = {}  # 设备 -> 最近记录的时间戳（秒）-> 该秒内记录过的消息时间
+        self.recent_size = recent_size
+        self.duplicates = 0
+        self.invalid = 0
+        self.paused = set()
+        self.connections = set()
+        self.hub_path = hub_path
+        self.retention = retention
+        self.conn = None
+        if hub_path is not None:
+            initialize_database(db_path=hub_path, hub=True)
+            # 各设备共用写连接，在打开写连接前确定清理方式（需要时转换），不在记录采样期间 VACUUM
+            self.retention = resolve_retention(hub_path, retention)
+            self.conn = connect_database(hub_path)
+            logger.info(f"Hub database initialized at {hub_path}")
+
+    def _recorder(self, device):
+        if device not in self.recorders and self.hub_path is not None:
+            self.recorders[device] = GPURecorder(
+                db_path=self.hub_path,
+                db_realtime_path=self.hub_path,
+                aggr_period=self.aggr_period,
+                realtime_period=self.realtime_period,
+                commit_every=None if self.group_commit else 1,
+                retention=self.retention,
+                device=device,
+                conn=self.conn,
+            )
+            self.last_timestamp[device] = self._latest(device)
+        elif device not in self.recorders:
+            db_path = os.path.join(self.data_dir, f"gpu_history_{device}.db")
+            db_realtime_path = os.path.join(self.data_dir, f"gpu_info_{device}.db")
+            initialize_database(db_path=db_path)
+            initialize_database(db_path=db_realtime_path)
+            logger.info(f"Database initialized for {device}")
+            self.recorders[device] = GPURecorder(
+                db_path=db_path,
+                db_realtime_path=db_realtime_path,
+                aggr_period=self.aggr_period,
+                realtime_period=self.realtime_period,
+                commit_every=None if self.group_commit else 1,
+                retention=self.retention,
+            )
+            self.last_timestamp[device] = self._latest(device)
+        return self.recorders[device]
+
+    def _connections(self, device):
+        # 设备的实时数据库和历史数据库连接，历史数据库在首次写入聚合结果前尚未连接
+        recorder = self.recorders[device]
+        if recorder.aggregator.conn is None:
+            recorder.aggregator.conn = connect_database(recorder.aggregator.db_path)
+        return recorder.writer.conn, recorder.aggregator.conn
+
+    def _latest(self, device):
+        # 已记录的最新时间戳（秒）：取实时数据和聚合结果中较晚的一个，发送端在本地聚合且不附带快照时没有实时数据
+        condition, params = ("", ()) if self.hub_path is None else (" WHERE device = ?", (device,))
+        latest = -1
+        for conn, table in zip(self._connections(device), ("gpu_info", "gpu_history")):
+            last = conn.execute(f"SELECT MAX(timestamp) FROM {table}{condition}", params).fetchone()[0]
+            if last is not None:
+                latest = max(latest, to_epoch(last))
+        return latest
+
+    def _stored(self, device, timestamp):
+        # 数据库中该秒是否已有该设备的实时数据或聚合结果
+        condition, params = ("", ()) if self.hub_path is None else (" AND device = ?", (device,))
+        for conn, table in zip(self._connections(device), ("gpu_info", "gpu_history")):
+            query = f"SELECT 1 FROM {table} WHERE timestamp = ?{condition} LIMIT 1"
+            if conn.execute(query, (timestamp,) + params).fetchone() is not None:
+                return True
+        return False
+
+    def _is_duplicate(self, device, curr_time):
+        timestamp = to_epoch(curr_time)
+        if timestamp > self.last_timestamp[device]:
+            return False
+        recent = self.recent.get(device, {}).get(timestamp)
+        if recent is not None:
+            return curr_time in recent
+        return self._stored(device, timestamp)
+
+    def _remember(self, device, curr_time):
+        timestamp = to_epoch(curr_time)
+        self.last_timestamp[device] = max(self.last_timestamp[device], timestamp)
+        recent = self.recent.setdefault(device, OrderedDict())
+        recent.setdefault(timestamp, set()).add(curr_time)
+        if len(recent) > self.recent_size:
+            recent.popitem(last=False)
+
+    def _record(self, items):
+        devices = set()
+        for device, gpu_info, history, curr_time in items:
+            try:
+                recorder = self._recorder(device)
+                if self._is_duplicate(device, curr_time):
+                    self.duplicates += 1
+                    continue
+                if history is None:
+                    recorder.record(gpu_info, curr_time)
+                else:
+                    recorder.record_aggregated(gpu_info, history, curr_time)
+                self._remember(device, curr_time)
+                devices.add(device)
+            except Exception as e:
+                logger.error(f"Error recording GPU info from {device}: {e}")
+        for device in devices:
+            self.recorders[device].flush()
+
+    def put(self, protocol, item):
+        self.queue.put_nowait(item)
+        if self.queue.qsize() >= self.high_water and protocol not in self.paused:
+            protocol.transport.pause_reading()
+            self.paused.add(protocol)
+
+    def _resume(self):
+        if self.paused and self.queue.qsize() <= self.low_water:
+            for protocol in self.paused:
+                if not protocol.transport.is_closing():
+                    protocol.transport.resume_reading()
+            self.paused.clear()
+
+    async def run(self):
+        # 队列中的 None 表示停止，停止前仍会写完它之前的采样
         while True:
-            # 接受连接
-            client_socket, client_address = server_socket.accept()
-            logger.info(f"Connection from {client_address}")
-
-            with client_socket:
-                buffer = b""
-                while True:
-                    # 接收数据
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-                    buffer += data
-
-                    try:
-                        # 尝试解析 JSON 数据
-                        message = json.loads(buffer.decode("utf-8"))
-                        buffer = b""  # 清空缓冲区
-
-                        if "magic" not in message or message["magic"] != 23333:
-                            logger.warning(f"Invalid data packet: {message}")
-                            # print("错误的数据包：", message)
-                            continue
-
-                        gpu_info = message["gpu_info"]
-                        curr_time = dt.datetime.strptime(message["timestamp"], "%Y-%m-%dT%H:%M:%S.%f").replace(
-                            tzinfo=dt.timezone(dt.timedelta(hours=8))
-                        )
-                        curr_time = curr_time - dt.timedelta(hours=8)  # Convert from UTC+8 to UTC+0
-                        update_database(gpu_info, curr_time.strftime("%Y-%m-%d %H:%M:%S"), db_path=DB_REALTIME_PATH)
-                        if (curr_time - timestamp_last).seconds >= AGGR_PERIOD - 1:
-                            timestamp_last = curr_time
-                            aggregate_data(
-                                timestamp_last, period_s=AGGR_PERIOD, db_path=DB_PATH, db_realtime_path=DB_REALTIME_PATH
-                            )
-                            remove_old_data(timestamp_last, period_s=3600, db_path=DB_REALTIME_PATH)
-                        time.sleep(1)
-
-                    except json.JSONDecodeError:
-                        logger.warning(f"Failed to decode JSON: {buffer.decode('utf-8')}")
-                        # 检测是否是不完整数据包
-                        if data[-1] != ord("}"):
-                            continue
-                        else:
-                            # print("数据包解析失败：", buffer.decode("utf-8"))
-                            logger.error(f"Failed to decode JSON: {buffer.decode('utf-8')}")
-                            buffer = b""
+            items = [await self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            stop = None in items
+            # 取出队列时，各连接已收到的帧中的消息都在这一批中，写入并提交后确认
+            acks = {protocol: protocol.frames for protocol in self.connections if protocol.ack}
+            await asyncio.to_thread(self._record, [item for item in items if item is not None])
+            for protocol, frames in acks.items():
+                if frames > protocol.acked and not protocol.transport.is_closing():
+                    protocol.transport.write(encode_ack(frames))
+                    protocol.acked = frames
+            for _ in items:
+                self.queue.task_done()
+            self._resume()
+            if stop:
+                break
+
+    def close(self):
+        for recorder in self.recorders.values():
+            recorder.close()
+        if self.conn is not None:
+            self.conn.close()
+
+
+class GPUDataProtocol(asyncio.BufferedProtocol):
+    """
+    一个发送端连接。数据直接读入 FrameDecoder 的缓冲区，消息中的 device 决定写入哪台设备的数据库，
+    不带 device 的消息写入 default_device。发送端连接后发来的 hello 消息用于协商协议版本和压缩方式，
+    接收端回复选择的结果；不协商的发送端使用版本 1。
+
+    hello 中请求确认的发送端，在每批消息写入数据库后收到 {"ack": n}（见 encode_ack），n 为本连接已处理的帧数，
+    无法解码的帧也计算在内。
+    """
+
+    def __init__(self, writer, default_device="virgo"):
+        self.writer = writer
+        self.default_device = default_device
+        self.decoder = FrameDecoder()
+        self.device = None
+        self.ack = False
+        self.frames = 0  # 已收到的帧数
+        self.acked = 0  # 已确认的帧数
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")
+        self.writer.connections.add(self)
+        logger.info(f"Connection from {self.peer}")
+
+    def connection_lost(self, exc):
+        self.writer.connections.discard(self)
+        self.writer.paused.discard(self)
+        logger.info(f"Connection from {self.peer} ({self.device}) closed")
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            frames = self.decoder.buffer_updated(nbytes)
+        except ProtocolError as e:
+            # 帧头损坏后无法再确定帧边界，只能断开连接
+            logger.error(f"Invalid data from {self.peer}, closing connection: {e}")
+            self.writer.invalid += 1
+            self.transport.close()
+            return
+
+        for version, payload in frames:
+            self.frames += 1
+            try:
+                messages = decode_messages(version, payload)
+            except ValueError as e:
+                # 未知的协议版本，或负载不是合法的 JSON
+                logger.warning(f"Failed to decode message from {self.peer}: {e}")
+                self.writer.invalid += 1
+                continue
+            for message in messages:
+                self.handle_message(message)
+
+    def handle_message(self, message):
+        if isinstance(message, dict) and isinstance(message.get("hello"), dict):
+            # 发送端协商协议版本和压缩方式
+            version, compression, reply = negotiate(message["hello"])
+            self.ack = message["hello"].get("ack") is True
+            self.transport.write(reply)
+            logger.info(f"Connection from {self.peer} uses protocol version {version}, compression {compression}")
+            return
+        try:
+            curr_time = parse_timestamp(message["timestamp"])
+            gpu_info = message["gpu_info"]
+            history = message.get("history")
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Invalid message from {self.peer}: {e}")
+            self.writer.invalid += 1
+            return
+
+        device = message.get("device", self.default_device)
+        if not isinstance(device, str) or not re.fullmatch(r"[\w.-]+", device):
+            # 设备名会出现在数据库文件名中
+            logger.warning(f"Invalid device name from {self.peer}: {device!r}")
+            self.writer.invalid += 1
+            return
+        if device != self.device:
+            logger.info(f"Connection from {self.peer} reports device {device}")
+            self.device = device
+        self.writer.put(self, (device, gpu_info, history, curr_time))
+
+
+async def serve(server_ip, server_port, device="virgo", data_dir="data", hub=False, writer=None, retention=None):
+    # hub 为 True 时所有设备写入 data_dir 下的同一个多设备数据库 gpu_hub.db；writer 不为 None 时使用给定的 DeviceWriter
+    if writer is None:
+        hub_path = os.path.join(data_dir, "gpu_hub.db") if hub else None
+        writer = DeviceWriter(data_dir=data_dir, hub_path=hub_path, retention=retention)
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: GPUDataProtocol(writer, device), server_ip, server_port)
+    logger.info(f"Server started, listening at {server_ip}:{server_port}")
+    writer_task = asyncio.create_task(writer.run())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # 断开所有连接，发送端会重连并重发未确认的消息；等待写入任务写完已收到的采样后再关闭数据库
+        for protocol in list(writer.connections):
+            protocol.transport.abort()
+        writer.queue.put_nowait(None)
+        await writer_task
+        writer.close()
+        logger.trace("Server closed")
+
+
+# 接收 GPU 信息的函数
+def receive_gpu_info(server_ip, server_port, device="virgo", hub=False, retention=None):
+    logger.info(f"Starting server at {server_ip}:{server_port}")
+    try:
+        asyncio.run(serve(server_ip, server_port, device, hub=hub, retention=retention))
     except KeyboardInterrupt:
         logger.info("Server stopped")
-    finally:
-        server_socket.close()
-        logger.trace("Server socket closed")
 
 
 # 主程序
 if __name__ == "__main__":
     import argparse
 
-    parser = argparse.ArgumentParser(description="Receive GPU information from the client.")
+    parser = argparse.ArgumentParser(description="Receive GPU information from the clients.")
     parser.add_argument("--ip", type=str, help="The IP address of the server.", default="0.0.0.0")
     parser.add_argument("--port", type=int, help="The port of the server.", default=3334)
-    parser.add_argument("--name", type=str, help="The device name.", default="virgo")
+    parser.add_argument("--name", type=str, help="The device name for messages that do not carry one.", default="virgo")
+    parser.add_argument(
+        "--hub", action="store_true", help="Store all devices in a single multi-device database, data/gpu_hub.db."
+    )
+    parser.add_argument(
+        "--retention",
+        choices=RETENTION_MODES,
+        help="How the realtime DBs reclaim space: full VACUUM or bounded incremental_vacuum. "
+        "New databases use incremental; by default existing ones keep their current mode, "
+        "and incremental converts them once with a full VACUUM when first opened.",
+    )
     args = parser.parse_args()
 
     logger.add("log/GPU_data_receiver_{time:YYYY-MM-DD}.log", rotation="00:00", retention="7 days", level="TRACE")
     logger.info("Starting GPU data receiver")
 
-    receive_gpu_info(args.ip, args.port, args.name)
+    receive_gpu_info(args.ip, args.port, args.name, args.hub, args.retention)
@@ -1,57 +1,253 @@
+import random
+import select
 import socket
-import json
 import time
+from collections import deque
 from datetime import datetime
 from pynvml import *
 
+from loguru import logger
+
 from GPU_logger import *
+from GPU_protocol import (
+    COMPRESSIONS,
+    PROTOCOL_VERSION,
+    SUPPORTED_VERSIONS,
+    FrameDecoder,
+    decode_message,
+    encode_hello,
+    encode_record,
+    encode_records,
+)
+from GPU_spool import MessageSpool
+
+
+class SpoolSender:
+    """
+    按顺序把磁盘队列中的消息记录（encode_record）发送到接收端。
+
+    每次连接后先与接收端协商协议版本和压缩方式：接收端支持时使用紧凑的版本 2 编码，compression 为 "zstd" 时
+    整帧压缩；接收端在 hello_timeout 秒内没有回复（不支持协商的旧版本）时，记录转换为版本 1 的 JSON 发送。
+
+    连接断开或接收端不可用时，按指数退避（backoff_min 到 backoff_max 秒，带随机抖动）重连，期间的采样留在队列中；
+    重连后从队列中最早的消息开始，以每帧最多 batch_size 条的批量重发，每次 send_pending() 最多发送 max_batches 帧，
+    避免长时间断线后的重发阻塞采样。
+
+    sendall 返回只代表数据进入了本机的发送缓冲区，因此 hello 中同时请求接收端确认：接收端在消息写入数据库后回复
+    已处理的帧数，发送端记录每一帧中最后一条消息的 id，只删除已确认的帧中的消息；网络静默中断或接收端主机宕机时，
+    未确认的消息留在队列中，重连后从最后一次确认之后全部重发，由接收端按时间戳去重。
+    不支持确认的旧版本接收端只能在发送后删除消息，最近发送的 resend 条消息仍留在队列中，重连后一并重发。
+    """
+
+    def __init__(
+        self,
+        server_ip,
+        server_port,
+        spool,
+        batch_size=600,
+        max_batches=10,
+        resend=10,
+        backoff_min=1.0,
+        backoff_max=60.0,
+        timeout=30.0,
+        compression="zstd",
+        hello_timeout=2.0,
+    ):
+        self.address = (server_ip, server_port)
+        self.spool = spool
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.resend = resend
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.compression = compression
+        self.hello_timeout = hello_timeout
+        self.version = PROTOCOL_VERSION
+        self.negotiated_compression = None
+        self.acked = False  # 接收端是否确认写入
+        self.decoder = None
+        self.frames = 0  # 本连接已发送的帧数（包括 hello）
+        self.in_flight = deque()  # 未确认的帧：(帧序号, 帧中最后一条消息的 id)
+        self.socket = None
+        self.sent_id = 0
+        self.sent_bytes = 0
+        self.backoff = backoff_min
+        self.retry_at = 0
+
+    def _fail(self, error):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        delay = self.backoff * random.uniform(0.5, 1.0)
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+        self.retry_at = time.monotonic() + delay
+        logger.warning(f"Connection to {self.address} failed: {error}, retrying in {delay:.1f} s")
+
+    def _connect(self):
+        if time.monotonic() < self.retry_at:
+            return False
+        try:
+            self.socket = socket.create_connection(self.address, timeout=self.timeout)
+            self.decoder = FrameDecoder(size=4096)
+            self.version, self.negotiated_compression, self.acked = self._handshake()
+        except OSError as e:
+            self._fail(e)
+            return False
+        self.backoff = self.backoff_min
+        self.frames = 1
+        self.in_flight.clear()
+        # 从队列中最早的消息开始发送，包括上次连接中已发送但未确认的消息
+        first_id = self.spool.first_id()
+        self.sent_id = 0 if first_id is None else first_id - 1
+        logger.info(
+            f"Connected to {self.address} with protocol version {self.version}, "
+            f"compression {self.negotiated_compression}, acknowledgements {self.acked}, "
+            f"{len(self.spool)} messages in spool"
+        )
+        return True
+
+    def _handshake(self):
+        compressions = [self.compression] if self.compression in COMPRESSIONS else []
+        self.socket.sendall(encode_hello(compressions=compressions, ack=True))
+        self.socket.settimeout(self.hello_timeout)
+        try:
+            while True:
+                n = self.socket.recv_into(self.decoder.get_buffer())
+                if n == 0:
+                    raise ConnectionError("Connection closed during handshake")
+                frames = self.decoder.buffer_updated(n)
+                if frames:
+                    reply = decode_message(*frames[0])["hello"]
+                    if reply["version"] not in SUPPORTED_VERSIONS:
+                        raise ValueError(f"Unsupported protocol version: {reply['version']}")
+                    return reply["version"], reply["compression"], reply.get("ack") is True
+        except socket.timeout:
+            logger.info(f"No handshake reply from {self.address}, using protocol version {PROTOCOL_VERSION}")
+            return PROTOCOL_VERSION, None, False
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Invalid handshake reply from {self.address}: {e}")
+            return PROTOCOL_VERSION, None, False
+        finally:
+            self.socket.settimeout(self.timeout)
+
+    def _receive_acks(self):
+        # 读取接收端已经发来的确认（不阻塞），删除已确认的帧中的消息
+        while select.select([self.socket], [], [], 0)[0]:
+            n = self.socket.recv_into(self.decoder.get_buffer())
+            if n == 0:
+                raise ConnectionError("Connection closed by the receiver")
+            for frame in self.decoder.buffer_updated(n):
+                try:
+                    frames = int(decode_message(*frame)["ack"])
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Invalid acknowledgement from {self.address}: {e}")
+                    continue
+                last_id = None
+                while self.in_flight and self.in_flight[0][0] <= frames:
+                    last_id = self.in_flight.popleft()[1]
+                if last_id is not None:
+                    self.spool.discard(last_id)
+
+    def send_pending(self):
+        # 返回本次发送的消息条数
+        if self.socket is None and not self._connect():
+            return 0
+        sent = 0
+        try:
+            for _ in range(self.max_batches):
+                rows = self.spool.peek(self.sent_id, self.batch_size)
+                if not rows:
+                    break
+                records = [record for _, record in rows]
+                frame = encode_records(records, self.version, self.negotiated_compression)
+                self.socket.sendall(frame)
+                self.sent_bytes += len(frame)
+                self.frames += 1
+                self.sent_id = rows[-1][0]
+                sent += len(rows)
+                if self.acked:
+                    self.in_flight.append((self.frames, self.sent_id))
+                else:
+                    self.spool.discard(self.sent_id - self.resend)
+            if self.acked:
+                self._receive_acks()
+        except OSError as e:
+            self._fail(e)
+        return sent
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
 
 
 # 发送 GPU 信息的函数
-def send_gpu_info(server_ip, server_port):
-    # 初始化 Socket
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket.connect((server_ip, server_port))
-
-    DB_PATH = "data/gpu_history_virgo.db"
-    DB_REALTIME_PATH = "data/gpu_info_virgo.db"
-
-    initialize_database(db_path=DB_PATH)
-    initialize_database(db_path=DB_REALTIME_PATH)
-    print("Database initialized.")
-    timestamp_last = dt.datetime.now(tz=dt.timezone.utc)
+def send_gpu_info(
+    server_ip,
+    server_port,
+    device="virgo",
+    high_res=False,
+    spool_size=7 * 86400,
+    compression="zstd",
+    edge=False,
+    snapshot=True,
+    local_db=True,
+    retention=None,
+):
+    """
+    edge 为 True 时在本地按聚合周期聚合（与接收端的聚合方式相同），每个周期只发送一条带聚合结果的消息，
+    snapshot 为 True 时附带周期结束时的最新采样；local_db 为 False 时不写本地数据库，只在内存中聚合。
+    retention 为本地实时数据库的清理方式，见 resolve_retention。
+    """
+    DB_PATH = f"data/gpu_history_{device}.db"
+    DB_REALTIME_PATH = f"data/gpu_info_{device}.db"
+
+    if local_db:
+        initialize_database(db_path=DB_PATH)
+        initialize_database(db_path=DB_REALTIME_PATH)
+        print("Database initialized.")
     AGGR_PERIOD = 30  # 聚合周期：30 秒
+    collector = GPUCollector(high_res=high_res)
+    recorder = GPURecorder(
+        db_path=DB_PATH,
+        db_realtime_path=DB_REALTIME_PATH,
+        aggr_period=AGGR_PERIOD,
+        realtime_period=3600,
+        retention=retention,
+        persist=local_db,
+    )
+    # 接收端不可用时，未发送的采样保存在磁盘队列中，重连后补发
+    spool = MessageSpool(db_path=f"data/spool_{device}.db", max_messages=spool_size)
+    sender = SpoolSender(server_ip, server_port, spool, compression=compression)
 
+    next_tick = time.monotonic()
     try:
         while True:
             # 获取 GPU 信息
-            gpu_info = get_gpu_info()
+            gpu_info = collector.sample()
             curr_time = dt.datetime.now(tz=dt.timezone.utc)
             timestamp = datetime.now().isoformat()
 
-            # 组装消息
-            data = {
-                "magic": 23333,
-                "timestamp": timestamp,
-                "gpu_info": gpu_info,
-            }
-            message = json.dumps(data)
-
-            update_database(gpu_info, curr_time.strftime("%Y-%m-%d %H:%M:%S"), db_path=DB_REALTIME_PATH)
-            if (curr_time - timestamp_last).seconds >= AGGR_PERIOD - 1:
-                timestamp_last = curr_time
-                aggregate_data(timestamp_last, period_s=AGGR_PERIOD, db_path=DB_PATH, db_realtime_path=DB_REALTIME_PATH)
-                remove_old_data(timestamp_last, period_s=3600, db_path=DB_REALTIME_PATH)
-
-            # 发送数据
-            client_socket.sendall(message.encode("utf-8"))
-
-            # 间隔 1 秒发送一次
-            time.sleep(1)
+            history = recorder.record(gpu_info, curr_time)
+
+            # 消息先编码为紧凑记录写入磁盘队列再发送，接收端按 device 写入对应的数据库
+            if not edge:
+                spool.put(encode_record(timestamp, gpu_info, device))
+            elif history is not None:
+                spool.put(encode_record(timestamp, gpu_info if snapshot else [], device, history))
+            sender.send_pending()
+
+            # 间隔 1 秒发送一次，补发耗时超过一个周期时从当前时间重新计时
+            next_tick = max(next_tick + 1, time.monotonic())
+            time.sleep(next_tick - time.monotonic())
     except KeyboardInterrupt:
         print("发送端已停止")
     finally:
-        client_socket.close()
+        recorder.close()
+        collector.close()
+        sender.close()
+        spool.close()
 
 
 # 主程序
@@ -61,7 +257,53 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Send GPU information to the server.")
     parser.add_argument("--server_ip", type=str, required=True, help="The IP address of the server.")
     parser.add_argument("--server_port", type=int, required=True, help="The port of the server.")
-    SERVER_IP = parser.parse_args().server_ip
-    SERVER_PORT = parser.parse_args().server_port
+    parser.add_argument("--name", type=str, help="The device name reported to the server.", default="virgo")
+    parser.add_argument(
+        "--high-res", action="store_true", help="Also send the sub-second points in NVML sample buffers."
+    )
+    parser.add_argument(
+        "--spool-size",
+        type=int,
+        help="Maximum number of unsent messages kept on disk while the server is unreachable.",
+        default=7 * 86400,
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["zstd", "none"],
+        help="Compression requested from the server for the compact encoding.",
+        default="zstd",
+    )
+    parser.add_argument(
+        "--edge-aggregate",
+        action="store_true",
+        help="Aggregate locally and send only one message per aggregation period.",
+    )
+    parser.add_argument(
+        "--no-snapshot",
+        action="store_true",
+        help="With --edge-aggregate, do not attach the latest sample to the aggregates.",
+    )
+    parser.add_argument("--no-local-db", action="store_true", help="Do not write the local databases.")
+    parser.add_argument(
+        "--retention",
+        choices=RETENTION_MODES,
+        help="How the local realtime DB reclaims space: full VACUUM or bounded incremental_vacuum. "
+        "New databases use incremental; by default existing ones keep their current mode, "
+        "and incremental converts them once with a full VACUUM at startup.",
+    )
+    args = parser.parse_args()
+    SERVER_IP = args.server_ip
+    SERVER_PORT = args.server_port
 
-    send_gpu_info(SERVER_IP, SERVER_PORT)
+    send_gpu_info(
+        SERVER_IP,
+        SERVER_PORT,
+        args.name,
+        args.high_res,
+        args.spool_size,
+        None if args.compression == "none" else args.compression,
+        args.edge_aggregate,
+        not args.no_snapshot,
+        not args.no_local_db,
+        args.retention,
+    )
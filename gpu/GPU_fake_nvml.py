@@ -0,0 +1,224 @@
+import random
+import time
+
+import pynvml
+from pynvml import *
+
+
+class FakeNVML:
+    """
+    模拟 pynvml 模块中 GPU 采集用到的接口，用于在没有 GPU 的机器上测试和压测采集程序，例如
+    GPUCollector(high_res=True, nvml=fake, processes=fake.processes)，或 get_gpu_info(nvml=fake, processes=fake.processes)。
+
+    每张 GPU 的时间划分为 job_period 秒的时段，每个时段以 busy_ratio 的概率运行一个训练任务：任务有 n_procs 个进程，
+    属于 n_users 个用户之一，利用率在每个训练步末尾（数据加载、同步）骤降，每 checkpoint_period 秒保存检查点时
+    接近空闲；空闲时段没有进程。noise 不为 0 时，运行任务的利用率和显存占用在每个采样点上有至多 ±noise 的相对波动。
+    采样缓冲区按 sample_interval_us 产生采样点，最多保留 buffer_size 个。
+    所有数值只取决于 seed、GPU 序号和时间，clock 可替换为手动推进的时钟以得到确定的结果。
+    """
+
+    NVMLError = pynvml.NVMLError
+
+    def __init__(
+        self,
+        n_gpus=8,
+        n_procs=2,
+        n_users=4,
+        total_memory=80 * 0x40000000,
+        job_period=900,
+        busy_ratio=0.75,
+        checkpoint_period=300,
+        noise=0.0,
+        sample_interval_us=166667,
+        buffer_size=100,
+        clock=time.time,
+        seed=0,
+    ):
+        self.n_gpus = n_gpus
+        self.n_procs = n_procs
+        self.n_users = n_users
+        self.total_memory = total_memory
+        self.job_period = job_period
+        self.busy_ratio = busy_ratio
+        self.checkpoint_period = checkpoint_period
+        self.noise = noise
+        self.sample_interval_us = sample_interval_us
+        self.buffer_size = buffer_size
+        self.clock = clock
+        self.seed = seed
+        self.initialized = False
+        self.error = None
+        self.calls = 0
+        self.jobs = {}  # (GPU 序号, 时段) -> 任务参数，空闲时段为 None
+        self.owners = {}  # pid -> 用户名
+        self.processes = FakeProcessCache(self)
+
+    def inject_error(self, value=NVML_ERROR_UNKNOWN):
+        # 下一次设备查询抛出 NVMLError
+        self.error = value
+
+    def _check(self):
+        self.calls += 1
+        if not self.initialized:
+            raise NVMLError(NVML_ERROR_UNINITIALIZED)
+        if self.error is not None:
+            value, self.error = self.error, None
+            raise NVMLError(value)
+
+    def _now_us(self):
+        return int(self.clock() * 1000000)
+
+    def _job(self, handle, t_us):
+        segment = t_us // (self.job_period * 1000000)
+        key = (handle, segment)
+        if key not in self.jobs:
+            if len(self.jobs) > 4096:
+                self.jobs.clear()
+                self.owners.clear()
+            rng = random.Random(f"{self.seed}-{handle}-{segment}")
+            job = None
+            if rng.random() < self.busy_ratio:
+                user = f"user{rng.randrange(self.n_users)}"
+                job = {
+                    "utilization": rng.uniform(70, 100),
+                    "memory": rng.uniform(0.3, 0.95),
+                    "step_us": int(rng.uniform(0.3, 2.0) * 1000000),
+                    "pids": [
+                        100000 + (segment % 1000 * self.n_gpus + handle) * self.n_procs + i
+                        for i in range(self.n_procs)
+                    ],
+                }
+                for pid in job["pids"]:
+                    self.owners[pid] = user
+            self.jobs[key] = job
+        return self.jobs[key]
+
+    def _value(self, handle, metric, t_us):
+        job = self._job(handle, t_us)
+        if job is None:
+            utilization = 0
+            memory = 0.005
+        else:
+            # 训练步的最后 15% 在等待数据和同步，检查点期间 GPU 接近空闲
+            utilization = job["utilization"]
+            if t_us % job["step_us"] > 0.85 * job["step_us"]:
+                utilization *= 0.1
+            if t_us // 1000000 % self.checkpoint_period < 10:
+                utilization = 3
+            memory = job["memory"]
+            if self.noise:
+                rng = random.Random(f"{self.seed}-{handle}-{t_us}")
+                utilization = min(utilization * (1 + rng.uniform(-self.noise, self.noise)), 100)
+                memory = min(memory * (1 + rng.uniform(-self.noise, self.noise)), 0.99)
+
+        if metric == "gpu_utilization":
+            return int(utilization)
+        if metric == "memory_utilization":
+            return int(utilization * 0.6)
+        if metric == "used_memory":
+            return int(self.total_memory * memory)
+        if metric == "power":
+            return int(60000 + 3400 * utilization)  # mW
+        if metric == "memory_temperature":
+            return int(40 + utilization / 4)
+        raise ValueError(f"Unknown metric: {metric}")
+
+    def nvmlInit(self):
+        self.initialized = True
+
+    def nvmlShutdown(self):
+        self._check()
+        self.initialized = False
+
+    def nvmlDeviceGetCount(self):
+        self._check()
+        return self.n_gpus
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        self._check()
+        if not 0 <= index < self.n_gpus:
+            raise NVMLError(NVML_ERROR_INVALID_ARGUMENT)
+        return index
+
+    def nvmlDeviceGetName(self, handle):
+        self._check()
+        return "NVIDIA A100-SXM4-80GB"
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        self._check()
+        used = self._value(handle, "used_memory", self._now_us())
+        return c_nvmlMemory_t(total=self.total_memory, free=self.total_memory - used, used=used)
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        self._check()
+        t_us = self._now_us()
+        return c_nvmlUtilization_t(
+            gpu=self._value(handle, "gpu_utilization", t_us), memory=self._value(handle, "memory_utilization", t_us)
+        )
+
+    def nvmlDeviceGetGraphicsRunningProcesses(self, handle):
+        self._check()
+        return []
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        self._check()
+        t_us = self._now_us()
+        job = self._job(handle, t_us)
+        if job is None:
+            return []
+        used = self._value(handle, "used_memory", t_us) // self.n_procs
+        return [
+            c_nvmlProcessInfo_t(pid=pid, usedGpuMemory=used, gpuInstanceId=0, computeInstanceId=0)
+            for pid in job["pids"]
+        ]
+
+    def nvmlDeviceGetSamples(self, handle, sampling_type, last_seen):
+        self._check()
+        metric = {
+            NVML_GPU_UTILIZATION_SAMPLES: "gpu_utilization",
+            NVML_MEMORY_UTILIZATION_SAMPLES: "memory_utilization",
+            NVML_TOTAL_POWER_SAMPLES: "power",
+        }.get(sampling_type)
+        if metric is None:
+            raise NVMLError(NVML_ERROR_NOT_SUPPORTED)
+
+        # 缓冲区中的采样点对齐到 sample_interval_us，只返回比 last_seen 更新的部分
+        latest = self._now_us() // self.sample_interval_us
+        first = max(latest - self.buffer_size + 1, last_seen // self.sample_interval_us + 1)
+        if first > latest:
+            raise NVMLError(NVML_ERROR_NOT_FOUND)
+        samples = []
+        for i in range(first, latest + 1):
+            t_us = i * self.sample_interval_us
+            value = c_nvmlValue_t(uiVal=self._value(handle, metric, t_us))
+            samples.append(c_nvmlSample_t(timeStamp=t_us, sampleValue=value))
+        return NVML_VALUE_TYPE_UNSIGNED_INT, samples
+
+    def nvmlDeviceGetFieldValues(self, handle, field_ids):
+        self._check()
+        t_us = self._now_us()
+        metrics = {NVML_FI_DEV_POWER_INSTANT: "power", NVML_FI_DEV_MEMORY_TEMP: "memory_temperature"}
+        values = (c_nvmlFieldValue_t * len(field_ids))()
+        for value, field_id in zip(values, field_ids):
+            value.fieldId = field_id
+            value.timestamp = t_us
+            if field_id in metrics:
+                value.valueType = NVML_VALUE_TYPE_UNSIGNED_INT
+                value.value.uiVal = self._value(handle, metrics[field_id], t_us)
+            else:
+                value.nvmlReturn = NVML_ERROR_NOT_SUPPORTED
+        return values
+
+
+class FakeProcessCache:
+    """
+    与 ProcessCache 接口相同的进程信息来源，返回 FakeNVML 中模拟进程所属的用户。
+    """
+
+    def __init__(self, nvml):
+        self.nvml = nvml
+
+    def update(self, pids):
+        return {
+            pid: {"user": self.nvml.owners.get(pid, "N/A"), "name": "python", "cpu_usage": 100.0} for pid in pids
+        }
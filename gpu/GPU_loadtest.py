@@ -0,0 +1,363 @@
+import asyncio
+import datetime as dt
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import psutil
+from loguru import logger
+
+from GPU_logger import *
+from GPU_fake_nvml import FakeNVML
+from GPU_protocol import encode_record
+from GPU_data_receiver import DeviceWriter, parse_timestamp, serve
+from GPU_data_sender import SpoolSender
+from GPU_spool import MessageSpool
+
+# 第 i 条消息的时间戳为 START_TIME 之后 i 秒（发送端的本地时间），发送速度与时间戳无关，即加速回放
+START_TIME = dt.datetime(2024, 1, 1, 8)
+
+
+def synthetic_samples(n_samples=300, n_gpus=8, n_procs=2, high_res=False):
+    # 在模拟的 NVML 上按 1 秒间隔生成的采样，发送时循环使用
+    clock = [START_TIME.timestamp()]
+    fake = FakeNVML(n_gpus=n_gpus, n_procs=n_procs, clock=lambda: clock[0])
+    collector = GPUCollector(high_res=high_res, nvml=fake, processes=fake.processes)
+    samples = []
+    for i in range(n_samples):
+        clock[0] = START_TIME.timestamp() + i
+        samples.append(collector.sample())
+    collector.close()
+    return samples
+
+
+def recorded_samples(db_path, n_samples=300):
+    # 读取实时数据库中最近的 n_samples 次采样，数据库只保存按用户汇总的用量，每个用户还原为一个进程
+    conn = sqlite3.connect(db_path)
+    query = "SELECT DISTINCT timestamp FROM gpu_info ORDER BY timestamp DESC LIMIT ?"
+    timestamps = [row[0] for row in conn.execute(query, (n_samples,))][::-1]
+    samples = []
+    for timestamp in timestamps:
+        gpus = {}
+        rows = conn.execute(
+            """
+            SELECT gpu_index, name, gpu_utilization, memory_utilization, total_memory, used_memory, free_memory
+            FROM gpu_info WHERE timestamp = ? ORDER BY gpu_index
+            """,
+            (timestamp,),
+        )
+        for gpu_index, name, gpu_util, memory_util, total, used, free in rows:
+            gpus[gpu_index] = {
+                "gpu_index": gpu_index,
+                "name": name,
+                "gpu_utilization": gpu_util,
+                "memory_utilization": memory_util,
+                "total_memory": total,
+                "used_memory": used,
+                "free_memory": free,
+                "processes": [],
+            }
+        rows = conn.execute("SELECT gpu_index, user, used_memory FROM gpu_user_info WHERE timestamp = ?", (timestamp,))
+        for gpu_index, user, used in rows:
+            if gpu_index in gpus:
+                gpus[gpu_index]["processes"].append(
+                    {"pid": 0, "user": user, "used_memory": int(used or 0), "cpu_usage": "N/A", "name": "replay"}
+                )
+        samples.append(list(gpus.values()))
+    conn.close()
+    return samples
+
+
+class LoadTestWriter(DeviceWriter):
+    # 记录每条消息写入数据库的时间（Unix 时间），count 为与测试进程共享的已写入消息数
+    def __init__(self, count, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count = count
+        self.stored = {}
+
+    def _record(self, items):
+        super()._record(items)
+        now = time.time()
+        for device, _, _, curr_time in items:
+            self.stored.setdefault((device, to_epoch(curr_time)), now)
+        self.count.value = len(self.stored)
+
+
+def run_receiver(port, data_dir, hub, realtime_period, count, stop, results):
+    # 在独立进程中运行接收端，stop 置位后写完已收到的消息并返回统计结果
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    hub_path = os.path.join(data_dir, "gpu_hub.db") if hub else None
+    writer = LoadTestWriter(count, data_dir=data_dir, realtime_period=realtime_period, hub_path=hub_path)
+
+    async def main():
+        task = asyncio.create_task(serve("127.0.0.1", port, data_dir=data_dir, writer=writer))
+        await asyncio.to_thread(stop.wait)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    process = psutil.Process()
+    cpu = process.cpu_times()
+    try:
+        io = process.io_counters()
+        write_chars, write_bytes = io.write_chars, io.write_bytes
+    except (AttributeError, psutil.Error):
+        # 部分平台或容器中没有进程 I/O 统计
+        write_chars = write_bytes = None
+    results.put(
+        {
+            "stored": writer.stored,
+            "duplicates": writer.duplicates,
+            "invalid": writer.invalid,
+            "cpu": cpu.user + cpu.system,
+            "write_chars": write_chars,
+            "write_bytes": write_bytes,
+        }
+    )
+
+
+def run_senders(senders, n_senders, port, samples, n_messages, rate, ramp, compression, spool_dir, start_at, results):
+    # 在一个工作进程中用线程运行多个发送端，第 k 个发送端在 start_at + ramp * k / n_senders 开始发送
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    def sender(k):
+        time.sleep(max(0, start_at + ramp * k / n_senders - time.time()))
+        device = f"node{k:03d}"
+        spool = MessageSpool(os.path.join(spool_dir, f"spool_{device}.db"), max_messages=n_messages)
+        client = SpoolSender("127.0.0.1", port, spool, compression=compression, backoff_min=0.1, backoff_max=1.0)
+        sent = []
+        try:
+            next_tick = time.monotonic()
+            for i in range(n_messages):
+                timestamp = (START_TIME + dt.timedelta(seconds=i)).isoformat()
+                sent.append(time.time())
+                spool.put(encode_record(timestamp, samples[(i + k) % len(samples)], device))
+                client.send_pending()
+                next_tick = max(next_tick + 1 / rate, time.monotonic())
+                time.sleep(max(0, next_tick - time.monotonic()))
+            # 发送队列中剩余的消息
+            deadline = time.monotonic() + 30
+            while spool.peek(client.sent_id, 1) and time.monotonic() < deadline:
+                if not client.send_pending():
+                    time.sleep(0.05)
+        finally:
+            results.put({"sender": k, "sent": sent, "bytes": client.sent_bytes, "dropped": spool.dropped})
+            client.close()
+            spool.close()
+
+    threads = [threading.Thread(target=sender, args=(k,)) for k in senders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def stored_messages(data_dir, hub, devices):
+    # 每台设备每条已写入的消息：(设备, 时间戳) -> (GPU 行数, GPU 使用率之和, 显存用量之和)
+    stored = {}
+    query = "SELECT timestamp, COUNT(*), SUM(gpu_utilization), SUM(used_memory) FROM gpu_info"
+    for device in devices:
+        if hub:
+            db_path, params = os.path.join(data_dir, "gpu_hub.db"), (device,)
+            rows_query = f"{query} WHERE device = ? GROUP BY timestamp"
+        else:
+            db_path, params = os.path.join(data_dir, f"gpu_info_{device}.db"), ()
+            rows_query = f"{query} GROUP BY timestamp"
+        if not os.path.exists(db_path):
+            continue
+        conn = sqlite3.connect(db_path)
+        for timestamp, *values in conn.execute(rows_query, params):
+            stored[(device, timestamp)] = tuple(values)
+        conn.close()
+    return stored
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_test(
+    n_senders=16,
+    n_messages=600,
+    rate=10.0,
+    ramp=1.0,
+    samples=None,
+    compression="zstd",
+    hub=False,
+    workers=4,
+):
+    """
+    启动 n_senders 个模拟发送端，通过真实的 SpoolSender 和磁盘队列向独立进程中的接收端发送消息。
+
+    每个发送端每秒发送 rate 条消息，每条消息代表 1 秒的采样，rate 即回放的加速倍数；发送端在 ramp 秒内依次启动，
+    分布在 workers 个进程中。发送结束后等待接收端写完全部消息，再从数据库中核对写入的每条消息。
+    """
+    samples = samples or synthetic_samples()
+    # 接收端按时间戳（秒）记录消息，第 i 条消息的时间戳为 epochs[i]
+    epochs = [to_epoch(parse_timestamp((START_TIME + dt.timedelta(seconds=i)).isoformat())) for i in range(n_messages)]
+    expected = {}
+    for k in range(n_senders):
+        for i in range(n_messages):
+            sample = samples[(i + k) % len(samples)]
+            expected[(f"node{k:03d}", epochs[i])] = (
+                len(sample),
+                sum(gpu["gpu_utilization"] for gpu in sample),
+                sum(gpu["used_memory"] for gpu in sample),
+            )
+    keys = list(expected)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        os.makedirs(data_dir)
+        port = free_port()
+        stop = multiprocessing.Event()
+        count = multiprocessing.Value("q", 0, lock=False)
+        receiver_results = multiprocessing.Queue()
+        # 实时数据在测试期间不过期，以便核对全部消息
+        receiver = multiprocessing.Process(
+            target=run_receiver, args=(port, data_dir, hub, n_messages + 3600, count, stop, receiver_results)
+        )
+        receiver.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        start_at = time.time() + 0.5
+        sender_results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=run_senders,
+                args=(
+                    range(w, n_senders, workers),
+                    n_senders,
+                    port,
+                    samples,
+                    n_messages,
+                    rate,
+                    ramp,
+                    compression,
+                    tmp_dir,
+                    start_at,
+                    sender_results,
+                ),
+            )
+            for w in range(min(workers, n_senders))
+        ]
+        for process in processes:
+            process.start()
+        sent = [sender_results.get() for _ in range(n_senders)]
+        for process in processes:
+            process.join()
+        send_end = time.time()
+
+        # 等待接收端写完已收到的消息，数量 10 秒不再增加后视为其余消息丢失
+        last_count, last_change = -1, time.monotonic()
+        while count.value < len(expected) and time.monotonic() - last_change < 10:
+            if count.value != last_count:
+                last_count, last_change = count.value, time.monotonic()
+            time.sleep(0.1)
+        stop.set()
+        receiver_result = receiver_results.get()
+        receiver.join()
+
+        stored = stored_messages(data_dir, hub, [f"node{k:03d}" for k in range(n_senders)])
+        db_size = sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir))
+
+    # 汇总结果
+    sent_time = {}
+    for result in sent:
+        for i, t in enumerate(result["sent"]):
+            sent_time[(f"node{result['sender']:03d}", epochs[i])] = t
+    stored_time = receiver_result["stored"]
+    delivered = [key for key in keys if key in stored]
+    corrupted = sum(stored[key] != expected[key] for key in delivered)
+    latencies = np.array([stored_time[key] - sent_time[key] for key in delivered if key in stored_time]) * 1000
+    wire_bytes = sum(result["bytes"] for result in sent)
+    elapsed = max(stored_time.values(), default=start_at) - start_at
+
+    n_gpus = np.mean([len(sample) for sample in samples])
+    print(
+        f"{n_senders} senders x {n_messages} messages at {rate:g} messages/s each ({n_senders * rate:g} offered), "
+        f"{n_gpus:.0f} GPUs per message, compression {compression}, {'hub' if hub else 'per-device'} databases"
+    )
+    print(
+        f"  delivered {len(delivered)}/{len(keys)}, dropped {len(keys) - len(delivered)}, corrupted {corrupted}, "
+        f"spool overflow {sum(result['dropped'] for result in sent)}, "
+        f"receiver duplicates {receiver_result['duplicates']}, invalid {receiver_result['invalid']}"
+    )
+    print(
+        f"  ingest {len(delivered) / elapsed:8.0f} messages/s over {elapsed:.1f} s "
+        f"(senders finished after {send_end - start_at:.1f} s), "
+        f"receiver CPU {receiver_result['cpu']:.1f} s ({receiver_result['cpu'] / max(len(delivered), 1) * 1e6:.0f} us/message)"
+    )
+    if len(latencies):
+        print(
+            "  send -> stored  "
+            + "  ".join(f"p{q}={np.percentile(latencies, q):8.1f} ms" for q in (50, 90, 99))
+            + f"  max={latencies.max():8.1f} ms"
+        )
+    write_chars = receiver_result["write_chars"]
+    print(
+        f"  received {wire_bytes / 2**20:.1f} MiB, database {db_size / 2**20:.1f} MiB"
+        + (
+            f", written {write_chars / 2**20:.1f} MiB ({write_chars / wire_bytes:.1f}x of received), "
+            f"{receiver_result['write_bytes'] / 2**20:.1f} MiB reached storage"
+            if write_chars is not None and wire_bytes
+            else ""
+        )
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load-test a local receiver with many simulated senders.")
+    parser.add_argument("--senders", type=int, nargs="+", help="Numbers of concurrent senders.", default=[16])
+    parser.add_argument("-n", type=int, help="Messages per sender.", default=600)
+    parser.add_argument("--rate", type=float, help="Messages per second per sender (replay speed-up).", default=10.0)
+    parser.add_argument("--ramp", type=float, help="Seconds over which the senders start.", default=1.0)
+    parser.add_argument("--gpus", type=int, help="GPUs per synthetic sample.", default=8)
+    parser.add_argument("--procs", type=int, help="Processes per GPU in synthetic samples.", default=2)
+    parser.add_argument("--high-res", action="store_true", help="Include high-resolution sample buffers.")
+    parser.add_argument("--replay", help="Replay the latest samples of this realtime database instead.")
+    parser.add_argument("--compression", choices=["zstd", "none"], help="Sender compression.", default="zstd")
+    parser.add_argument("--hub", action="store_true", help="Receiver writes a single multi-device database.")
+    parser.add_argument("--workers", type=int, help="Sender processes.", default=min(4, os.cpu_count()))
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.replay:
+        samples = recorded_samples(args.replay)
+    else:
+        samples = synthetic_samples(n_gpus=args.gpus, n_procs=args.procs, high_res=args.high_res)
+    for n_senders in args.senders:
+        load_test(
+            n_senders,
+            args.n,
+            args.rate,
+            args.ramp,
+            samples,
+            None if args.compression == "none" else args.compression,
+            args.hub,
+            args.workers,
+        )
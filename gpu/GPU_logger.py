@@ -1,73 +1,101 @@
 from loguru import logger
-import pandas as pd
+import numpy as np
 import sqlite3
 import time
 import datetime as dt
+import json
+import queue
+import threading
+from array import array
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+import pynvml
 from pynvml import *
 import psutil
 
 
-def get_gpu_info():
+def get_process_info(processes):
+    process_info = []
+    for p in processes:
+        try:
+            proc = psutil.Process(p.pid)
+            username = proc.username()  # 获取用户
+            cpu_usage = proc.cpu_percent()  # 获取 CPU 使用率
+            process_info.append(
+                {
+                    "pid": p.pid,
+                    "user": username,
+                    "used_memory": p.usedGpuMemory,
+                    "cpu_usage": cpu_usage,
+                    "name": proc.name(),
+                }
+            )
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            # 处理进程终止或权限不足的情况
+            process_info.append(
+                {
+                    "pid": p.pid,
+                    "user": "N/A",
+                    "used_memory": p.usedGpuMemory,
+                    "cpu_usage": "N/A",
+                    "name": "Unknown",
+                }
+            )
+    return process_info
+
+
+def get_gpu_info(nvml=pynvml, processes=None):
+    # nvml 为提供 NVML 接口的模块，processes 为与 ProcessCache 接口相同的进程信息来源，为 None 时通过 psutil 查询；
+    # 两者都可替换为模拟实现（如 GPU_fake_nvml.FakeNVML 及其 processes）
     logger.trace("Getting GPU info")
     # 初始化 NVML
-    nvmlInit()
-    device_count = nvmlDeviceGetCount()
+    nvml.nvmlInit()
+    device_count = nvml.nvmlDeviceGetCount()
     gpu_info = []
 
     for i in range(device_count):
         # 获取 GPU 句柄
-        handle = nvmlDeviceGetHandleByIndex(i)
+        handle = nvml.nvmlDeviceGetHandleByIndex(i)
 
         # 获取 GPU 名称
-        gpu_name = nvmlDeviceGetName(handle)
+        gpu_name = nvml.nvmlDeviceGetName(handle)
 
         # 获取 GPU 使用率
-        utilization = nvmlDeviceGetUtilizationRates(handle)
+        utilization = nvml.nvmlDeviceGetUtilizationRates(handle)
         gpu_utilization = utilization.gpu
         memory_utilization = utilization.memory
 
         # 获取显存信息
-        memory_info = nvmlDeviceGetMemoryInfo(handle)
+        memory_info = nvml.nvmlDeviceGetMemoryInfo(handle)
         total_memory = memory_info.total
         used_memory = memory_info.used
         free_memory = memory_info.free
 
         # 获取正在使用的进程信息
         try:
-            processes = nvmlDeviceGetGraphicsRunningProcesses(handle) + nvmlDeviceGetComputeRunningProcesses(handle)
-        except NVMLError as err:
+            running = nvml.nvmlDeviceGetGraphicsRunningProcesses(handle)
+            running += nvml.nvmlDeviceGetComputeRunningProcesses(handle)
+        except nvml.NVMLError as err:
             if err.value == NVML_ERROR_NOT_SUPPORTED:
-                processes = []  # 某些设备可能不支持获取进程信息
+                running = []  # 某些设备可能不支持获取进程信息
             else:
                 raise
 
-        process_info = []
-        for p in processes:
-            try:
-                proc = psutil.Process(p.pid)
-                username = proc.username()  # 获取用户
-                cpu_usage = proc.cpu_percent()  # 获取 CPU 使用率
-                process_info.append(
-                    {
-                        "pid": p.pid,
-                        "user": username,
-                        "used_memory": p.usedGpuMemory,
-                        "cpu_usage": cpu_usage,
-                        "name": proc.name(),
-                    }
-                )
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                # 处理进程终止或权限不足的情况
-                process_info.append(
-                    {
-                        "pid": p.pid,
-                        "user": "N/A",
-                        "used_memory": p.usedGpuMemory,
-                        "cpu_usage": "N/A",
-                        "name": "Unknown",
-                    }
-                )
+        if processes is None:
+            process_info = get_process_info(running)
+        else:
+            process_meta = processes.update(p.pid for p in running)
+            process_info = [
+                {
+                    "pid": p.pid,
+                    "user": process_meta[p.pid]["user"],
+                    "used_memory": p.usedGpuMemory,
+                    "cpu_usage": process_meta[p.pid]["cpu_usage"],
+                    "name": process_meta[p.pid]["name"],
+                }
+                for p in running
+            ]
 
         # 保存 GPU 信息
         gpu_info.append(
@@ -84,15 +112,337 @@ def get_gpu_info():
         )
 
     # 关闭 NVML
-    nvmlShutdown()
+    nvml.nvmlShutdown()
     logger.trace("Get GPU info completed")
     return gpu_info
 
 
-def initialize_database(db_path="gpu_history.db"):
+class ProcessCache:
+    """
+    GPU 进程元数据的 LRU 缓存，以 (pid, create_time) 为键。
+
+    缓存 psutil.Process 对象及其用户名、进程名，使 cpu_percent() 成为两次采样之间的真实区间测量；
+    进程退出（或不再使用 GPU）后移除对应条目，pid 被复用时通过 create_time 区分。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # (pid, create_time) -> {"process", "user", "name"}
+        self.keys = {}  # pid -> (pid, create_time)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _evict(self, pid):
+        key = self.keys.pop(pid)
+        del self.entries[key]
+
+    def _lookup(self, pid):
+        key = self.keys.get(pid)
+        if key is not None:
+            entry = self.entries[key]
+            # is_running() 会比较 create_time，pid 被复用时视为新进程
+            if entry["process"].is_running():
+                self.entries.move_to_end(key)
+                return entry
+            self._evict(pid)
+
+        proc = psutil.Process(pid)
+        entry = {"process": proc, "user": proc.username(), "name": proc.name()}
+        proc.cpu_percent()  # 首次调用建立 CPU 时间基准
+        key = (pid, proc.create_time())
+        self.entries[key] = entry
+        self.keys[pid] = key
+        if len(self.entries) > self.maxsize:
+            (old_pid, _), _ = self.entries.popitem(last=False)
+            del self.keys[old_pid]
+        return entry
+
+    def update(self, pids):
+        """
+        刷新本次采样中出现的进程，并移除已经不再出现的进程。
+
+        Args:
+            pids (Iterable[int]): 本次采样中所有 GPU 上的进程 pid，可以重复。
+
+        Returns:
+            dict: pid -> {"user", "name", "cpu_usage"}。
+        """
+        info = {}
+        for pid in pids:
+            if pid in info:
+                continue
+            try:
+                entry = self._lookup(pid)
+                info[pid] = {"user": entry["user"], "name": entry["name"], "cpu_usage": entry["process"].cpu_percent()}
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                # 处理进程终止或权限不足的情况
+                if pid in self.keys:
+                    self._evict(pid)
+                info[pid] = {"user": "N/A", "name": "Unknown", "cpu_usage": "N/A"}
+
+        for pid in list(self.keys):
+            if pid not in info:
+                self._evict(pid)
+        return info
+
+
+# 高频采样模式读取的 NVML 采样缓冲区：(指标名, 采样类型)，驱动在缓冲区中保存最近一段时间内的多个采样点
+HIGH_RES_SAMPLES = (
+    ("gpu_utilization", NVML_GPU_UTILIZATION_SAMPLES),
+    ("memory_utilization", NVML_MEMORY_UTILIZATION_SAMPLES),
+    ("power", NVML_TOTAL_POWER_SAMPLES),
+)
+
+# 高频采样模式通过一次 nvmlDeviceGetFieldValues 批量读取的字段：(指标名, 字段 ID)
+HIGH_RES_FIELDS = (
+    ("power_instant", NVML_FI_DEV_POWER_INSTANT),
+    ("memory_temperature", NVML_FI_DEV_MEMORY_TEMP),
+)
+
+# c_nvmlValue_t 联合体中与值类型对应的字段
+NVML_VALUE_FIELDS = {
+    NVML_VALUE_TYPE_DOUBLE: "dVal",
+    NVML_VALUE_TYPE_UNSIGNED_INT: "uiVal",
+    NVML_VALUE_TYPE_UNSIGNED_LONG: "ulVal",
+    NVML_VALUE_TYPE_UNSIGNED_LONG_LONG: "ullVal",
+    NVML_VALUE_TYPE_SIGNED_LONG_LONG: "sllVal",
+    NVML_VALUE_TYPE_SIGNED_INT: "siVal",
+    NVML_VALUE_TYPE_UNSIGNED_SHORT: "usVal",
+}
+
+
+def nvml_value(value_type, value):
+    return getattr(value, NVML_VALUE_FIELDS[value_type])
+
+
+class GPUCollector:
+    """
+    长期持有 NVML 会话的 GPU 信息采集器。
+
+    NVML 只在首次采样时初始化，设备句柄以及名称、总显存、序号等静态属性会被缓存；
+    采样过程中出现 NVML 错误时关闭会话，重新初始化后重试一次。
+
+    high_res 为 True 时，每次采样额外读取 NVML 的采样缓冲区（nvmlDeviceGetSamples）和批量字段
+    （nvmlDeviceGetFieldValues），在每张 GPU 的信息中以 "samples" 给出自上次采样以来的全部采样点：
+    {指标名: [[NVML 时间戳（微秒）, 值], ...]}。
+
+    nvml 和 processes 为可替换的指标来源：nvml 是提供 NVML 接口的模块，processes 是与 ProcessCache 接口相同的进程
+    信息来源，模拟实现见 GPU_fake_nvml。
+    """
+
+    def __init__(self, high_res=False, nvml=pynvml, processes=None):
+        self.nvml = nvml
+        self.high_res = high_res
+        self.devices = None
+        self.processes = ProcessCache() if processes is None else processes
+        self.last_seen = {}  # (gpu_index, 指标名) -> 已读取的最新采样时间戳
+
+    def _init(self):
+        logger.trace("Initializing NVML session")
+        self.nvml.nvmlInit()
+        self.devices = []
+        for i in range(self.nvml.nvmlDeviceGetCount()):
+            handle = self.nvml.nvmlDeviceGetHandleByIndex(i)
+            self.devices.append(
+                {
+                    "gpu_index": i,
+                    "handle": handle,
+                    "name": self.nvml.nvmlDeviceGetName(handle),
+                    "total_memory": self.nvml.nvmlDeviceGetMemoryInfo(handle).total,
+                }
+            )
+        logger.trace(f"NVML session initialized with {len(self.devices)} devices")
+
+    def close(self):
+        if self.devices is None:
+            return
+        self.devices = None
+        try:
+            self.nvml.nvmlShutdown()
+        except self.nvml.NVMLError as err:
+            logger.warning(f"Failed to shutdown NVML: {err}")
+
+    def _sample_high_res(self, device):
+        handle = device["handle"]
+        samples = {}
+        for metric, sampling_type in HIGH_RES_SAMPLES:
+            key = (device["gpu_index"], metric)
+            last_seen = self.last_seen.get(key, 0)
+            try:
+                value_type, buffer = self.nvml.nvmlDeviceGetSamples(handle, sampling_type, last_seen)
+            except self.nvml.NVMLError as err:
+                # 自上次读取以来没有新的采样点，或设备不支持该采样类型
+                if err.value in (NVML_ERROR_NOT_FOUND, NVML_ERROR_NOT_SUPPORTED):
+                    continue
+                raise
+            points = [[s.timeStamp, nvml_value(value_type, s.sampleValue)] for s in buffer if s.timeStamp > last_seen]
+            if points:
+                self.last_seen[key] = points[-1][0]
+                samples[metric] = points
+
+        try:
+            values = self.nvml.nvmlDeviceGetFieldValues(handle, [field_id for _, field_id in HIGH_RES_FIELDS])
+        except self.nvml.NVMLError as err:
+            if err.value != NVML_ERROR_NOT_SUPPORTED:
+                raise
+            values = []
+        for (metric, _), value in zip(HIGH_RES_FIELDS, values):
+            if value.nvmlReturn == NVML_SUCCESS:
+                samples[metric] = [[value.timestamp, nvml_value(value.valueType, value.value)]]
+        return samples
+
+    def _sample(self):
+        samples = []
+        for device in self.devices:
+            handle = device["handle"]
+            utilization = self.nvml.nvmlDeviceGetUtilizationRates(handle)
+            memory_info = self.nvml.nvmlDeviceGetMemoryInfo(handle)
+
+            try:
+                processes = self.nvml.nvmlDeviceGetGraphicsRunningProcesses(handle)
+                processes += self.nvml.nvmlDeviceGetComputeRunningProcesses(handle)
+            except self.nvml.NVMLError as err:
+                if err.value == NVML_ERROR_NOT_SUPPORTED:
+                    processes = []  # 某些设备可能不支持获取进程信息
+                else:
+                    raise
+            samples.append((device, utilization, memory_info, processes))
+
+        # 同一进程可能出现在多张 GPU 上，每次采样只查询一次
+        process_meta = self.processes.update(p.pid for *_, processes in samples for p in processes)
+
+        gpu_info = []
+        for device, utilization, memory_info, processes in samples:
+            gpu = {
+                "gpu_index": device["gpu_index"],
+                "name": device["name"],
+                "gpu_utilization": utilization.gpu,
+                "memory_utilization": utilization.memory,
+                "total_memory": device["total_memory"],
+                "used_memory": memory_info.used,
+                "free_memory": memory_info.free,
+                "processes": [
+                    {
+                        "pid": p.pid,
+                        "user": process_meta[p.pid]["user"],
+                        "used_memory": p.usedGpuMemory,
+                        "cpu_usage": process_meta[p.pid]["cpu_usage"],
+                        "name": process_meta[p.pid]["name"],
+                    }
+                    for p in processes
+                ],
+            }
+            if self.high_res:
+                gpu["samples"] = self._sample_high_res(device)
+            gpu_info.append(gpu)
+        return gpu_info
+
+    def sample(self):
+        logger.trace("Sampling GPU info")
+        if self.devices is None:
+            self._init()
+        try:
+            gpu_info = self._sample()
+        except self.nvml.NVMLError as err:
+            # NVML 出错后重新初始化会话再重试一次
+            logger.warning(f"NVML error while sampling, reinitializing: {err}")
+            self.close()
+            self._init()
+            gpu_info = self._sample()
+        logger.trace("Sample GPU info completed")
+        return gpu_info
+
+
+# 历史数据的汇总层级：(层级名, 表名后缀, 时间粒度秒数)，每一层由上一层汇总而来
+HISTORY_TIERS = (
+    ("30s", "", 30),
+    ("5m", "_5m", 300),
+    ("1h", "_1h", 3600),
+    ("1d", "_1d", 86400),
+)
+
+# 数据库表结构版本，记录在 PRAGMA user_version 中
+# 0/1: timestamp 为 "YYYY-MM-DD HH:MM:SS" 格式的 TEXT，timestamp 和 gpu_index 分别建索引
+# 2: timestamp 为整数 Unix 时间戳（秒，UTC），使用以 timestamp 开头的复合覆盖索引
+SCHEMA_VERSION = 2
+
+# 含 timestamp 列的数据表
+TIMESTAMP_TABLES = ["gpu_info", "gpu_user_info"] + [
+    f"{table}{suffix}" for _, suffix, _ in HISTORY_TIERS for table in ("gpu_history", "gpu_user_history")
+]
+
+# 当前版本的索引：(索引名, 表名, 列)
+SCHEMA_INDEXES = [
+    ("idx_gpu_info_covering", "gpu_info", "timestamp, gpu_index, gpu_utilization, used_memory"),
+    ("idx_user_info_covering", "gpu_user_info", "timestamp, gpu_index, user, gpu_utilization, used_memory"),
+]
+SCHEMA_INDEXES += [("idx_gpu_samples_timestamp", "gpu_samples", "timestamp, gpu_index, metric")]
+for _, suffix, _ in HISTORY_TIERS:
+    SCHEMA_INDEXES += [
+        (
+            f"idx_gpu_history{suffix}_covering",
+            f"gpu_history{suffix}",
+            "timestamp, gpu_index, gpu_utilization, used_memory",
+        ),
+        (
+            f"idx_user_history{suffix}_covering",
+            f"gpu_user_history{suffix}",
+            "timestamp, user, gpu_index, gpu_utilization, used_memory",
+        ),
+        (f"idx_user_history{suffix}_user", f"gpu_user_history{suffix}", "user, timestamp"),
+    ]
+
+# 多设备（hub）数据库的每张表多一列 device，索引改为以 device 开头（按设备查询）；
+# 历史表的覆盖索引另有在 timestamp 之后加入 device 的一组（覆盖全部设备的长时间范围查询）。
+# 实时表每秒写入，覆盖全部设备的查询只取最新数据，不再额外维护一组索引；
+# 以 user 开头的索引没有这一组，否则查询计划会为了 GROUP BY user 选择它而不是覆盖索引
+HUB_TABLES = TIMESTAMP_TABLES + ["gpu_samples"]
+HUB_INDEXES = []
+for name, table, columns in SCHEMA_INDEXES:
+    HUB_INDEXES.append((f"{name}_device", table, f"device, {columns}"))
+    if table.startswith(("gpu_history", "gpu_user_history")) and name.endswith("_covering"):
+        first, rest = columns.split(", ", 1)
+        HUB_INDEXES.append((f"{name}_fleet", table, f"{first}, device, {rest}"))
+
+# 聚合结果的唯一索引：同一时间每张 GPU（每个用户）只有一条聚合记录，多设备数据库中再加上 device；
+# 发送端重连后重发的聚合结果由 INSERT OR IGNORE 忽略
+UNIQUE_INDEXES = [
+    ("idx_gpu_history_unique", "gpu_history", "timestamp, gpu_index"),
+    ("idx_user_history_unique", "gpu_user_history", "timestamp, gpu_index, user"),
+]
+
+# 旧版本的单列索引，迁移时删除
+LEGACY_INDEXES = [
+    "idx_gpu_timestamp",
+    "idx_gpu_index",
+    "idx_user_timestamp",
+    "idx_user_gpu_index",
+    "idx_gpu_history_gpu_index",
+    "idx_user_history_gpu_index",
+] + [f"idx_{table}{suffix}_timestamp" for _, suffix, _ in HISTORY_TIERS for table in ("gpu_history", "user_history")]
+
+
+def to_epoch(timestamp):
+    # 统一转换为整数 Unix 时间戳（秒），没有时区信息的时间视为 UTC
+    if isinstance(timestamp, str):
+        timestamp = dt.datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, dt.datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=dt.timezone.utc)
+        return int(timestamp.timestamp())
+    return int(timestamp)
+
+
+def initialize_database(db_path="gpu_history.db", hub=False):
+    # hub 为 True 时初始化为多设备数据库，见 HUB_INDEXES
     logger.trace(f"Initializing database at {db_path}")
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    is_new = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'gpu_info'").fetchone() is None
+    if is_new:
+        # auto_vacuum 在建表前设置即可生效，新建的数据库直接使用 INCREMENTAL，无需转换（见 enable_incremental_vacuum）
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
     # 创建 GPU 信息表，允许多条记录
     cursor.execute(
@@ -106,77 +456,202 @@ def initialize_database(db_path="gpu_history.db"):
             total_memory INTEGER,
             used_memory INTEGER,
             free_memory INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            timestamp INTEGER DEFAULT (UNIXEPOCH())
         )
         """
     )
 
-    # 创建 GPU 历史记录 以更长间隔记录历史数据
+    # 创建 GPU 用户使用记录表，允许多条记录
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS gpu_history (
+        CREATE TABLE IF NOT EXISTS gpu_user_info (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             gpu_index INTEGER,
-            gpu_utilization INTEGER,
-            gpu_utilization_max INTEGER,
-            gpu_utilization_min INTEGER,
+            user TEXT,
             used_memory INTEGER,
-            used_memory_max INTEGER,
-            used_memory_min INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            gpu_utilization INTEGER,
+            timestamp INTEGER DEFAULT (UNIXEPOCH())
         )
         """
     )
 
-    # 创建 GPU 用户使用记录表，允许多条记录
+    # 创建高频采样表，每行保存一张 GPU 一个指标在一次采样中读到的全部采样点
+    # timestamp 为首个采样点所在的秒（Unix 时间戳），start 为其微秒时间戳，
+    # offsets 为各采样点相对 start 的微秒偏移（小端 uint32），vals 为采样值（小端 float32）
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS gpu_user_info (
+        CREATE TABLE IF NOT EXISTS gpu_samples (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             gpu_index INTEGER,
-            user TEXT,
-            used_memory INTEGER,
-            gpu_utilization INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            metric TEXT,
+            timestamp INTEGER,
+            start INTEGER,
+            count INTEGER,
+            offsets BLOB,
+            vals BLOB
         )
         """
     )
 
-    # 创建 GPU 用户使用历史记录表，以更长间隔记录历史数据
+    # 创建 GPU 历史记录表及其汇总层级表，以更长间隔记录历史数据
+    # 汇总层级表的 timestamp 为时间桶的起点
+    for _, suffix, _ in HISTORY_TIERS:
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS gpu_history{suffix} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                gpu_index INTEGER,
+                gpu_utilization INTEGER,
+                gpu_utilization_max INTEGER,
+                gpu_utilization_min INTEGER,
+                used_memory INTEGER,
+                used_memory_max INTEGER,
+                used_memory_min INTEGER,
+                timestamp INTEGER DEFAULT (UNIXEPOCH())
+            )
+            """
+        )
+
+        # 创建 GPU 用户使用历史记录表
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS gpu_user_history{suffix} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                gpu_index INTEGER,
+                user TEXT,
+                used_memory INTEGER,
+                used_memory_max INTEGER,
+                used_memory_min INTEGER,
+                gpu_utilization INTEGER,
+                gpu_utilization_max INTEGER,
+                gpu_utilization_min INTEGER,
+                timestamp INTEGER DEFAULT (UNIXEPOCH())
+            )
+            """
+        )
+
+    # 汇总进度：每个层级表（多设备数据库中每台设备）已读到的上一层最大 id 和已汇总到的时间，见 rollup_history
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS gpu_user_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            gpu_index INTEGER,
-            user TEXT,
-            used_memory INTEGER,
-            used_memory_max INTEGER,
-            used_memory_min INTEGER,
-            gpu_utilization INTEGER,
-            gpu_utilization_max INTEGER,
-            gpu_utilization_min INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            tier_table TEXT,
+            device TEXT NOT NULL DEFAULT '',
+            last_id INTEGER,
+            last_time INTEGER,
+            PRIMARY KEY (tier_table, device)
         )
         """
     )
 
+    if is_new:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    if hub:
+        for table in HUB_TABLES:
+            columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+            if "device" not in columns:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN device TEXT")
+    conn.commit()
+    conn.close()
+
+    # 旧版本数据库在此迁移到当前版本
+    migrate_database(db_path)
+
     # 添加索引
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_timestamp ON gpu_info (timestamp)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_index ON gpu_info (gpu_index)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_timestamp ON gpu_user_info (timestamp)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_gpu_index ON gpu_user_info (gpu_index)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_history_timestamp ON gpu_history (timestamp)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gpu_history_gpu_index ON gpu_history (gpu_index)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_history_timestamp ON gpu_user_history (timestamp)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_history_gpu_index ON gpu_user_history (gpu_index)")
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for name, table, columns in HUB_INDEXES if hub else SCHEMA_INDEXES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        for name, table, columns in UNIQUE_INDEXES:
+            if hub:
+                columns = f"{columns}, device"
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is None:
+                # 建立唯一索引前删除此前重复写入的聚合记录，只保留最早的一条
+                deleted = conn.execute(
+                    f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {columns})"
+                ).rowcount
+                if deleted:
+                    logger.info(f"Removed {deleted} duplicate rows from {table}")
+                conn.execute(f"CREATE UNIQUE INDEX {name} ON {table} ({columns})")
+    conn.close()
+    logger.trace("Initialize database completed")
+
+
+def migrate_database(db_path="gpu_history.db", batch_size=50000):
+    """
+    将数据库在线迁移到当前的表结构版本。
+
+    旧版本的 TEXT 时间戳按 id 分批原地转换为整数时间戳，每批使用一个短事务，迁移期间网页和记录程序仍可读写数据库；
+    随后删除旧的单列索引、建立复合覆盖索引并更新 user_version。已是当前版本的数据库不做任何操作。
 
+    Args:
+        db_path (str): SQLite 数据库路径。
+        batch_size (int): 每个事务转换的 id 数量。
+
+    Returns:
+        int: 转换的记录数。
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        return 0
+
+    logger.info(f"Migrating {db_path} to schema version {SCHEMA_VERSION}")
+    # 先删除旧索引，避免转换时逐行维护 timestamp 索引
+    for name in LEGACY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
     conn.commit()
+
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    total = 0
+    for table in TIMESTAMP_TABLES:
+        if table not in tables:
+            continue
+        converted = 0
+        last_id = 0
+        while True:
+            # 每批重新读取最大 id，迁移期间新写入的旧格式记录同样会被转换
+            max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+            if last_id >= max_id:
+                break
+            batch_end = min(last_id + batch_size, max_id)
+            with conn:
+                converted += conn.execute(
+                    f"""
+                    UPDATE {table} SET timestamp = UNIXEPOCH(timestamp)
+                    WHERE id > ? AND id <= ? AND typeof(timestamp) = 'text'
+                    """,
+                    (last_id, batch_end),
+                ).rowcount
+            last_id = batch_end
+        if converted:
+            logger.info(f"Converted {converted} timestamps in {table}")
+        total += converted
+
+    with conn:
+        for name, table, columns in SCHEMA_INDEXES:
+            if table in tables:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.close()
-    logger.trace("Initialize database completed")
+    logger.info(f"Migrate {db_path} completed")
+    return total
+
+
+def get_user_usage(gpu):
+    # 按用户汇总显存用量，GPU 使用率按进程数平均分配
+    user_data = {}
+    tot_processes = len(gpu["processes"])
+    for proc in gpu["processes"]:
+        if proc["user"] not in user_data:
+            user_data[proc["user"]] = {"used_memory": 0, "gpu_utilization": 0}
+        user_data[proc["user"]]["used_memory"] += proc["used_memory"]
+        user_data[proc["user"]]["gpu_utilization"] += gpu["gpu_utilization"] / tot_processes
+    return user_data
 
 
 def update_database(gpu_info, timestamp, db_path="gpu_history.db"):
     logger.trace(f"Updating database at {db_path} with timestamp {timestamp}")
+    timestamp = to_epoch(timestamp)
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
@@ -204,15 +679,7 @@ def update_database(gpu_info, timestamp, db_path="gpu_history.db"):
             )
 
             # 插入 GPU 用户使用信息
-            user_data = {}
-            tot_processes = len(gpu["processes"])
-            for proc in gpu["processes"]:
-                if proc["user"] not in user_data:
-                    user_data[proc["user"]] = {"used_memory": 0, "gpu_utilization": 0}
-                user_data[proc["user"]]["used_memory"] += proc["used_memory"]
-                user_data[proc["user"]]["gpu_utilization"] += gpu["gpu_utilization"] / tot_processes
-
-            for user, data in user_data.items():
+            for user, data in get_user_usage(gpu).items():
                 cursor.execute(
                     """
                     INSERT INTO gpu_user_info (gpu_index, user, used_memory, gpu_utilization, timestamp)
@@ -240,15 +707,149 @@ def update_database(gpu_info, timestamp, db_path="gpu_history.db"):
     logger.trace("Update database completed")
 
 
+def connect_database(db_path="gpu_history.db"):
+    # 长期持有的写连接：WAL 模式下读者不会被写入阻塞
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def encode_samples(points):
+    """
+    将 [[微秒时间戳, 值], ...] 编码为 gpu_samples 表的 (timestamp, start, count, offsets, vals)。
+    """
+    timestamps = np.array([t for t, _ in points], dtype=np.int64)
+    start = int(timestamps[0])
+    offsets = (timestamps - start).astype("<u4").tobytes()
+    vals = np.array([v for _, v in points], dtype="<f4").tobytes()
+    return start // 1000000, start, len(points), offsets, vals
+
+
+def decode_samples(start, offsets, vals):
+    # gpu_samples 表中一行的解码，返回微秒时间戳和采样值
+    return start + np.frombuffer(offsets, dtype="<u4").astype(np.int64), np.frombuffer(vals, dtype="<f4")
+
+
+class DatabaseWriter:
+    """
+    长期持有 SQLite 连接的批量写入器，可直接替代 update_database。
+
+    连接以 WAL 模式和 synchronous=NORMAL 打开，每次采样的 GPU 记录和用户记录分别用 executemany 批量插入；
+    commit_every 大于 1 时，多次采样合并在同一个事务中提交，为 None 时只在调用 flush() 时提交。
+    GPU 信息中带有高频采样点（"samples"）时，每张 GPU 的每个指标编码为 gpu_samples 表中的一行。
+
+    device 不为 None 时写入多设备数据库的 device 列。conn 为多台设备共享的写连接时，不由写入器关闭，
+    flush() 会一并提交其他设备未提交的采样。
+    """
+
+    def __init__(self, db_path="gpu_history.db", commit_every=1, device=None, conn=None):
+        logger.trace(f"Opening database writer at {db_path}")
+        self.db_path = db_path
+        self.commit_every = commit_every
+        self.pending = 0
+        self.device = () if device is None else (device,)
+        self.device_column = "" if device is None else ", device"
+        self.device_value = "" if device is None else ", ?"
+        self.owns_conn = conn is None
+        self.conn = connect_database(db_path) if conn is None else conn
+
+    def write(self, gpu_info, timestamp):
+        timestamp = to_epoch(timestamp)
+        gpu_rows = []
+        user_rows = []
+        sample_rows = []
+        for gpu in gpu_info:
+            gpu_rows.append(
+                (
+                    gpu["gpu_index"],
+                    gpu["name"],
+                    gpu["gpu_utilization"],
+                    gpu["memory_utilization"],
+                    gpu["total_memory"],
+                    gpu["used_memory"],
+                    gpu["free_memory"],
+                    timestamp,
+                )
+                + self.device
+            )
+            for user, data in get_user_usage(gpu).items():
+                user_rows.append(
+                    (gpu["gpu_index"], user, data["used_memory"], data["gpu_utilization"], timestamp) + self.device
+                )
+            for metric, points in gpu.get("samples", {}).items():
+                if points:
+                    sample_rows.append((gpu["gpu_index"], metric) + encode_samples(points) + self.device)
+
+        shared = not self.owns_conn
+        try:
+            if shared:
+                # 共享连接上出错时只回滚本次写入，不影响其他设备未提交的采样
+                if not self.conn.in_transaction:
+                    self.conn.execute("BEGIN")
+                self.conn.execute("SAVEPOINT write")
+            self.conn.executemany(
+                f"""
+                INSERT INTO gpu_info (gpu_index, name, gpu_utilization, memory_utilization, total_memory, used_memory, free_memory, timestamp{self.device_column})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?{self.device_value})
+                """,
+                gpu_rows,
+            )
+            self.conn.executemany(
+                f"""
+                INSERT INTO gpu_user_info (gpu_index, user, used_memory, gpu_utilization, timestamp{self.device_column})
+                VALUES (?, ?, ?, ?, ?{self.device_value})
+                """,
+                user_rows,
+            )
+            if sample_rows:
+                self.conn.executemany(
+                    f"""
+                    INSERT INTO gpu_samples (gpu_index, metric, timestamp, start, count, offsets, vals{self.device_column})
+                    VALUES (?, ?, ?, ?, ?, ?, ?{self.device_value})
+                    """,
+                    sample_rows,
+                )
+            if shared:
+                self.conn.execute("RELEASE write")
+        except Exception as e:
+            logger.error(f"Error updating database: {e}")
+            if shared:
+                self.conn.execute("ROLLBACK TO write")
+                self.conn.execute("RELEASE write")
+                return
+            # 出现错误时回滚，未提交的采样一并丢弃
+            self.conn.rollback()
+            self.pending = 0
+            return
+
+        self.pending += 1
+        if self.commit_every is not None and self.pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.owns_conn:
+            self.conn.close()
+        logger.trace(f"Database writer at {self.db_path} closed")
+
+
 # 合并timestamp前period秒内的数据，提取平均值、最大值和最小值
 def aggregate_data(timestamp, period_s=30, db_path="gpu_history.db", db_realtime_path="gpu_info.db"):
+    import pandas as pd
+
     logger.trace(f"Aggregating data at {timestamp} with period {period_s} seconds")
     conn = sqlite3.connect(db_realtime_path)
     cursor = conn.cursor()
 
     # 查询时间范围
-    start_time = (timestamp - pd.Timedelta(seconds=period_s)).strftime("%Y-%m-%d %H:%M:%S")
-    end_time = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    end_time = to_epoch(timestamp)
+    start_time = end_time - period_s
 
     query = """
         SELECT gpu_index, gpu_utilization, used_memory
@@ -342,35 +943,827 @@ def aggregate_data(timestamp, period_s=30, db_path="gpu_history.db", db_realtime
     logger.trace("Aggregate data completed")
 
 
-def remove_old_data(timestamp, period_s=3600, db_path="gpu_history.db"):
-    logger.trace(f"Removing old data before {timestamp - pd.Timedelta(seconds=period_s)}")
+def grouped_stats(groups, values, n_groups):
+    # 按组计算平均值、第一四分位数和第三四分位数（线性插值，与 pandas quantile 一致）
+    counts = np.bincount(groups, minlength=n_groups)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    mean = np.bincount(groups, weights=values, minlength=n_groups) / counts
+
+    sorted_values = values[np.lexsort((values, groups))]
+    quantiles = []
+    for q in (0.25, 0.75):
+        pos = (counts - 1) * q
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        frac = pos - lo
+        quantiles.append(sorted_values[offsets + lo] * (1 - frac) + sorted_values[offsets + hi] * frac)
+    return mean, quantiles[0], quantiles[1]
+
+
+class StreamingAggregator:
+    """
+    在内存中维护当前聚合窗口的流式聚合器，替代 aggregate_data 回读实时数据库。
+
+    窗口内每个 gpu_index 和 (gpu_index, user) 的采样值连同组号追加到紧凑的 array 缓冲区中；
+    窗口关闭时一次性向量化计算平均值和四分位数，并批量写入 gpu_history / gpu_user_history。
+    device 和 conn 的含义同 DatabaseWriter。
+    """
+
+    def __init__(self, db_path="gpu_history.db", device=None, conn=None):
+        self.db_path = db_path
+        self.device = () if device is None else (device,)
+        self.device_column = "" if device is None else ", device"
+        self.device_value = "" if device is None else ", ?"
+        self.owns_conn = conn is None
+        self.conn = conn
+        self.reset()
+
+    def reset(self):
+        self.gpu_keys = {}  # gpu_index -> 组号
+        self.gpu_groups = array("q")
+        self.gpu_utilization = array("d")
+        self.gpu_used_memory = array("d")
+        self.user_keys = {}  # (gpu_index, user) -> 组号
+        self.user_groups = array("q")
+        self.user_used_memory = array("d")
+        self.user_gpu_utilization = array("d")
+
+    def __len__(self):
+        return len(self.gpu_groups)
+
+    def add(self, gpu_info):
+        for gpu in gpu_info:
+            group = self.gpu_keys.setdefault(gpu["gpu_index"], len(self.gpu_keys))
+            self.gpu_groups.append(group)
+            self.gpu_utilization.append(gpu["gpu_utilization"])
+            self.gpu_used_memory.append(gpu["used_memory"])
+
+            for user, data in get_user_usage(gpu).items():
+                group = self.user_keys.setdefault((gpu["gpu_index"], user), len(self.user_keys))
+                self.user_groups.append(group)
+                self.user_used_memory.append(data["used_memory"])
+                self.user_gpu_utilization.append(data["gpu_utilization"])
+
+    def compute(self):
+        """
+        计算当前窗口的聚合结果并清空缓冲区。
+
+        Returns:
+            gpu_rows (list[tuple]): (gpu_index, gpu_utilization, gpu_utilization_max, gpu_utilization_min,
+                used_memory, used_memory_max, used_memory_min)。
+            user_rows (list[tuple]): (gpu_index, user, used_memory, used_memory_max, used_memory_min,
+                gpu_utilization, gpu_utilization_max, gpu_utilization_min)。
+        """
+        gpu_rows = []
+        if self.gpu_keys:
+            groups = np.frombuffer(self.gpu_groups, dtype=np.int64)
+            n_groups = len(self.gpu_keys)
+            util_avg, util_min, util_max = grouped_stats(groups, np.frombuffer(self.gpu_utilization), n_groups)
+            mem_avg, mem_min, mem_max = grouped_stats(groups, np.frombuffer(self.gpu_used_memory), n_groups)
+            for gpu_index, i in self.gpu_keys.items():
+                gpu_rows.append(
+                    (
+                        gpu_index,
+                        float(util_avg[i]),
+                        float(util_max[i]),
+                        float(util_min[i]),
+                        float(mem_avg[i]),
+                        float(mem_max[i]),
+                        float(mem_min[i]),
+                    )
+                )
+
+        user_rows = []
+        if self.user_keys:
+            groups = np.frombuffer(self.user_groups, dtype=np.int64)
+            n_groups = len(self.user_keys)
+            mem_avg, mem_min, mem_max = grouped_stats(groups, np.frombuffer(self.user_used_memory), n_groups)
+            util_avg, util_min, util_max = grouped_stats(groups, np.frombuffer(self.user_gpu_utilization), n_groups)
+            for (gpu_index, user), i in self.user_keys.items():
+                user_rows.append(
+                    (
+                        gpu_index,
+                        user,
+                        float(mem_avg[i]),
+                        float(mem_max[i]),
+                        float(mem_min[i]),
+                        float(util_avg[i]),
+                        float(util_max[i]),
+                        float(util_min[i]),
+                    )
+                )
+
+        self.reset()
+        return gpu_rows, user_rows
+
+    def flush(self, timestamp):
+        # 计算当前窗口的聚合结果并写入历史数据库，返回 compute() 的结果
+        logger.trace(f"Flushing aggregated data at {timestamp}")
+        gpu_rows, user_rows = self.compute()
+        self.write(gpu_rows, user_rows, timestamp)
+        logger.trace("Flush aggregated data completed")
+        return gpu_rows, user_rows
+
+    def write(self, gpu_rows, user_rows, timestamp):
+        # 写入一个聚合周期的结果，行的格式与 compute() 的返回值相同；已有同一时间的聚合记录（重发的聚合结果）时忽略
+        timestamp = to_epoch(timestamp)
+        if self.conn is None:
+            self.conn = connect_database(self.db_path)
+
+        with self.conn:
+            self.conn.executemany(
+                f"""
+                INSERT OR IGNORE INTO gpu_history (gpu_index, gpu_utilization, gpu_utilization_max, gpu_utilization_min, used_memory, used_memory_max, used_memory_min, timestamp{self.device_column})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?{self.device_value})
+                """,
+                [tuple(row) + (timestamp,) + self.device for row in gpu_rows],
+            )
+            self.conn.executemany(
+                f"""
+                INSERT OR IGNORE INTO gpu_user_history (gpu_index, user, used_memory, used_memory_max, used_memory_min, gpu_utilization, gpu_utilization_max, gpu_utilization_min, timestamp{self.device_column})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?{self.device_value})
+                """,
+                [tuple(row) + (timestamp,) + self.device for row in user_rows],
+            )
+
+    def close(self):
+        if self.conn is not None and self.owns_conn:
+            self.conn.close()
+        self.conn = None
+
+
+# 汇总到更粗层级时各列的聚合方式
+ROLLUP_COLUMNS = {
+    "gpu_utilization": "AVG",
+    "gpu_utilization_max": "MAX",
+    "gpu_utilization_min": "MIN",
+    "used_memory": "AVG",
+    "used_memory_max": "MAX",
+    "used_memory_min": "MIN",
+}
+
+
+def rollup_history(conn, timestamp, retention=None, device=None):
+    """
+    将历史数据逐层汇总到更粗的层级，并删除各层级中超过保留期限的数据。
+
+    每一层在 rollup_state 表中记录已读到的上一层的最大 id 和已汇总到的时间（此前的时间桶均已结束）。
+    每次汇总此后结束的时间桶，以及上一层新写入的行中落在更早时间桶中的迟到数据（如发送端重放的离线缓存）所在的时间桶：
+    先删除层级表中这些时间桶的旧结果再重新汇总，因此可以重复调用。上一层中已超过保留期限的时间桶数据可能不完整，
+    只在层级表中还没有该时间桶时汇总。汇总方式与历史查询的重新分桶一致：
+    平均值取平均，第一四分位数取最小，第三四分位数取最大。
+
+    汇总层级的时间戳为时间桶的起点，而 30 秒层级的时间戳为聚合窗口的结束时间：时间戳为 T 的行对应 [T - 30, T)，
+    按 (T - 1) 分桶，时间桶 [b, b + period) 包含时间戳在 (b, b + period] 中的 30 秒数据。
+
+    Args:
+        conn (sqlite3.Connection): 历史数据库连接。
+        timestamp (datetime | int): 当前时间。
+        retention (dict | None): 层级名 -> 保留秒数，未指定或为 None 的层级永久保留。
+        device (str | None): 多设备数据库中只汇总和清理该设备的数据。
+    """
+    logger.trace(f"Rolling up history at {timestamp}")
+    now = to_epoch(timestamp)
+    retention = retention or {}
+    device_filter = "" if device is None else " AND device = ?"
+    device_params = () if device is None else (device,)
+
+    with conn:
+        for (source_tier, source, _), (_, suffix, period) in zip(HISTORY_TIERS, HISTORY_TIERS[1:]):
+            end_time = now // period * period
+            # 上一层的时间戳与其所属时间桶的偏移（见上文）
+            shift = 1 if source_tier == HISTORY_TIERS[0][0] else 0
+            # 上一层早于该时间的数据可能已被清理
+            source_expire = None if retention.get(source_tier) is None else now - int(retention[source_tier])
+            for table, group_columns in (("gpu_history", "gpu_index"), ("gpu_user_history", "gpu_index, user")):
+                if device is not None:
+                    group_columns = f"device, {group_columns}"
+                state_key = (f"{table}{suffix}", "" if device is None else device)
+                max_id = conn.execute(f"SELECT MAX(id) FROM {table}{source}").fetchone()[0]
+                if max_id is None:
+                    continue
+                state = conn.execute(
+                    "SELECT last_id, last_time FROM rollup_state WHERE tier_table = ? AND device = ?", state_key
+                ).fetchone()
+                if state is None:
+                    # 层级表为空时汇总上一层的全部数据；已有汇总结果（旧版本的记录程序）时从其最后一个时间桶之后继续
+                    last_time = conn.execute(
+                        f"SELECT MAX(timestamp) FROM {table}{suffix} WHERE 1{device_filter}", device_params
+                    ).fetchone()[0]
+                    state = (0, end_time) if last_time is None else (max_id, last_time + period)
+                last_id, last_time = state
+
+                # 上一层新写入的行落在已汇总过的时间桶中；按 id 范围读取，不使用以 timestamp 或 device 开头的索引
+                buckets = [
+                    row[0]
+                    for row in conn.execute(
+                        f"""
+                        SELECT DISTINCT (timestamp - {shift}) / {period} * {period}
+                        FROM {table}{source}
+                        WHERE id > ? AND +timestamp < ?{device_filter.replace("device", "+device")}
+                        """,
+                        (last_id, last_time + shift) + device_params,
+                    )
+                ]
+                expired = [bucket for bucket in buckets if source_expire is not None and bucket < source_expire]
+                if expired:
+                    existing = {
+                        row[0]
+                        for row in conn.execute(
+                            f"""
+                            SELECT DISTINCT timestamp FROM {table}{suffix}
+                            WHERE timestamp >= ? AND timestamp < ?{device_filter}
+                            """,
+                            (min(expired), source_expire) + device_params,
+                        )
+                    }
+                    buckets = [bucket for bucket in buckets if bucket >= source_expire or bucket not in existing]
+
+                # 合并相邻的时间桶，加上此后结束的时间桶
+                ranges = []
+                for bucket in sorted(buckets):
+                    if ranges and ranges[-1][1] == bucket:
+                        ranges[-1][1] = bucket + period
+                    else:
+                        ranges.append([bucket, bucket + period])
+                if last_time < end_time:
+                    ranges.append([last_time, end_time])
+
+                conn.executemany(
+                    f"DELETE FROM {table}{suffix} WHERE timestamp >= ? AND timestamp < ?{device_filter}",
+                    [tuple(time_range) + device_params for time_range in ranges],
+                )
+                conn.executemany(
+                    f"""
+                    INSERT INTO {table}{suffix} ({group_columns}, {", ".join(ROLLUP_COLUMNS)}, timestamp)
+                    SELECT
+                        {group_columns},
+                        {", ".join(f"{func}({column})" for column, func in ROLLUP_COLUMNS.items())},
+                        (timestamp - {shift}) / {period} * {period} AS bucket
+                    FROM {table}{source}
+                    WHERE timestamp >= ? AND timestamp < ?{device_filter}
+                    GROUP BY {group_columns}, bucket
+                    """,
+                    [(start + shift, end + shift) + device_params for start, end in ranges],
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO rollup_state (tier_table, device, last_id, last_time) VALUES (?, ?, ?, ?)",
+                    state_key + (max_id, max(last_time, end_time)),
+                )
+
+        # 按层级删除过期数据
+        for tier, suffix, _ in HISTORY_TIERS:
+            if retention.get(tier) is not None:
+                expire_time = now - int(retention[tier])
+                for table in ("gpu_history", "gpu_user_history"):
+                    conn.execute(
+                        f"DELETE FROM {table}{suffix} WHERE timestamp < ?{device_filter}",
+                        (expire_time,) + device_params,
+                    )
+    logger.trace("Roll up history completed")
+
+
+RETENTION_MODES = ("vacuum", "incremental")
+
+
+def get_retention_mode(db_path="gpu_history.db"):
+    # 数据库当前适用的清理方式：auto_vacuum 为 INCREMENTAL（新建的数据库或已转换过）时为 "incremental"
+    conn = sqlite3.connect(db_path)
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    return "incremental" if auto_vacuum == 2 else "vacuum"
+
+
+def enable_incremental_vacuum(db_path="gpu_history.db"):
+    # auto_vacuum 只能在建表前设置，已有数据库需要 VACUUM 一次才能转换，期间数据库被锁定，耗时与数据库大小成正比
+    conn = sqlite3.connect(db_path)
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        size = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0] / 2**20
+        logger.warning(f"Converting {db_path} ({size:.0f} MiB) to auto_vacuum=INCREMENTAL with a one-time VACUUM")
+        start = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info(f"Converted {db_path} in {time.perf_counter() - start:.1f} s")
+    conn.close()
+
+
+def resolve_retention(db_path, retention=None):
+    """
+    确定实时数据库的清理方式。
+
+    retention 为 None 时沿用数据库当前的方式（见 get_retention_mode），不转换已有的数据库；
+    为 "incremental" 时将尚未转换的数据库转换为 auto_vacuum=INCREMENTAL（一次完整的 VACUUM）。
+    """
+    if retention is None:
+        retention = get_retention_mode(db_path)
+        if retention == "vacuum":
+            logger.info(f"{db_path} keeps full VACUUM retention, use --retention incremental to convert it once")
+    elif retention == "incremental":
+        enable_incremental_vacuum(db_path)
+    return retention
+
+
+def remove_old_data(timestamp, period_s=3600, db_path="gpu_history.db", mode="vacuum", vacuum_pages=256, device=None):
+    """
+    删除 timestamp 前 period_s 秒之前的实时数据，device 不为 None 时只删除多设备数据库中该设备的数据。
+
+    mode 为 "vacuum" 时每次删除后执行完整的 VACUUM；为 "incremental" 时只用 incremental_vacuum 释放至多
+    vacuum_pages 个空闲页，数据库需先通过 enable_incremental_vacuum 转换。
+    """
+    start_time = to_epoch(timestamp) - period_s
+    logger.trace(f"Removing old data before {start_time}")
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    device_filter = "" if device is None else " AND device = ?"
+    params = (start_time,) if device is None else (start_time, device)
 
     # 删除过期的 GPU 信息
-    start_time = (timestamp - pd.Timedelta(seconds=period_s)).strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("DELETE FROM gpu_info WHERE timestamp < ?", (start_time,))
+    cursor.execute(f"DELETE FROM gpu_info WHERE timestamp < ?{device_filter}", params)
 
     # 删除过期的 GPU 用户使用信息
-    cursor.execute("DELETE FROM gpu_user_info WHERE timestamp < ?", (start_time,))
+    cursor.execute(f"DELETE FROM gpu_user_info WHERE timestamp < ?{device_filter}", params)
+
+    # 删除过期的高频采样点
+    cursor.execute(f"DELETE FROM gpu_samples WHERE timestamp < ?{device_filter}", params)
 
     # 提交事务
     conn.commit()
 
-    # VAACUUM
-    cursor.execute("VACUUM")
-    conn.commit()
+    if mode == "incremental":
+        # 每次最多归还 vacuum_pages 页，其余空闲页留给后续插入复用
+        cursor.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+        conn.commit()
+    else:
+        # VAACUUM
+        cursor.execute("VACUUM")
+        conn.commit()
 
     conn.close()
     logger.trace("Remove old data completed")
 
 
+class GPURecorder:
+    """
+    记录一台设备的 GPU 采样。
+
+    每次采样写入实时数据库并加入流式聚合窗口；每经过一个聚合周期，将窗口的聚合结果写入历史数据库并更新汇总层级，
+    并按 retention 指定的方式（见 resolve_retention）清理实时数据库中的过期数据。record() 在聚合周期结束时返回该周期的聚合结果
+    {"gpu": gpu_rows, "user": user_rows}（格式同 StreamingAggregator.compute），否则返回 None。
+
+    persist 为 False 时不读写任何数据库，只在内存中按相同的周期聚合，供发送端在本地聚合后只发送聚合结果。
+
+    device 不为 None 时写入多设备数据库（db_path 和 db_realtime_path 可以是同一个文件），conn 为多台设备共享的写连接，
+    实时数据和聚合结果都通过它写入。
+    """
+
+    def __init__(
+        self,
+        db_path="gpu_history.db",
+        db_realtime_path="gpu_info.db",
+        aggr_period=30,
+        realtime_period=3600,
+        commit_every=1,
+        retention=None,
+        vacuum_pages=256,
+        history_retention=None,
+        persist=True,
+        device=None,
+        conn=None,
+    ):
+        self.db_realtime_path = db_realtime_path
+        self.aggr_period = aggr_period
+        self.realtime_period = realtime_period
+        self.retention = retention
+        self.vacuum_pages = vacuum_pages
+        self.history_retention = history_retention
+        self.persist = persist
+        self.device = device
+        self.writer = None
+        if persist:
+            self.retention = resolve_retention(db_realtime_path, retention)
+            self.writer = DatabaseWriter(db_path=db_realtime_path, commit_every=commit_every, device=device, conn=conn)
+        self.aggregator = StreamingAggregator(db_path=db_path, device=device, conn=conn)
+        self.timestamp_last = None
+
+    def record(self, gpu_info, curr_time):
+        if self.persist:
+            self.writer.write(gpu_info, curr_time)
+        self.aggregator.add(gpu_info)
+        if self.timestamp_last is None:
+            self.timestamp_last = curr_time
+        elif (curr_time - self.timestamp_last).total_seconds() >= self.aggr_period - 1:
+            self.timestamp_last = curr_time
+            if self.persist:
+                # 清理前先提交实时数据，避免与写连接上未提交的事务冲突
+                self.writer.flush()
+                gpu_rows, user_rows = self.aggregator.flush(curr_time)
+                self._maintain(curr_time)
+            else:
+                gpu_rows, user_rows = self.aggregator.compute()
+            return {"gpu": gpu_rows, "user": user_rows}
+        return None
+
+    def record_aggregated(self, gpu_info, history, curr_time):
+        """
+        记录发送端已经聚合好的一个周期。
+
+        Args:
+            gpu_info (list): 周期结束时的最新采样，只写入实时数据库，不参与聚合；可以为空。
+            history (dict): {"gpu": gpu_rows, "user": user_rows}，格式同 StreamingAggregator.compute。
+            curr_time (datetime): 周期结束的时间。
+        """
+        if gpu_info:
+            self.writer.write(gpu_info, curr_time)
+        self.writer.flush()
+        self.aggregator.write(history["gpu"], history["user"], curr_time)
+        self._maintain(curr_time)
+
+    def _maintain(self, curr_time):
+        rollup_history(self.aggregator.conn, curr_time, self.history_retention, self.device)
+        remove_old_data(
+            curr_time,
+            period_s=self.realtime_period,
+            db_path=self.db_realtime_path,
+            mode=self.retention,
+            vacuum_pages=self.vacuum_pages,
+            device=self.device,
+        )
+
+    def flush(self):
+        # 提交实时数据库中尚未提交的采样
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.aggregator.close()
+
+
+class SamplingPipeline:
+    """
+    按单调时钟的整数倍节拍采样，采样结果经有界队列交给独立的持久化线程写入数据库。
+
+    第 k 次采样安排在 start + k * interval，与采样、写入的耗时无关，周期不会漂移；写入、聚合或清理数据库变慢时
+    只会让队列积压，不会推迟采样。计数器：
+    - late：开始时间比节拍晚 late_threshold 秒以上的采样；
+    - missed：上一次采样超时而整个跳过的节拍；
+    - dropped：队列已满时丢弃的最旧采样。
+
+    metrics 为 MetricsState 时，每次采样和每个聚合周期的结果同时更新到其中，供 MetricsServer 提供给采集端。
+    """
+
+    def __init__(self, collector, recorder, interval=1.0, queue_size=60, late_threshold=0.1, metrics=None):
+        self.collector = collector
+        self.recorder = recorder
+        self.interval = interval
+        self.late_threshold = late_threshold
+        self.metrics = metrics
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._persist, name="GPU persistence", daemon=True)
+        self.stats = {"samples": 0, "late": 0, "missed": 0, "dropped": 0, "errors": 0}
+
+    def _persist(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            gpu_info, curr_time = item
+            try:
+                history = self.recorder.record(gpu_info, curr_time)
+            except Exception as e:
+                logger.error(f"Error recording GPU info: {e}")
+                continue
+            if history is not None and self.metrics is not None:
+                self.metrics.update_period(history, curr_time)
+
+    def _enqueue(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                # 持久化跟不上时丢弃最旧的采样，保留最新的数据
+                try:
+                    self.queue.get_nowait()
+                    self.stats["dropped"] += 1
+                except queue.Empty:
+                    pass
+
+    def _tick(self):
+        try:
+            gpu_info = self.collector.sample()
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Error sampling GPU info: {e}")
+            return
+        self.stats["samples"] += 1
+        curr_time = dt.datetime.now(tz=dt.timezone.utc)
+        if self.metrics is not None:
+            self.metrics.update(gpu_info, curr_time, self.stats)
+        self._enqueue((gpu_info, curr_time))
+
+    def run(self, max_ticks=None):
+        # 在当前线程中按节拍采样，直到 stop() 或完成 max_ticks 个节拍
+        if not self.thread.is_alive():
+            self.thread.start()
+        tick = time.monotonic()
+        ticks = 0
+        while not self.stop_event.is_set() and (max_ticks is None or ticks < max_ticks):
+            if time.monotonic() - tick > self.late_threshold:
+                self.stats["late"] += 1
+            self._tick()
+            ticks += 1
+
+            tick += self.interval
+            now = time.monotonic()
+            if now >= tick:
+                # 本次采样超过了一个周期，跳过已错过的节拍，下一次采样仍落在节拍上
+                missed = int((now - tick) // self.interval) + 1
+                self.stats["missed"] += missed
+                tick += missed * self.interval
+                logger.warning(f"Sampling overran, skipped {missed} tick(s)")
+            self.stop_event.wait(tick - time.monotonic())
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        # 等待持久化线程写完队列中剩余的采样
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.recorder.close()
+        logger.info(f"Sampling pipeline closed: {self.stats}")
+
+
+# StreamingAggregator.compute() 返回的每行对应的历史数据库列
+HISTORY_GPU_COLUMNS = (
+    "gpu_index",
+    "gpu_utilization",
+    "gpu_utilization_max",
+    "gpu_utilization_min",
+    "used_memory",
+    "used_memory_max",
+    "used_memory_min",
+)
+HISTORY_USER_COLUMNS = (
+    "gpu_index",
+    "user",
+    "used_memory",
+    "used_memory_max",
+    "used_memory_min",
+    "gpu_utilization",
+    "gpu_utilization_max",
+    "gpu_utilization_min",
+)
+
+
+def prometheus_labels(**labels):
+    # 标签值中的反斜杠、双引号和换行需要转义
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class MetricsState:
+    """
+    在内存中保存最新一次采样和最近一个聚合周期的结果，供 MetricsServer 以 Prometheus 文本格式和 JSON 提供。
+
+    update() 由采样线程调用，update_period() 由持久化线程调用；两种格式的响应在数据更新后的第一次请求时生成并缓存，
+    之后的请求直到下一次更新都直接返回缓存的字节串，不访问数据库。
+    """
+
+    def __init__(self, device="leo", aggr_period=30):
+        self.device = device
+        self.aggr_period = aggr_period
+        self.lock = threading.Lock()
+        self.gpu_info = []
+        self.timestamp = None
+        self.stats = {}
+        self.period = None  # {"timestamp", "gpu", "user"}
+        self.cache = {}  # 格式 -> 响应字节串
+
+    def update(self, gpu_info, curr_time, stats=None):
+        with self.lock:
+            self.gpu_info = gpu_info
+            self.timestamp = to_epoch(curr_time)
+            self.stats = dict(stats or {})
+            self.cache.clear()
+
+    def update_period(self, history, curr_time):
+        # history 为 GPURecorder.record() 在聚合周期结束时返回的 {"gpu": gpu_rows, "user": user_rows}
+        with self.lock:
+            self.period = {"timestamp": to_epoch(curr_time), "gpu": history["gpu"], "user": history["user"]}
+            self.cache.clear()
+
+    def render(self, fmt="prometheus"):
+        with self.lock:
+            if fmt not in self.cache:
+                self.cache[fmt] = self._json() if fmt == "json" else self._prometheus()
+            return self.cache[fmt]
+
+    def _json(self):
+        data = {
+            "device": self.device,
+            "timestamp": self.timestamp,
+            "gpu_info": [
+                {
+                    **{key: value for key, value in gpu.items() if key not in ("processes", "samples")},
+                    "users": get_user_usage(gpu),
+                }
+                for gpu in self.gpu_info
+            ],
+            "stats": self.stats,
+            "period": None,
+        }
+        if self.period is not None:
+            # 聚合结果的字段与历史数据库的列相同，*_max / *_min 为第三 / 第一四分位数
+            data["period"] = {
+                "timestamp": self.period["timestamp"],
+                "seconds": self.aggr_period,
+                "gpu": [dict(zip(HISTORY_GPU_COLUMNS, row)) for row in self.period["gpu"]],
+                "user": [dict(zip(HISTORY_USER_COLUMNS, row)) for row in self.period["user"]],
+            }
+        return json.dumps(data, ensure_ascii=False).encode()
+
+    def _prometheus(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{prometheus_labels(**labels)} {value}" for labels, value in samples)
+
+        device = self.device
+        gpus = [(gpu, {"device": device, "gpu": gpu["gpu_index"], "name": gpu["name"]}) for gpu in self.gpu_info]
+        users = [
+            ({"device": device, "gpu": gpu["gpu_index"], "user": user}, data)
+            for gpu in self.gpu_info
+            for user, data in get_user_usage(gpu).items()
+        ]
+        if self.timestamp is not None:
+            metric(
+                "gpu_sample_timestamp_seconds",
+                "gauge",
+                "Time of the latest sample.",
+                [({"device": device}, self.timestamp)],
+            )
+        metric("gpu_utilization_percent", "gauge", "GPU utilization.", [(l, g["gpu_utilization"]) for g, l in gpus])
+        metric(
+            "gpu_memory_utilization_percent",
+            "gauge",
+            "GPU memory controller utilization.",
+            [(l, g["memory_utilization"]) for g, l in gpus],
+        )
+        metric("gpu_memory_used_bytes", "gauge", "Used GPU memory.", [(l, g["used_memory"]) for g, l in gpus])
+        metric("gpu_memory_total_bytes", "gauge", "Total GPU memory.", [(l, g["total_memory"]) for g, l in gpus])
+        metric("gpu_processes", "gauge", "Processes running on the GPU.", [(l, len(g["processes"])) for g, l in gpus])
+        metric(
+            "gpu_user_utilization_percent",
+            "gauge",
+            "GPU utilization attributed to the user.",
+            [(l, data["gpu_utilization"]) for l, data in users],
+        )
+        metric(
+            "gpu_user_memory_used_bytes",
+            "gauge",
+            "GPU memory used by the user's processes.",
+            [(l, data["used_memory"]) for l, data in users],
+        )
+
+        if self.period is not None:
+            # 每个聚合周期的平均值和四分位数，stat 为 mean、q1、q3
+            stats = (("mean", 0), ("q3", 1), ("q1", 2))
+            metric(
+                "gpu_period_end_timestamp_seconds",
+                "gauge",
+                f"End of the latest {self.aggr_period} s aggregation period.",
+                [({"device": device}, self.period["timestamp"])],
+            )
+            gpu_samples = {"gpu_period_utilization_percent": [], "gpu_period_memory_used_bytes": []}
+            for row in self.period["gpu"]:
+                for stat, i in stats:
+                    labels = {"device": device, "gpu": row[0], "stat": stat}
+                    gpu_samples["gpu_period_utilization_percent"].append((labels, row[1 + i]))
+                    gpu_samples["gpu_period_memory_used_bytes"].append((labels, row[4 + i]))
+            user_samples = {"gpu_period_user_memory_used_bytes": [], "gpu_period_user_utilization_percent": []}
+            for row in self.period["user"]:
+                for stat, i in stats:
+                    labels = {"device": device, "gpu": row[0], "user": row[1], "stat": stat}
+                    user_samples["gpu_period_user_memory_used_bytes"].append((labels, row[2 + i]))
+                    user_samples["gpu_period_user_utilization_percent"].append((labels, row[5 + i]))
+            for name, samples in {**gpu_samples, **user_samples}.items():
+                metric(name, "gauge", "Statistics over the latest aggregation period.", samples)
+
+        for key, value in self.stats.items():
+            metric(
+                f"gpu_logger_{key}_total",
+                "counter",
+                f"Sampling pipeline counter: {key}.",
+                [({"device": device}, value)],
+            )
+        return ("\n".join(lines) + "\n").encode()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 默认保持连接，采集端可以在同一个连接上反复抓取；响应头和响应体分两次写出，
+    # 不关闭 Nagle 算法时保持的连接上每次响应都要等待对端的延迟确认
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    routes = {
+        "/metrics": ("prometheus", "text/plain; version=0.0.4; charset=utf-8"),
+        "/metrics.json": ("json", "application/json"),
+    }
+
+    def do_GET(self):
+        route = self.routes.get(self.path.split("?", 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        fmt, content_type = route
+        body = self.server.metrics.render(fmt)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.trace(f"Metrics request from {self.address_string()}: {format % args}")
+
+
+class MetricsServer:
+    """
+    在后台线程中提供 MetricsState 的 HTTP 服务：/metrics 为 Prometheus 文本格式，/metrics.json 为 JSON。
+    port 为 0 时由系统分配端口，实际端口见 self.port。
+    """
+
+    def __init__(self, metrics, host="0.0.0.0", port=9400):
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = metrics
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="GPU metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Serving metrics at http://{self.server.server_address[0]}:{self.port}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Monitor GPU usage of current device.")
     parser.add_argument("--name", help="The device name to monitor.", default="leo")
+    parser.add_argument(
+        "--commit-every", type=int, help="Number of samples grouped into one realtime DB transaction.", default=1
+    )
+    parser.add_argument(
+        "--high-res",
+        action="store_true",
+        help="Also record the sub-second points in NVML sample buffers into the realtime DB.",
+    )
+    parser.add_argument("--interval", type=float, help="Sampling interval in seconds.", default=1.0)
+    parser.add_argument(
+        "--queue-size", type=int, help="Max samples waiting to be written before the oldest is dropped.", default=60
+    )
+    parser.add_argument(
+        "--retention",
+        choices=RETENTION_MODES,
+        help="How the realtime DB reclaims space: full VACUUM or bounded incremental_vacuum. "
+        "New databases use incremental; by default existing ones keep their current mode, "
+        "and incremental converts them once with a full VACUUM at startup.",
+    )
+    parser.add_argument(
+        "--vacuum-pages", type=int, help="Max pages released per cycle in incremental retention.", default=256
+    )
+    parser.add_argument(
+        "--history-retention",
+        nargs="+",
+        metavar="TIER=DAYS",
+        help=f"Retention in days per history tier ({', '.join(tier for tier, _, _ in HISTORY_TIERS)}), "
+        "tiers not listed are kept forever.",
+        default=[],
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve the latest sample and aggregates over HTTP on this port (/metrics, /metrics.json).",
+    )
+    parser.add_argument("--metrics-host", help="Address the metrics endpoint binds to.", default="0.0.0.0")
     args = parser.parse_args()
+    history_retention = {}
+    for item in args.history_retention:
+        tier, days = item.split("=")
+        if tier not in [name for name, _, _ in HISTORY_TIERS]:
+            parser.error(f"Unknown history tier: {tier}")
+        history_retention[tier] = float(days) * 86400
 
     logger.add("log/GPU_logger_{time:YYYY-MM-DD}.log", rotation="00:00", retention="7 days", level="TRACE")
     logger.info("Starting GPU logger")
@@ -380,20 +1773,36 @@ if __name__ == "__main__":
     initialize_database(db_path=DB_PATH)
     initialize_database(db_path=DB_REALTIME_PATH)
     logger.info("Database initialized")
-    timestamp_last = dt.datetime.now(tz=dt.timezone.utc)
     AGGR_PERIOD = 30  # 聚合周期：30 秒
+    collector = GPUCollector(high_res=args.high_res)
+    recorder = GPURecorder(
+        db_path=DB_PATH,
+        db_realtime_path=DB_REALTIME_PATH,
+        aggr_period=AGGR_PERIOD,
+        realtime_period=3600,
+        commit_every=args.commit_every,
+        retention=args.retention,
+        vacuum_pages=args.vacuum_pages,
+        history_retention=history_retention,
+    )
 
-    while True:
-        try:
-            gpu_info = get_gpu_info()
-            curr_time = dt.datetime.now(tz=dt.timezone.utc)
-            update_database(gpu_info, curr_time.strftime("%Y-%m-%d %H:%M:%S"), db_path=DB_REALTIME_PATH)
-            if (curr_time - timestamp_last).seconds >= AGGR_PERIOD - 1:
-                timestamp_last = curr_time
-                aggregate_data(timestamp_last, period_s=AGGR_PERIOD, db_path=DB_PATH, db_realtime_path=DB_REALTIME_PATH)
-                remove_old_data(timestamp_last, period_s=3600, db_path=DB_REALTIME_PATH)
-            time.sleep(1)
-
-        except KeyboardInterrupt:
-            logger.info("Monitoring stopped")
-            break
+    metrics = None
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics = MetricsState(device=args.name, aggr_period=AGGR_PERIOD)
+        metrics_server = MetricsServer(metrics, host=args.metrics_host, port=args.metrics_port)
+        metrics_server.start()
+
+    pipeline = SamplingPipeline(
+        collector, recorder, interval=args.interval, queue_size=args.queue_size, metrics=metrics
+    )
+
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        logger.info("Monitoring stopped")
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        pipeline.close()
+        collector.close()
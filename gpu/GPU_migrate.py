@@ -0,0 +1,34 @@
+import sqlite3
+import time
+
+from loguru import logger
+
+from GPU_logger import SCHEMA_VERSION, migrate_database
+
+
+# 主程序
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=f"Migrate GPU databases (e.g. data/gpu_history_*.db) to schema version {SCHEMA_VERSION} in place. "
+        "Timestamps are converted in short batches, so the webapp and an upgraded logger can keep using the files."
+    )
+    parser.add_argument("db_paths", nargs="+", help="The database files to migrate.")
+    parser.add_argument("--batch-size", type=int, help="Number of rows converted per transaction.", default=50000)
+    args = parser.parse_args()
+
+    for db_path in args.db_paths:
+        conn = sqlite3.connect(db_path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.close()
+        if version >= SCHEMA_VERSION:
+            logger.info(f"{db_path} is already at schema version {version}")
+            continue
+
+        start = time.perf_counter()
+        converted = migrate_database(db_path, batch_size=args.batch_size)
+        logger.info(
+            f"{db_path}: schema version {version} -> {SCHEMA_VERSION}, "
+            f"{converted} rows converted in {time.perf_counter() - start:.1f} s"
+        )
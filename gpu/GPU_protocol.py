@@ -0,0 +1,312 @@
+import datetime as dt
+import json
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 发送端与接收端之间的帧格式：帧头 + 负载
+# 帧头（网络字节序）：magic (uint16) | 协议版本 (uint8) | 保留 (1 字节) | 负载长度 (uint32)
+MAGIC = 23333
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!HBxI")
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+# 版本 2 为紧凑的二进制编码，负载 = 压缩方式 (uint8) + 若干条消息记录（压缩方式不为 0 时整体压缩）。
+# 每条记录自带字符串表，可以直接拼接（小端字节序）：
+#   RECORD: 时间戳（发送端本地时间，微秒, int64）| 设备名 | 字符串数 (uint16) | GPU 数 (uint16) | 标志 (uint8)
+#   字符串表：每个字符串为长度 (uint16) + UTF-8 字节，设备名、GPU 型号、用户名和进程名用字符串序号表示
+#   每张 GPU：GPU + PROCESS × 进程数 + 每个高频指标的 SAMPLES + 偏移 (uint32 × 点数) + 值 (float32 × 点数)
+#   标志含 HAS_HISTORY 时，之后是发送端聚合的一个周期：HISTORY + HISTORY_GPU × GPU 行数 + HISTORY_USER × 用户行数
+# 进程的 CPU 使用率和高频采样值以 float32 传输，无法获取的进程显存和 CPU 使用率分别编码为 -1 和 NaN。
+COMPACT_VERSION = 2
+SUPPORTED_VERSIONS = (PROTOCOL_VERSION, COMPACT_VERSION)
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSIONS = {"zstd": COMPRESSION_ZSTD} if zstandard is not None else {}
+ZSTD_LEVEL = 3
+ZSTD_ERRORS = (zstandard.ZstdError,) if zstandard is not None else ()
+RECORD = struct.Struct("<qHHHB")
+STRING = struct.Struct("<H")
+GPU = struct.Struct("<HHBBQQQHB")
+PROCESS = struct.Struct("<IHHqf")
+SAMPLES = struct.Struct("<HIq")
+HISTORY = struct.Struct("<HH")
+HISTORY_GPU = struct.Struct("<H6d")
+HISTORY_USER = struct.Struct("<HH6d")
+HAS_HISTORY = 1
+NO_STRING = 0xFFFF
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_frame(payload, version=PROTOCOL_VERSION):
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Payload too large: {len(payload)} bytes")
+    return HEADER.pack(MAGIC, version, len(payload)) + payload
+
+
+def message_payload(timestamp, gpu_info, device=None, history=None):
+    # 版本 1 的负载为 UTF-8 编码的 JSON：{"timestamp": ..., "gpu_info": [...], "device": ..., "history": ...}
+    # device 和 history 可省略。带 history 的消息来自在本地聚合的发送端：history 为一个聚合周期的结果
+    # {"gpu": [...], "user": [...]}（行的格式同 GPU_logger.StreamingAggregator.compute），gpu_info 为周期结束时的最新快照
+    message = {"timestamp": timestamp, "gpu_info": gpu_info}
+    if device is not None:
+        message["device"] = device
+    if history is not None:
+        message["history"] = history
+    return json.dumps(message).encode("utf-8")
+
+
+def encode_message(timestamp, gpu_info, device=None):
+    return encode_frame(message_payload(timestamp, gpu_info, device))
+
+
+def encode_batch(payloads):
+    # 多条消息合并为一帧：{"messages": [消息, ...]}，直接拼接 message_payload 的结果，不重新编码
+    return encode_frame(b'{"messages": [' + b", ".join(payloads) + b"]}")
+
+
+def decode_message(version, payload):
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    # 直接从 memoryview 解码为字符串，不额外复制一份 bytes
+    return json.loads(str(payload, "utf-8"))
+
+
+def decode_messages(version, payload):
+    # 返回一帧中的全部消息，单条消息的帧返回只有一个元素的列表
+    if version == COMPACT_VERSION:
+        if not payload:
+            raise ProtocolError("Empty payload")
+        compression, body = payload[0], payload[1:]
+        if compression not in (COMPRESSION_NONE, *COMPRESSIONS.values()):
+            raise ProtocolError(f"Unsupported compression: {compression}")
+        try:
+            if compression == COMPRESSION_ZSTD:
+                if zstandard.frame_content_size(body) > MAX_PAYLOAD_SIZE:
+                    raise ProtocolError("Decompressed payload too large")
+                body = zstandard.ZstdDecompressor().decompress(body)
+            return decode_records(body)
+        except (struct.error, IndexError) + ZSTD_ERRORS as e:
+            raise ProtocolError(f"Invalid record: {e}")
+    message = decode_message(version, payload)
+    if isinstance(message, dict) and "messages" in message:
+        if not isinstance(message["messages"], list):
+            raise ProtocolError("Invalid batch message")
+        return message["messages"]
+    return [message]
+
+
+def encode_hello(versions=SUPPORTED_VERSIONS, compressions=tuple(COMPRESSIONS), ack=False):
+    # 发送端连接后首先发送的版本 1 消息，列出支持的协议版本和压缩方式；不支持协商的接收端会忽略它
+    # ack 为 True 时请求接收端确认已写入数据库的帧，见 encode_ack
+    hello = {"versions": list(versions), "compressions": list(compressions)}
+    if ack:
+        hello["ack"] = True
+    return encode_frame(json.dumps({"hello": hello}).encode())
+
+
+def negotiate(hello):
+    # 接收端选择双方都支持的最高协议版本和压缩方式，返回回复给发送端的帧；发送端请求确认时回复中带 "ack": true
+    versions = [v for v in hello.get("versions", []) if v in SUPPORTED_VERSIONS]
+    version = max(versions, default=PROTOCOL_VERSION)
+    compression = next((c for c in hello.get("compressions", []) if c in COMPRESSIONS), None)
+    if version == PROTOCOL_VERSION:
+        compression = None
+    reply = {"hello": {"version": version, "compression": compression}}
+    if hello.get("ack") is True:
+        reply["hello"]["ack"] = True
+    return version, compression, encode_frame(json.dumps(reply).encode())
+
+
+def encode_ack(frames):
+    # 接收端发给发送端的版本 1 消息 {"ack": n}：本连接的前 n 帧（包括 hello）中的消息都已写入数据库
+    return encode_frame(json.dumps({"ack": frames}).encode())
+
+
+def encode_record(timestamp, gpu_info, device=None, history=None):
+    # 一条消息的版本 2 记录，参数同 message_payload，timestamp 为 ISO 格式的本地时间
+    strings = {}
+
+    def ref(string):
+        return strings.setdefault(string, len(strings))
+
+    device_id = NO_STRING if device is None else ref(device)
+    parts = []
+    for gpu in gpu_info:
+        processes = gpu["processes"]
+        samples = [(metric, points) for metric, points in gpu.get("samples", {}).items() if points]
+        parts.append(
+            GPU.pack(
+                gpu["gpu_index"],
+                ref(gpu["name"]),
+                gpu["gpu_utilization"],
+                gpu["memory_utilization"],
+                gpu["total_memory"],
+                gpu["used_memory"],
+                gpu["free_memory"],
+                len(processes),
+                len(samples),
+            )
+        )
+        for proc in processes:
+            parts.append(
+                PROCESS.pack(
+                    proc["pid"],
+                    ref(proc["user"]),
+                    ref(proc["name"]),
+                    -1 if proc["used_memory"] is None else proc["used_memory"],
+                    float("nan") if proc["cpu_usage"] == "N/A" else proc["cpu_usage"],
+                )
+            )
+        for metric, points in samples:
+            start = points[0][0]
+            count = len(points)
+            parts.append(SAMPLES.pack(ref(metric), count, start))
+            parts.append(struct.pack(f"<{count}I{count}f", *[p[0] - start for p in points], *[p[1] for p in points]))
+
+    if history is not None:
+        parts.append(HISTORY.pack(len(history["gpu"]), len(history["user"])))
+        parts += [HISTORY_GPU.pack(*row) for row in history["gpu"]]
+        parts += [HISTORY_USER.pack(row[0], ref(row[1]), *row[2:]) for row in history["user"]]
+
+    timestamp_us = (dt.datetime.fromisoformat(timestamp).replace(tzinfo=None) - EPOCH) // dt.timedelta(microseconds=1)
+    flags = 0 if history is None else HAS_HISTORY
+    header = [RECORD.pack(timestamp_us, device_id, len(strings), len(gpu_info), flags)]
+    for string in strings:
+        data = string.encode("utf-8")
+        header.append(STRING.pack(len(data)) + data)
+    return b"".join(header + parts)
+
+
+def decode_records(body):
+    messages = []
+    offset = 0
+    while offset < len(body):
+        timestamp_us, device_id, n_strings, n_gpus, flags = RECORD.unpack_from(body, offset)
+        offset += RECORD.size
+        strings = []
+        for _ in range(n_strings):
+            (length,) = STRING.unpack_from(body, offset)
+            offset += STRING.size
+            strings.append(str(body[offset : offset + length], "utf-8"))
+            offset += length
+
+        gpu_info = []
+        for _ in range(n_gpus):
+            index, name, gpu_util, memory_util, total, used, free, n_procs, n_metrics = GPU.unpack_from(body, offset)
+            offset += GPU.size
+            processes = []
+            for _ in range(n_procs):
+                pid, user, proc_name, proc_memory, cpu_usage = PROCESS.unpack_from(body, offset)
+                offset += PROCESS.size
+                processes.append(
+                    {
+                        "pid": pid,
+                        "user": strings[user],
+                        "used_memory": None if proc_memory < 0 else proc_memory,
+                        "cpu_usage": "N/A" if cpu_usage != cpu_usage else cpu_usage,
+                        "name": strings[proc_name],
+                    }
+                )
+            gpu = {
+                "gpu_index": index,
+                "name": strings[name],
+                "gpu_utilization": gpu_util,
+                "memory_utilization": memory_util,
+                "total_memory": total,
+                "used_memory": used,
+                "free_memory": free,
+                "processes": processes,
+            }
+            if n_metrics:
+                gpu["samples"] = {}
+            for _ in range(n_metrics):
+                metric, count, start = SAMPLES.unpack_from(body, offset)
+                offset += SAMPLES.size
+                values = struct.unpack_from(f"<{count}I{count}f", body, offset)
+                offset += 8 * count
+                gpu["samples"][strings[metric]] = [
+                    (start + ts, value) for ts, value in zip(values[:count], values[count:])
+                ]
+            gpu_info.append(gpu)
+
+        message = {"timestamp": (EPOCH + dt.timedelta(microseconds=timestamp_us)).isoformat(), "gpu_info": gpu_info}
+        if device_id != NO_STRING:
+            message["device"] = strings[device_id]
+        if flags & HAS_HISTORY:
+            n_gpu_rows, n_user_rows = HISTORY.unpack_from(body, offset)
+            offset += HISTORY.size
+            gpu_rows = []
+            for _ in range(n_gpu_rows):
+                gpu_rows.append(HISTORY_GPU.unpack_from(body, offset))
+                offset += HISTORY_GPU.size
+            user_rows = []
+            for _ in range(n_user_rows):
+                row = HISTORY_USER.unpack_from(body, offset)
+                user_rows.append((row[0], strings[row[1]]) + row[2:])
+                offset += HISTORY_USER.size
+            message["history"] = {"gpu": gpu_rows, "user": user_rows}
+        messages.append(message)
+    return messages
+
+
+def encode_records(records, version=COMPACT_VERSION, compression=None):
+    # 把 encode_record 生成的若干条记录编码为一帧；接收端只支持版本 1 时转换为 JSON 批量消息
+    if version == PROTOCOL_VERSION:
+        return encode_batch([json.dumps(message).encode("utf-8") for message in decode_records(b"".join(records))])
+    body = b"".join(records)
+    if compression is None:
+        return encode_frame(bytes([COMPRESSION_NONE]) + body, COMPACT_VERSION)
+    body = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return encode_frame(bytes([COMPRESSIONS[compression]]) + body, COMPACT_VERSION)
+
+
+class FrameDecoder:
+    """
+    从字节流中切分帧。
+
+    接收方把数据直接读入 get_buffer() 返回的缓冲区空闲部分（socket.recv_into 或 asyncio.BufferedProtocol），
+    再调用 buffer_updated(n) 取得这次读到的全部完整帧 (版本, 负载)。负载是指向内部缓冲区的 memoryview，
+    不复制数据，只在下一次 get_buffer() 之前有效；不完整的帧留在缓冲区中，等待后续数据。
+    """
+
+    def __init__(self, size=64 * 1024):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # 第一个未解析字节
+        self.end = 0  # 已读入数据的末尾
+
+    def get_buffer(self):
+        pending = self.end - self.start
+        if self.start and (self.start == self.end or self.end == len(self.buffer)):
+            # 把尚未解析的不完整帧移到缓冲区开头
+            self.buffer[:pending] = bytes(self.view[self.start : self.end])
+            self.start, self.end = 0, pending
+        if self.end == len(self.buffer):
+            # 单帧超过缓冲区大小时扩容
+            self.buffer = self.buffer + bytearray(len(self.buffer))
+            self.view = memoryview(self.buffer)
+        return self.view[self.end :]
+
+    def buffer_updated(self, n):
+        self.end += n
+        frames = []
+        while self.end - self.start >= HEADER.size:
+            magic, version, length = HEADER.unpack_from(self.buffer, self.start)
+            if magic != MAGIC:
+                raise ProtocolError(f"Invalid magic number: {magic}")
+            if length > MAX_PAYLOAD_SIZE:
+                raise ProtocolError(f"Payload too large: {length} bytes")
+            frame_end = self.start + HEADER.size + length
+            if frame_end > self.end:
+                break
+            frames.append((version, self.view[self.start + HEADER.size : frame_end]))
+            self.start = frame_end
+        return frames
@@ -0,0 +1,53 @@
+import sqlite3
+
+from loguru import logger
+
+
+class MessageSpool:
+    """
+    发送端的磁盘队列，保存尚未确认送达的消息负载。
+
+    消息按写入顺序获得递增的 id。put() 写入一条消息，超过 max_messages 条时丢弃最旧的消息；
+    peek(after_id, limit) 按顺序取出 id 大于 after_id 的消息，discard(up_to_id) 删除 id 不超过 up_to_id 的消息。
+    每次写入都立即提交，发送端进程退出或机器重启后，未发送的消息在下次启动时继续发送。
+    """
+
+    def __init__(self, db_path="data/spool.db", max_messages=7 * 86400):
+        self.db_path = db_path
+        self.max_messages = max_messages
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # AUTOINCREMENT 保证队列清空后 id 也不会重复使用
+        self.conn.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, payload BLOB)")
+        self.conn.commit()
+        self.dropped = 0
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def put(self, payload):
+        with self.conn:
+            message_id = self.conn.execute("INSERT INTO spool (payload) VALUES (?)", (payload,)).lastrowid
+            dropped = self.conn.execute("DELETE FROM spool WHERE id <= ?", (message_id - self.max_messages,)).rowcount
+        if dropped:
+            self.dropped += dropped
+            logger.warning(f"Spool full, dropped {dropped} oldest messages")
+        return message_id
+
+    def first_id(self):
+        # 队列中最早的消息 id，队列为空时返回 None
+        return self.conn.execute("SELECT MIN(id) FROM spool").fetchone()[0]
+
+    def peek(self, after_id=0, limit=1000):
+        return self.conn.execute(
+            "SELECT id, payload FROM spool WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+
+    def discard(self, up_to_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM spool WHERE id <= ?", (up_to_id,))
+
+    def close(self):
+        self.conn.close()
+        logger.trace(f"Spool at {self.db_path} closed")
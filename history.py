@@ -12,8 +12,8 @@ from GPU_query_db import (
     dict_username,
     query_gpu_history_average_usage,
     query_gpu_history_usage,
+    query_gpu_user_history_matrix,
     query_gpu_user_history_total_usage,
-    query_gpu_user_history_usage,
     query_min_max_timestamp,
 )
 
@@ -77,26 +77,28 @@ def gpu_chart_band(df: pd.DataFrame, y_label: str, N_GPU: int = 8):
 
 
 def gpu_chart_user(
-    user_usage_grouped: tuple[dict, pd.DatetimeIndex],
+    user_usage: dict,
     y_label: str,
     name_dict: dict | None = None,
     N_GPU: int = 8,
 ):
     # stack area chart for y_label
     # df["gpu_index"] = df["gpu_index"].astype(str)
+    # user_usage 为 query_gpu_user_history_matrix 的结果，每个 (用户, GPU) 是矩阵的一列
     colors = px.colors.qualitative.Plotly
     tot_colors = len(colors)
     opacities = [0.3 + 0.7 * i / (N_GPU - 1) for i in range(N_GPU)]
 
-    data, base = user_usage_grouped
+    timestamp = user_usage["timestamp"]
+    values = user_usage[y_label]
 
     fig = go.Figure()
     # add line of zeros as base
     fig.add_trace(
         go.Scatter(
             name="Base",
-            x=base,
-            y=np.zeros(len(base)),
+            x=timestamp,
+            y=np.zeros(len(timestamp)),
             mode="lines",
             line=dict(width=0),
             stackgroup="one",
@@ -104,7 +106,8 @@ def gpu_chart_user(
         )
     )
 
-    for i, (user, gpu_data) in enumerate(data.items()):
+    # 列按用户名和 GPU 编号排序
+    for i, user in enumerate(pd.unique(user_usage["user"])):
         color = ",".join(
             [str(int(colors[i % tot_colors][j : j + 2], 16)) for j in (1, 3, 5)]
         )
@@ -112,7 +115,7 @@ def gpu_chart_user(
         fig.add_trace(
             go.Scatter(
                 name=username,
-                x=list(gpu_data.values())[0]["timestamp"],
+                x=timestamp[:1],
                 y=[0],
                 mode="lines",
                 legendgroup=username,
@@ -121,18 +124,17 @@ def gpu_chart_user(
                 showlegend=True,
             )
         )
-        for gpu_index, gpu_i in gpu_data.items():
+        for column in np.flatnonzero(user_usage["user"] == user):
+            gpu_index = int(user_usage["gpu_index"][column])
             fig.add_trace(
                 go.Scatter(
                     name=f"{username} GPU {gpu_index}",
-                    x=gpu_i["timestamp"],
-                    y=gpu_i[y_label],
+                    x=timestamp,
+                    y=values[:, column],
                     mode="lines",
-                    line=dict(
-                        width=1, color=f"rgba({color},{opacities[int(gpu_index)]})"
-                    ),
+                    line=dict(width=1, color=f"rgba({color},{opacities[gpu_index]})"),
                     fill="tonexty",
-                    fillcolor=f"rgba({color},{opacities[int(gpu_index)] - 0.2})",
+                    fillcolor=f"rgba({color},{opacities[gpu_index] - 0.2})",
                     stackgroup="one",
                     legendgroup=username,
                     showlegend=False,
@@ -370,9 +372,7 @@ def webapp_history(
             )
 
             if select == "**详细信息**":
-                gpu_usage_df = query_gpu_history_usage(
-                    start_time, end_time, DB_PATH, True
-                )
+                gpu_usage_df = query_gpu_history_usage(start_time, end_time, DB_PATH)
 
                 st.subheader("使用率 %")
                 gpu_chart_band(gpu_usage_df, "gpu_utilization", N_GPU)
@@ -380,8 +380,8 @@ def webapp_history(
                 st.subheader("显存用量 GB")
                 gpu_chart_band(gpu_usage_df, "used_memory", N_GPU)
             elif select == "**用户使用**":
-                user_usage_grouped = query_gpu_user_history_usage(
-                    start_time, end_time, DB_PATH, True
+                user_usage = query_gpu_user_history_matrix(
+                    start_time, end_time, DB_PATH
                 )
                 if os.getenv("ENABLE_NAME_DICT", "0") == "1":
                     name_dict = dict_username(DB_PATH)
@@ -397,12 +397,12 @@ def webapp_history(
                     )
 
                 st.subheader("用户使用率 %")
-                gpu_chart_user(user_usage_grouped, "gpu_utilization", name_dict, N_GPU)
+                gpu_chart_user(user_usage, "gpu_utilization", name_dict, N_GPU)
 
                 st.dataframe(user_total_df)
 
                 st.subheader("用户显存用量 GB")
-                gpu_chart_user(user_usage_grouped, "used_memory", name_dict, N_GPU)
+                gpu_chart_user(user_usage, "used_memory", name_dict, N_GPU)
 
             elif select == "**汇总数据**":
                 gpu_usage_df = query_gpu_history_usage(start_time, end_time, DB_PATH)
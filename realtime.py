@@ -63,22 +63,17 @@ def webapp_realtime(hostname="Virgo", db_path="data/gpu_history_virgo.db", confi
     if st.session_state.get(f"_selection_realtime_{hostname}", None) is None:
         st.session_state[f"_selection_realtime_{hostname}"] = "**详细信息**"
 
-    # 查询时间范围：过去 30 秒
-    def get_time_range():
-        end_time = dt.datetime.now(tz=dt.timezone.utc)
-        start_time = end_time - dt.timedelta(seconds=DURATION)
-        return start_time.strftime("%Y-%m-%d %H:%M:%S"), end_time.strftime("%Y-%m-%d %H:%M:%S")
+    # 一次读取最近 DURATION 秒的全部实时数据：所有会话共用每个数据库的缓冲区，只读取新写入的行
+    snapshot = query_realtime_snapshot(DB_PATH, DURATION)
 
     # 最新数据
-    gpu_current_df = query_latest_gpu_info(DB_PATH)
+    gpu_current_df = snapshot["latest"]
     if not gpu_current_df.empty:
         current_timestamp = gpu_current_df["timestamp"].max()
         col2.write(f"更新于：{current_timestamp}")
 
-    start_time, end_time = get_time_range()
-
-    # 获取数据
-    gpu_utilization_df = query_gpu_realtime_usage(start_time, end_time, DB_PATH)
+    gpu_utilization_df = snapshot["gpu"][["gpu_index", "gpu_utilization", "timestamp"]]
+    gpu_memory_df = snapshot["gpu"][["gpu_index", "used_memory", "timestamp"]]
 
     # 如果没有数据，提示用户
     if gpu_utilization_df.empty:
@@ -114,9 +109,6 @@ def webapp_realtime(hostname="Virgo", db_path="data/gpu_history_virgo.db", confi
         )
 
         if select == "**详细信息**":
-            gpu_utilization_df = query_gpu_realtime_usage(start_time, end_time, DB_PATH)
-            gpu_memory_df = query_gpu_memory_realtime_usage(start_time, end_time, DB_PATH)
-
             # GPU 每台设备的利用率折线图
             st.subheader("使用率 %")
             chart = (
@@ -145,13 +137,13 @@ def webapp_realtime(hostname="Virgo", db_path="data/gpu_history_virgo.db", confi
             st.altair_chart(chart, use_container_width=True)
 
         elif select == "**用户使用**":
-            user_gpu_df = query_user_gpu_realtime_usage(start_time, end_time, DB_PATH)
-            user_gpu_memory_df = query_user_gpu_memory_realtime_usage(start_time, end_time, DB_PATH)
+            user_df = snapshot["user"]
 
             if os.getenv("ENABLE_NAME_DICT", "0") == "1":
                 user_dict = dict_username(DB_PATH)
-                user_gpu_df["user"] = user_gpu_df["user"].apply(lambda x: user_dict.get(x, x))
-                user_gpu_memory_df["user"] = user_gpu_memory_df["user"].apply(lambda x: user_dict.get(x, x))
+                user_df["user"] = user_df["user"].apply(lambda x: user_dict.get(x, x))
+            user_gpu_df = user_df[["gpu_index", "user", "gpu_utilization", "timestamp"]]
+            user_gpu_memory_df = user_df[["gpu_index", "user", "used_memory", "timestamp"]]
 
             st.subheader("用户使用率 %")
             chart = (
@@ -181,9 +173,6 @@ def webapp_realtime(hostname="Virgo", db_path="data/gpu_history_virgo.db", confi
             st.altair_chart(chart, use_container_width=True)
 
         elif select == "**汇总数据**":
-            gpu_utilization_df = query_gpu_realtime_usage(start_time, end_time, DB_PATH)
-            gpu_memory_df = query_gpu_memory_realtime_usage(start_time, end_time, DB_PATH)
-
             # 总 GPU 使用率折线图
             st.subheader("总使用率 %")
             chart = (
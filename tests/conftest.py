@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 网页的查询模块在仓库根目录，记录程序的模块在 gpu/ 下，彼此以模块名直接导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "gpu")]
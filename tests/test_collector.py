@@ -0,0 +1,15 @@
+from GPU_fake_nvml import FakeNVML
+from GPU_logger import GPUCollector, get_gpu_info
+
+
+def test_get_gpu_info_matches_collector_with_fake_processes():
+    fake = FakeNVML(clock=lambda: 1700000000.0)
+    gpu_info = get_gpu_info(nvml=fake, processes=fake.processes)
+    users = {process["user"] for gpu in gpu_info for process in gpu["processes"]}
+    assert users and "N/A" not in users
+
+    collector = GPUCollector(nvml=fake, processes=fake.processes)
+    try:
+        assert collector.sample() == gpu_info
+    finally:
+        collector.close()
@@ -0,0 +1,30 @@
+import pandas as pd
+
+import GPU_query_db as db
+from GPU_logger import initialize_database
+
+
+def test_format_local_time_empty():
+    values = db.to_local_time(pd.Series([], dtype="int64"))
+    assert db.format_local_time(values).empty
+
+
+def test_format_local_time():
+    values = db.to_local_time(pd.Series([0, 86399]))
+    assert db.format_local_time(values).tolist() == ["1970-01-01 08:00:00", "1970-01-02 07:59:59"]
+
+
+def test_latest_gpu_info_empty_database(tmp_path):
+    # 新建的数据库中还没有数据时返回空结果，实时页面据此提示监控程序可能离线
+    db_path = str(tmp_path / "gpu_info.db")
+    initialize_database(db_path)
+    assert db.query_latest_gpu_info(db_path).empty
+    snapshot = db.query_realtime_snapshot(db_path)
+    assert snapshot["latest"].empty and snapshot["gpu"].empty and snapshot["user"].empty
+
+
+def test_fleet_latest_gpu_info_empty_database(tmp_path):
+    hub_path = str(tmp_path / "gpu_hub.db")
+    initialize_database(hub_path, hub=True)
+    assert db.query_fleet_latest_gpu_info(hub_path).empty
+    assert db.query_latest_gpu_info(hub_path, device="leo").empty
@@ -0,0 +1,43 @@
+import sqlite3
+
+from GPU_logger import GPURecorder, get_retention_mode, initialize_database
+
+
+def auto_vacuum(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_new_database_uses_incremental_retention(tmp_path):
+    db_path = tmp_path / "gpu_info.db"
+    initialize_database(db_path=db_path)
+    assert get_retention_mode(db_path) == "incremental"
+
+    recorder = GPURecorder(db_path=tmp_path / "gpu_history.db", db_realtime_path=db_path)
+    assert recorder.retention == "incremental"
+    recorder.close()
+
+
+def test_existing_database_is_converted_only_on_request(tmp_path):
+    # 旧版本创建的数据库：建表时没有设置 auto_vacuum
+    db_path = tmp_path / "gpu_info.db"
+    initialize_database(db_path=db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.close()
+    initialize_database(db_path=db_path)
+    assert auto_vacuum(db_path) == 0
+
+    recorder = GPURecorder(db_path=tmp_path / "gpu_history.db", db_realtime_path=db_path)
+    assert recorder.retention == "vacuum"
+    recorder.close()
+    assert auto_vacuum(db_path) == 0
+
+    recorder = GPURecorder(db_path=tmp_path / "gpu_history.db", db_realtime_path=db_path, retention="incremental")
+    assert recorder.retention == "incremental"
+    recorder.close()
+    assert auto_vacuum(db_path) == 2
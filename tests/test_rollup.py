@@ -0,0 +1,36 @@
+import sqlite3
+
+from GPU_logger import initialize_database, rollup_history
+from GPU_query_db import get_history_table
+
+
+def insert_history(conn, rows):
+    conn.executemany(
+        """
+        INSERT INTO gpu_history (gpu_index, gpu_utilization, gpu_utilization_max, gpu_utilization_min,
+            used_memory, used_memory_max, used_memory_min, timestamp)
+        VALUES (0, ?, ?, ?, 0, 0, 0, ?)
+        """,
+        [(value, value, value, timestamp) for timestamp, value in rows],
+    )
+
+
+def test_rollup_buckets_rows_by_window_end(tmp_path):
+    db_path = tmp_path / "gpu_history.db"
+    initialize_database(db_path=db_path)
+    conn = sqlite3.connect(db_path)
+
+    # 30 秒层级的时间戳为窗口结束时间：时间戳 600 的行对应 [570, 600)，属于从 300 开始的 5 分钟时间桶
+    start = 3600
+    insert_history(conn, [(start + 30 * i, 10 if i <= 10 else 50) for i in range(1, 21)])
+    rollup_history(conn, start + 600 + 30)
+
+    rows = conn.execute("SELECT timestamp, gpu_utilization, gpu_utilization_max FROM gpu_history_5m ORDER BY timestamp")
+    assert rows.fetchall() == [(start, 10, 10), (start + 300, 50, 50)]
+
+    # 查询在汇总层级之后由基础表补齐时，边界上的行只来自汇总层级
+    table = get_history_table(conn, "gpu_history", 300, start, start + 900)
+    insert_history(conn, [(start + 630, 90)])
+    timestamps = [row[0] for row in conn.execute(f"SELECT timestamp FROM {table} ORDER BY timestamp")]
+    assert timestamps == [start, start + 300, start + 630]
+    conn.close()
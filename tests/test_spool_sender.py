@@ -0,0 +1,147 @@
+import asyncio
+import datetime as dt
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from GPU_data_receiver import DeviceWriter, serve
+from GPU_data_sender import SpoolSender
+from GPU_protocol import FrameDecoder, decode_message, encode_frame, encode_record
+from GPU_spool import MessageSpool
+
+GPU_INFO = [
+    {
+        "gpu_index": 0,
+        "name": "Fake GPU",
+        "gpu_utilization": 50,
+        "memory_utilization": 10,
+        "total_memory": 80 << 30,
+        "used_memory": 8 << 30,
+        "free_memory": 72 << 30,
+        "processes": [],
+    }
+]
+START_TIME = dt.datetime(2024, 1, 1, 8)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def put_messages(spool, start, n):
+    for i in range(start, start + n):
+        spool.put(encode_record((START_TIME + dt.timedelta(seconds=i)).isoformat(), GPU_INFO, "node"))
+
+
+def wait_for(condition, sender, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        sender.send_pending()
+        time.sleep(0.02)
+
+
+class Receiver:
+    # 在后台线程中运行的接收端
+    def __init__(self, data_dir):
+        self.port = free_port()
+        self.writer = DeviceWriter(data_dir=str(data_dir))
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(serve("127.0.0.1", self.port, data_dir=str(data_dir), writer=self.writer))
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+        self.loop.close()
+
+
+class SilentReceiver:
+    # 回复 hello 并同意确认，之后读取全部数据但不写入也不确认，模拟网络静默中断或接收端主机宕机
+    def __init__(self, ack=True):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.ack = ack
+        self.received = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        conn, _ = self.server.accept()
+        decoder = FrameDecoder()
+        hello = None
+        while True:
+            n = conn.recv_into(decoder.get_buffer())
+            if n == 0:
+                break
+            for frame in decoder.buffer_updated(n):
+                if hello is None:
+                    hello = decode_message(*frame)["hello"]
+                    reply = {"version": 2, "compression": None}
+                    if self.ack:
+                        reply["ack"] = True
+                    conn.sendall(encode_frame(json.dumps({"hello": reply}).encode()))
+                else:
+                    self.received += 1
+        conn.close()
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = MessageSpool(db_path=str(tmp_path / "spool.db"))
+    yield spool
+    spool.close()
+
+
+def test_acknowledged_messages_are_discarded(tmp_path, spool):
+    receiver = Receiver(tmp_path / "data")
+    sender = SpoolSender("127.0.0.1", receiver.port, spool, batch_size=5)
+    try:
+        put_messages(spool, 0, 20)
+        wait_for(lambda: len(spool) == 0, sender)
+        assert sender.acked
+    finally:
+        sender.close()
+        receiver.stop()
+    assert receiver.writer.duplicates == 0
+
+
+def test_unacknowledged_messages_are_replayed(tmp_path, spool):
+    silent = SilentReceiver()
+    sender = SpoolSender("127.0.0.1", silent.port, spool, batch_size=5)
+    put_messages(spool, 0, 20)
+    wait_for(lambda: silent.received == 4, sender)
+    # sendall 成功但接收端没有确认，消息都留在队列中
+    assert len(spool) == 20
+    sender.close()
+
+    receiver = Receiver(tmp_path / "data")
+    sender = SpoolSender("127.0.0.1", receiver.port, spool, batch_size=5)
+    try:
+        wait_for(lambda: len(spool) == 0, sender)
+    finally:
+        sender.close()
+        receiver.stop()
+    assert receiver.writer.duplicates == 0
+
+
+def test_receiver_without_acknowledgements_keeps_resend_messages(spool):
+    silent = SilentReceiver(ack=False)
+    sender = SpoolSender("127.0.0.1", silent.port, spool, batch_size=5, resend=3)
+    put_messages(spool, 0, 20)
+    wait_for(lambda: silent.received == 4, sender)
+    sender.close()
+    assert not sender.acked
+    assert len(spool) == 3